@@ -1,269 +1,1961 @@
 #!/usr/bin/env python3
-"""Builds supabase migration SQL for kpi_monthly_actual + backfill + sync."""
+"""Builds supabase migration SQL for kpi_monthly_actual + kpi_monthly_series + backfill + sync."""
 # noqa: long strings intentional
+import argparse
+import re
+import sys
+import textwrap
+from dataclasses import astuple, dataclass
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
-def main():
+
+@dataclass(frozen=True)
+class Kpi:
+    """One auto KPI: SELECT expression over a source, evaluated per period.
+
+    With ``time_col`` the KPI is a flow: rows are taken from [m_start, m_end) of that
+    column, so a month series is one ``date_trunc('month', time_col)`` grouped scan.
+    Without it ``where`` describes the state at month end (it may reference
+    ``m_start``/``m_end`` directly) and the series joins the source once against the
+    month list. ``value`` must yield 0 over an empty set; empty months are filled with 0.
+    """
+
+    kid: str
+    value: str
+    src: str
+    where: str = ""
+    time_col: Optional[str] = None
+    date_window: bool = False
+
+    def window(self, lo: str, hi: str) -> str:
+        cast = "::date" if self.date_window else ""
+        return f"{self.time_col} >= {lo}{cast} AND {self.time_col} < {hi}{cast}"
+
+    def conditions(self, *extra: str) -> str:
+        return " AND ".join(c for c in (self.where, *extra) if c)
+
+    @property
+    def kind(self) -> str:
+        return "flow" if self.time_col else "snapshot"
+
+    @property
+    def plain(self) -> bool:
+        """Single table (optionally aliased): the only sources we derive indexes for."""
+        return re.fullmatch(r"\w+(\s+\w+)?", self.src.strip()) is not None
+
+    def unaliased(self, sql: str) -> str:
+        parts = self.src.split()
+        return re.sub(rf"\b{parts[1]}\.", "", sql) if len(parts) == 2 else sql
+
+    @property
+    def filters(self) -> List[str]:
+        """Conjuncts of ``where`` that do not depend on the period (usable as index predicates)."""
+        return [c for c in conjuncts(self.where) if not PERIOD_RE.search(c)]
+
+    @property
+    def sweep(self) -> Optional[Tuple[str, Optional[str]]]:
+        """(open, close) columns when this is a month-end open COUNT.
+
+        That is ``open < m_end [AND (close IS NULL OR close >= m_end)]`` plus static
+        filters. Such a KPI is a running sum of +1/-1 month events.
+        """
+        if self.time_col or self.value != "COUNT(*)::numeric" or self.src.startswith("("):
+            return None
+        opened = closed = None
+        for c in conjuncts(self.where):
+            if not PERIOD_RE.search(c):
+                continue
+            m = re.fullmatch(r"([\w.]+) < m_end(?:::date)?", c)
+            n = re.fullmatch(r"\(([\w.]+) IS NULL OR \1 >= m_end(?:::date)?\)", c)
+            if m and not opened:
+                opened = m.group(1)
+            elif n and not closed:
+                closed = n.group(1)
+            else:
+                return None
+        return (opened, closed) if opened else None
+
+    @property
+    def index_key(self) -> Optional[str]:
+        """Column (or expression) the period bound is applied to."""
+        if self.time_col:
+            return self.unaliased(self.time_col)
+        for c in conjuncts(self.where):
+            m = re.fullmatch(r"([\w.]+) < m_end", c)
+            if m:
+                return self.unaliased(m.group(1))
+        return None
+
+    @property
+    def table(self) -> str:
+        """Base table read by the KPI (the inner table for subquery sources)."""
+        m = re.match(r"\(\s*SELECT\b.*?\bFROM\s+(\w+)", self.src, re.S)
+        return m.group(1) if m else self.src.split()[0]
+
+    @property
+    def definition(self) -> tuple:
+        """Everything but the id, whitespace-normalised: equal definitions compute equal values."""
+        return tuple(" ".join(f.split()) if isinstance(f, str) else f for f in astuple(self)[1:])
+
+    @property
+    def source_key(self) -> str:
+        """Table name for plain sources; joins and subqueries are grouped on their own."""
+        if self.src.startswith("(") or re.search(r"\bJOIN\b", self.src):
+            return self.src
+        return self.src.split()[0]
+
+
+PERIOD_RE = re.compile(r"\b(?:m_start|m_end|now\(\)|CURRENT_DATE|CURRENT_TIMESTAMP)", re.I)
+
+
+def conjuncts(cond: str) -> List[str]:
+    """Top-level AND terms of cond (parentheses and string literals respected)."""
+    out: List[str] = []
+    depth = start = i = 0
+    while i < len(cond):
+        c = cond[i]
+        if c == "'":
+            i = cond.index("'", i + 1)
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif depth == 0 and re.match(r"\sAND\s", cond[i:i + 5], re.I):
+            out.append(cond[start:i])
+            start = i = i + 4
+            continue
+        i += 1
+    out.append(cond[start:])
+    return [" ".join(c.split()) for c in out if c.strip()]
+
+
+def count_(src: str, where: str = "", **kw) -> dict:
+    return dict(value="COUNT(*)::numeric", src=src, where=where, **kw)
+
+
+def rate_(src: str, ok: str, where: str = "", **kw) -> dict:
+    value = f"""CASE WHEN COUNT(*) = 0 THEN 0 ELSE ROUND(
+      COUNT(*) FILTER (WHERE {ok})::numeric / COUNT(*)::numeric * 100, 2) END"""
+    return dict(value=value, src=src, where=where, **kw)
+
+
+
+@dataclass(frozen=True)
+class Latest:
+    """Latest row per entity of a raw table (a maintained ``DISTINCT ON``), kept current by triggers.
+
+    Without ``asof`` it holds one row per ``key``: the first under ``ORDER BY order``. With
+    ``asof`` it is a history: one row per (``key``, ``asof`` value) holding the row that was
+    latest among those with ``asof`` up to that point, valid over [``valid_from``,
+    ``valid_to``) until the entity's next entry ('infinity' for the current one).
+    """
+
+    table: str
+    key: str
+    order: str
+    cols: Tuple[str, ...]
+    asof: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return f"kpi_latest_{self.table}"
+
+    @property
+    def columns(self) -> List[str]:
+        return [self.key] + (["valid_from", "valid_to"] if self.asof else []) + list(self.cols)
+
+    @property
+    def indexes(self) -> List[Tuple[str, str, bool]]:
+        """(name, columns, unique) of the table's indexes."""
+        if not self.asof:
+            return [(f"{self.name}_key", self.key, True)]
+        # Geçmişli tabloda dönem sonu araması valid_to üzerinden aralık taramasıdır.
+        return [(f"{self.name}_key", f"{self.key}, valid_from", True), (f"{self.name}_valid_to", "valid_to", False)]
+
+    @property
+    def title(self) -> str:
+        kind = f"{self.asof} geçmişli" if self.asof else "anlık"
+        return f"Son satır tablosu: {self.table} içinde {self.key} başına en güncel kayıt ({kind})"
+
+    def as_of(self, alias: str, at: str) -> str:
+        """Condition picking the entry of `alias` that was current just before `at`."""
+        return f"{alias}.valid_from < {at} AND {alias}.valid_to >= {at}"
+
+    def rows(self, keys: str = "") -> str:
+        """SELECT producing the table's rows (only entities in the `keys` subquery, if given)."""
+        only = f" AND {self.key} IN ({keys})" if keys else ""
+        if not self.asof:
+            return f"""SELECT DISTINCT ON ({self.key}) {", ".join(self.columns)}
+    FROM public.{self.table}
+    WHERE {self.key} IS NOT NULL{only}
+    ORDER BY {self.key}, {self.order}"""
+        cols = ", ".join(f"w.{c}" for c in self.cols)
+        return f"""SELECT t.{self.key}, t.{self.asof} AS valid_from,
+      COALESCE(lead(t.{self.asof}) OVER (PARTITION BY t.{self.key} ORDER BY t.{self.asof}), 'infinity') AS valid_to, {cols}
+    FROM (
+      SELECT DISTINCT {self.key}, {self.asof} FROM public.{self.table}
+      WHERE {self.key} IS NOT NULL AND {self.asof} IS NOT NULL{only}
+    ) t
+    CROSS JOIN LATERAL (
+      SELECT {", ".join(self.cols)} FROM public.{self.table} x
+      WHERE x.{self.key} = t.{self.key} AND x.{self.asof} <= t.{self.asof}
+      ORDER BY {self.order} LIMIT 1
+    ) w"""
+
+
+@dataclass(frozen=True)
+class EventPairs:
+    """Start/end event pairs per ``key`` of an event table, kept current by triggers.
+
+    One row per (``start`` event, ``end`` event) of the same key, with both timestamps and
+    the duration between them, so KPIs read the pairs instead of self-joining the events.
+    """
+
+    name: str
+    table: str
+    key: str
+    type_col: str
+    start: str
+    end: str
+    time_col: str
+
+    @property
+    def columns(self) -> List[str]:
+        return [self.key, "start_event_id", "end_event_id", "started_at", "ended_at", "duration"]
+
+    @property
+    def indexes(self) -> List[Tuple[str, str, bool]]:
+        return [(f"{self.name}_key", "start_event_id, end_event_id", True), (f"{self.name}_{self.key}", self.key, False)]
+
+    @property
+    def title(self) -> str:
+        return f"Olay çiftleri: {self.table} içinde {self.key} başına {self.start} -> {self.end} süreleri"
+
+    def rows(self, keys: str = "") -> str:
+        """SELECT producing the table's rows (only keys in the `keys` subquery, if given)."""
+        only = f" AND s.{self.key} IN ({keys})" if keys else ""
+        return f"""SELECT s.{self.key}, s.id AS start_event_id, e.id AS end_event_id,
+      s.{self.time_col} AS started_at, e.{self.time_col} AS ended_at, e.{self.time_col} - s.{self.time_col} AS duration
+    FROM public.{self.table} s
+    JOIN public.{self.table} e ON e.{self.key} = s.{self.key} AND e.{self.type_col} = '{self.end}'
+    WHERE s.{self.type_col} = '{self.start}'{only}"""
+
+
+# Ekipman başına son kalibrasyon (anlık) ve tedarikçi başına dönem sonu geçerli puan (geçmişli).
+LATEST_CALIBRATION = Latest("equipment_calibrations", "equipment_id",
+                            "calibration_date DESC NULLS LAST, created_at DESC NULLS LAST",
+                            ("next_calibration_date", "is_active"))
+LATEST_SUPPLIER_SCORE = Latest("supplier_scores", "supplier_id", "period DESC NULLS LAST, created_at DESC",
+                               ("final_score",), asof="created_at")
+LATEST: List[Latest] = [LATEST_CALIBRATION, LATEST_SUPPLIER_SCORE]
+CONTROL_DURATIONS = EventPairs("inspection_control_durations", "vehicle_timeline_events", "inspection_id",
+                               "event_type", "control_start", "control_end", "event_timestamp")
+# Tetikleyicilerle anahtar bazında yeniden hesaplanan tablolar.
+MAINTAINED: List[Union[Latest, EventPairs]] = [*LATEST, CONTROL_DURATIONS]
+
+# Girdi kalite oranları (ay içi)
+same_incoming = dict(
+    value="""CASE WHEN COALESCE(SUM(quantity_received),0) = 0 THEN 0
+      ELSE ROUND(COALESCE(SUM(quantity_rejected),0)::numeric / NULLIF(SUM(quantity_received),0) * 100, 2) END""",
+    src="incoming_inspections",
+    time_col="inspection_date",
+)
+same_process_inkr = count_("process_inkr_reports", time_col="created_at")
+same_open_complaints = count_("customer_complaints cc", """cc.created_at < m_end AND cc.status NOT IN ('Kapatıldı', 'Çözüldü', 'İptal')
+        AND (cc.actual_close_date IS NULL OR cc.actual_close_date >= m_end::date)""")
+same_completed_audits = count_("audits", "status = 'Tamamlandı'", time_col="COALESCE(updated_at, created_at)")
+same_quality_cost = dict(value="COALESCE(SUM(amount), 0)::numeric", src="quality_costs", time_col="cost_date", date_window=True)
+
+KPIS: List[Kpi] = [
+    Kpi("incoming_rejection_rate", **same_incoming),
+    Kpi("supplier_nc_rate", **same_incoming),
+
+    # DF/8D — açık anlık (ay sonu)
+    Kpi("open_non_conformities_count", **count_("non_conformities nc", """nc.created_at < m_end AND nc.status NOT IN ('Kapatıldı', 'Reddedildi')
+        AND (nc.closed_at IS NULL OR nc.closed_at >= m_end)""")),
+    Kpi("open_8d_count", **count_("non_conformities nc", """nc.type = '8D' AND nc.created_at < m_end AND nc.status <> 'Kapatıldı'
+        AND (nc.closed_at IS NULL OR nc.closed_at >= m_end)""")),
+    Kpi("df_closure_rate", """CASE WHEN COUNT(*) FILTER (WHERE nc.type = 'DF' AND nc.status != 'Reddedildi') = 0 THEN 0
+      ELSE ROUND(COUNT(*) FILTER (WHERE nc.type = 'DF' AND nc.status = 'Kapatıldı')::numeric
+        / NULLIF(COUNT(*) FILTER (WHERE nc.type = 'DF' AND nc.status != 'Reddedildi'), 0) * 100, 2) END""",
+        "non_conformities nc", time_col="nc.created_at"),
+    Kpi("avg_quality_nc_closure_time", "COALESCE(ROUND(AVG(EXTRACT(EPOCH FROM (nc.closed_at - nc.created_at)) / 86400)::numeric, 1), 0)",
+        "non_conformities nc", """nc.department = 'Kalite' AND nc.status = 'Kapatıldı'
+        AND nc.closed_at IS NOT NULL AND nc.created_at IS NOT NULL""", time_col="nc.closed_at"),
+
+    # Uygunsuzluk modülü
+    Kpi("open_nonconformity_count", **count_("nonconformity_records nr", """nr.created_at < m_end
+        AND NOT (nr.status = 'Kapatıldı' AND COALESCE(nr.updated_at, nr.created_at) < m_end)
+        AND NOT (nr.status IN ('DF Açıldı','8D Açıldı') AND nr.source_nc_id IS NOT NULL)""")),
+    Kpi("nonconformity_30d_count", **count_("nonconformity_records", time_col="created_at")),
+    Kpi("nonconformity_closure_rate", **rate_("nonconformity_records", "status = 'Kapatıldı'", time_col="created_at")),
+    Kpi("critical_nonconformity_count", **count_("nonconformity_records", "severity = 'Kritik'", time_col="created_at")),
+    Kpi("nonconformity_df_8d_conversion_rate", **rate_("nonconformity_records", "status IN ('DF Açıldı','8D Açıldı')", time_col="created_at")),
+
+    Kpi("quarantine_count", **count_("quarantine_records qr", "qr.status = 'Karantinada' AND qr.created_at < m_end")),
+
+    Kpi("produced_vehicles_count", **count_("produced_vehicles pv", time_col="pv.created_at")),
+
+    Kpi("quality_inspection_pass_rate", **rate_("quality_inspections qi", "qi.status = 'Onaylandı'", time_col="qi.quality_entry_at")),
+    Kpi("avg_quality_process_time", "COALESCE(ROUND(AVG(EXTRACT(EPOCH FROM (COALESCE(qi.shipped_at, qi.updated_at) - qi.quality_entry_at)) / 86400)::numeric, 2), 0)",
+        "quality_inspections qi", "qi.quality_entry_at IS NOT NULL", time_col="qi.quality_entry_at"),
+    Kpi("avg_quality_inspection_time", "COALESCE(ROUND(AVG(EXTRACT(EPOCH FROM d.duration) / 86400)::numeric, 2), 0)",
+        f"{CONTROL_DURATIONS.name} d", time_col="d.started_at"),
+
+    Kpi("process_inkr_30d_count", **same_process_inkr),
+    Kpi("process_inkr_total_count", **same_process_inkr),
+
+    Kpi("leak_test_30d_count", **count_("leak_test_records", time_col="created_at")),
+    Kpi("leak_test_rejection_30d_count", **count_("leak_test_records", "test_result = 'Red'", time_col="created_at")),
+    Kpi("leak_test_pass_rate", **rate_("leak_test_records", "test_result = 'Kabul'", time_col="created_at")),
+
+    Kpi("open_supplier_nc_count", **count_("supplier_non_conformities snc",
+        "snc.created_at < m_end AND snc.status <> 'Kapatıldı' AND (snc.closed_at IS NULL OR snc.closed_at >= m_end)")),
+
+    Kpi("active_suppliers_count", **count_("suppliers s", "s.status = 'Onaylı' AND s.created_at < m_end")),
+
+    Kpi("avg_supplier_score", "COALESCE(ROUND(AVG(l.final_score)::numeric, 2), 0)",
+        f"{LATEST_SUPPLIER_SCORE.name} l JOIN suppliers s ON s.id = l.supplier_id",
+        f"s.status = 'Onaylı' AND {LATEST_SUPPLIER_SCORE.as_of('l', 'm_end')}"),
+
+    # SPC / MPC / validation / FMEA / APQP / PPAP / run-at-rate / DMAIC
+    Kpi("active_spc_characteristics_count", **count_("spc_characteristics", "is_active = true AND created_at < m_end")),
+    Kpi("out_of_control_processes_count", "COUNT(DISTINCT characteristic_id)::numeric", "spc_control_charts",
+        "is_in_control = false AND period_end >= m_start AND period_start < m_end"),
+    Kpi("capable_processes_rate", **rate_("spc_capability_studies", "cp >= 1.33 AND cpk >= 1.33", time_col="created_at")),
+    Kpi("msa_studies_count", **count_("spc_msa_studies", time_col="created_at")),
+    Kpi("active_production_plans_count", **count_("production_plans", "status IN ('Planned', 'In Progress') AND created_at < m_end")),
+    Kpi("critical_characteristics_count", **count_("critical_characteristics", "is_active = true AND created_at < m_end")),
+    Kpi("process_parameter_records_count", **count_("process_parameter_records", time_col="record_date", date_window=True)),
+    Kpi("active_validation_plans_count", **count_("validation_plans", "status IN ('Planned', 'In Progress') AND created_at < m_end")),
+    Kpi("completed_validations_rate", **rate_("validation_plans", "status = 'Completed'", time_col="created_at")),
+    Kpi("active_fmea_projects_count", **count_("fmea_projects", "status IN ('Active', 'In Review', 'Draft') AND created_at < m_end")),
+    Kpi("high_rpn_count", **count_("fmea_causes_controls", "rpn > 100", time_col="created_at")),
+    Kpi("completed_fmea_actions_rate", **rate_("fmea_action_plans", "status = 'Completed'", time_col="created_at")),
+    Kpi("active_apqp_projects_count", **count_("apqp_projects", "status NOT IN ('Approved', 'Rejected', 'Completed') AND created_at < m_end")),
+    Kpi("pending_ppap_approvals_count", **count_("ppap_submissions", "submission_status IN ('Submitted', 'Draft') AND created_at < m_end")),
+    Kpi("run_at_rate_completion_rate", **rate_("run_at_rate_studies", "status = 'Completed'", time_col="created_at")),
+    Kpi("active_dmaic_projects_count", **count_("dmaic_projects", "overall_status != 'Completed' AND created_at < m_end")),
+    Kpi("completed_dmaic_projects_count", **count_("dmaic_projects", "overall_status = 'Completed'", time_col="updated_at")),
+    Kpi("dmaic_success_rate", **rate_("dmaic_projects", "overall_status = 'Completed'", time_col="created_at")),
+
+    Kpi("open_customer_complaints_count", **same_open_complaints),
+    Kpi("after_sales_open_count", **same_open_complaints),
+    Kpi("after_sales_30d_count", **count_("customer_complaints", time_col="created_at")),
+
+    Kpi("sla_compliant_complaints_rate", """CASE WHEN COUNT(*) FILTER (WHERE status IN ('Kapalı','Çözüldü')) = 0 THEN 0 ELSE ROUND(
+      COUNT(*) FILTER (WHERE status IN ('Kapalı','Çözüldü') AND actual_close_date IS NOT NULL AND target_close_date IS NOT NULL AND actual_close_date <= target_close_date)::numeric
+      / NULLIF(COUNT(*) FILTER (WHERE status IN ('Kapalı','Çözüldü')), 0) * 100, 2) END""",
+        "customer_complaints", time_col="updated_at"),
+
+    Kpi("avg_complaint_resolution_time", "COALESCE(ROUND(AVG(EXTRACT(EPOCH FROM (actual_close_date - complaint_date)) / 86400)::numeric, 2), 0)",
+        "customer_complaints", "status IN ('Kapalı', 'Çözüldü') AND actual_close_date IS NOT NULL AND complaint_date IS NOT NULL",
+        time_col="actual_close_date"),
+
+    Kpi("expired_document_count", **count_("documents d", "d.valid_until IS NOT NULL", time_col="d.valid_until", date_window=True)),
+
+    Kpi("completed_internal_audits_30d_count", **same_completed_audits),
+    Kpi("open_internal_audit_count", **same_completed_audits),
+
+    Kpi("open_deviation_count", **count_("deviations d", "d.created_at < m_end AND d.status NOT IN ('Tamamlandı', 'Reddedildi')")),
+
+    Kpi("calibration_due_count", "COUNT(*)::numeric", f"{LATEST_CALIBRATION.name} l JOIN equipments e ON e.id = l.equipment_id",
+        """e.status IS DISTINCT FROM 'Hurdaya Ayrıldı' AND (l.is_active IS NULL OR l.is_active = true)
+        AND l.next_calibration_date IS NOT NULL AND l.next_calibration_date < m_end::date"""),
+
+    Kpi("active_fixture_count", **count_("fixtures", "status = 'Aktif' AND created_at < m_end")),
+    Kpi("total_fixture_count", **count_("fixtures", "created_at < m_end")),
+    Kpi("fixture_nonconformity_count", **count_("fixture_nonconformities fn",
+        "fn.created_at < m_end AND (fn.correction_status IS NULL OR fn.correction_status != 'Düzeltildi')")),
+
+    Kpi("active_wps_procedures_count", **count_("wps_procedures", "status = 'Active' AND created_at < m_end")),
+    Kpi("pending_wps_approvals_count", **count_("wps_procedures", "status = 'Pending Approval' AND created_at < m_end")),
+
+    Kpi("planned_trainings_count", **count_("trainings", time_col="created_at")),
+    Kpi("completed_trainings_count", **count_("trainings", "status IN ('Tamamlandı', 'Tamamlandi', 'Completed')", time_col="updated_at")),
+    Kpi("training_participation_rate", **rate_("training_participants tp JOIN trainings tr ON tr.id = tp.training_id",
+        "tp.status = 'Tamamlandı'", time_col="tr.created_at")),
+
+    Kpi("avg_polyvalence_score", "COALESCE(ROUND(AVG(ps.current_level)::numeric, 2), 0)", "personnel_skills ps", "ps.updated_at < m_end"),
+    Kpi("critical_skill_gaps_count", **count_("personnel_skills ps JOIN skills s ON ps.skill_id = s.id",
+        "s.is_critical = true AND ps.current_level < s.target_level AND ps.updated_at < m_end")),
+    Kpi("expired_certifications_count", **count_("personnel_skills",
+        "is_certified = true AND certification_expiry_date IS NOT NULL AND certification_expiry_date < m_end::date")),
+
+    Kpi("active_kaizen_count", **count_("kaizen_entries", "status NOT IN ('Kapandı', 'Reddedildi') AND created_at < m_end")),
+    Kpi("completed_kaizen_count", **count_("kaizen_entries", "status = 'Kapandı'", time_col="updated_at")),
+    Kpi("kaizen_success_rate", """CASE WHEN COUNT(*) FILTER (WHERE status NOT IN ('Reddedildi', 'Askıda')) = 0 THEN 0 ELSE ROUND(
+      COUNT(*) FILTER (WHERE status = 'Kapandı')::numeric / NULLIF(COUNT(*) FILTER (WHERE status NOT IN ('Reddedildi', 'Askıda')), 0) * 100, 2) END""",
+        "kaizen_entries", time_col="created_at"),
+
+    Kpi("active_benchmarks_count", **count_("benchmarks", "status NOT IN ('Completed', 'Cancelled', 'Tamamlandı', 'İptal') AND created_at < m_end")),
+    Kpi("completed_benchmarks_count", **count_("benchmarks", "status IN ('Completed', 'Tamamlandı')", time_col="updated_at")),
+
+    Kpi("open_tasks_count", **count_("tasks t", "t.created_at < m_end AND t.status NOT IN ('Completed', 'Cancelled', 'Tamamlandı', 'İptal')")),
+    Kpi("overdue_tasks_count", **count_("tasks t",
+        "t.status NOT IN ('Completed', 'Cancelled', 'Tamamlandı', 'İptal') AND t.due_date IS NOT NULL AND t.due_date < LEAST(m_end::date, CURRENT_DATE) AND t.created_at < m_end")),
+    Kpi("task_completion_rate", **rate_("tasks", "status IN ('Completed', 'Tamamlandı')", time_col="created_at")),
+    Kpi("completed_tasks_30d_count", **count_("tasks", "status IN ('Tamamlandı', 'Completed')", time_col="updated_at")),
+
+    Kpi("nps_score", """CASE WHEN COUNT(*) = 0 THEN 0 ELSE ROUND(((COUNT(*) FILTER (WHERE nps_score >= 9)::numeric / COUNT(*))
+      - (COUNT(*) FILTER (WHERE nps_score <= 6)::numeric / COUNT(*))) * 100, 2) END""",
+        "customer_satisfaction_surveys", time_col="created_at"),
+    Kpi("satisfaction_surveys_count", **count_("customer_satisfaction_surveys", time_col="created_at")),
+    Kpi("avg_customer_satisfaction_score", "COALESCE(ROUND(AVG(overall_score)::numeric, 2), 0)", "customer_satisfaction_surveys", time_col="created_at"),
+
+    Kpi("active_supplier_development_plans_count", **count_("supplier_development_plans",
+        "current_status NOT IN ('Completed', 'Cancelled', 'Tamamlandı', 'İptal') AND created_at < m_end")),
+    Kpi("completed_supplier_development_plans_count", **count_("supplier_development_plans",
+        "current_status IN ('Completed', 'Tamamlandı')", time_col="updated_at")),
+
+    Kpi("non_quality_cost", **same_quality_cost),
+    Kpi("total_quality_cost", **same_quality_cost),
+]
+
+
+@dataclass(frozen=True)
+class Rollup:
+    """Daily rollup of a raw table, kept current by statement-level triggers.
+
+    One row per (UTC day of ``time_col``, ``dims``) holding the row count ``n_rows`` and the
+    totals of ``sums`` (stored under the raw column names). The listed flow KPIs read it
+    instead of the raw table; their filters may only use ``dims``.
+    """
+
+    table: str
+    time_col: str
+    kids: Tuple[str, ...]
+    dims: Tuple[Tuple[str, str], ...] = ()
+    sums: Tuple[str, ...] = ()
+    date_col: bool = False
+
+    @property
+    def name(self) -> str:
+        return f"kpi_daily_{self.table}"
+
+    @property
+    def columns(self) -> List[str]:
+        return [d for d, _ in self.dims] + list(self.sums)
+
+    def day(self, ts: str) -> str:
+        return ts if self.date_col else f"({ts} AT TIME ZONE 'UTC')::date"
+
+
+ROLLUPS: List[Rollup] = [
+    Rollup("leak_test_records", "created_at",
+           ("leak_test_30d_count", "leak_test_rejection_30d_count", "leak_test_pass_rate"),
+           dims=(("test_result", "text"),)),
+    Rollup("produced_vehicles", "created_at", ("produced_vehicles_count",)),
+    Rollup("nonconformity_records", "created_at",
+           ("nonconformity_30d_count", "nonconformity_closure_rate", "critical_nonconformity_count",
+            "nonconformity_df_8d_conversion_rate"),
+           dims=(("status", "text"), ("severity", "text"))),
+    Rollup("quality_costs", "cost_date", ("non_quality_cost",), sums=("amount",), date_col=True),
+    Rollup("customer_complaints", "created_at", ("after_sales_30d_count",)),
+    Rollup("process_inkr_reports", "created_at", ("process_inkr_30d_count",)),
+    Rollup("audits", "COALESCE(updated_at, created_at)", ("completed_internal_audits_30d_count",),
+           dims=(("status", "text"),)),
+]
+
+
+def rollup_of() -> Dict[str, Rollup]:
+    """Canonical auto_kpi_id -> the rollup it reads."""
+    canon = canonical_of()
+    out = {}
+    for r in ROLLUPS:
+        for kid in r.kids:
+            k = canon[kid]
+            if not (k.time_col and k.table == r.table and k.unaliased(k.time_col) == r.time_col
+                    and k.date_window == r.date_col):
+                raise ValueError(f"{kid}: not a {r.time_col} flow KPI of {r.table}")
+            out[k.kid] = r
+    return out
+
+
+def where_clause(cond: str) -> str:
+    return f"\n      WHERE {cond}" if cond else ""
+
+
+def kpi_query(k: Kpi, into: str = "") -> str:
+    """Single-period query; m_start/m_end are the caller's period bounds."""
+    r = rollup_of().get(k.kid)
+    if r:
+        return rollup_query(k, r, "m_start", "m_end")
+    window = k.window("m_start", "m_end") if k.time_col else ""
+    return f"""SELECT {k.value}{into}
+      FROM {k.src}{where_clause(k.conditions(window))}"""
+
+
+def series_query(k: Kpi) -> str:
+    """All months of kpi_months(p_from, p_to) from one scan of the source."""
+    if k.sweep:
+        return sweep_rows(k.src, [k], "p_from", "p_to")
+    r = rollup_of().get(k.kid)
+    if r:
+        # Günlük özet: ay başına gün sayısı kadar satır okunur.
+        return f"""SELECT months.m_start, g.v
+    FROM kpi_months(p_from, p_to) months
+    CROSS JOIN LATERAL (
+      {rollup_query(k, r, "months.m_start", "months.m_end")}
+    ) g(v)"""
+    if k.time_col:
+        grouped = f"""SELECT date_trunc('month', {k.time_col}) AS m, {k.value} AS v
+      FROM {k.src}
+      WHERE {k.conditions(k.window("date_trunc('month', p_from)", "(date_trunc('month', p_to) + interval '1 month')"))}
+      GROUP BY 1"""
+    else:
+        # Ay sonu anlık: kaynak ay listesiyle bir kez birleştirilir; where içindeki m_end ayın sınırıdır.
+        join = "CROSS JOIN LATERAL" if k.src.startswith("(") else "CROSS JOIN"
+        grouped = f"""SELECT mo.m_start AS m, {k.value} AS v
+      FROM kpi_months(p_from, p_to) mo {join} {k.src}{where_clause(k.conditions())}
+      GROUP BY 1"""
+    return f"""SELECT months.m_start, COALESCE(g.v, 0)
+    FROM kpi_months(p_from, p_to) months
+    LEFT JOIN (
+      {grouped}
+    ) g ON g.m = months.m_start"""
+
+
+def sweep_rows(src: str, ks: List[Kpi], lo: str, hi: str) -> str:
+    """Month-end open counts of sweep KPIs for every month of kpi_months(lo, hi) in one pass.
+
+    Each row adds +1 in the month of its open column and -1 in the month of its close
+    column (never before the open month). A running sum over the months gives the
+    number of rows open at each m_end. Events before ``lo`` are folded into its month.
+    """
+    pairs: Dict[Tuple[str, Optional[str]], int] = {}
+    for k in ks:
+        pairs.setdefault(k.sweep, len(pairs))
+    events = []
+    for (opened, closed), j in pairs.items():
+        events.append(f"({j}, date_trunc('month', {opened}), 1)")
+        if closed:
+            events.append(f"""({j}, CASE WHEN {opened} IS NOT NULL AND {closed} IS NOT NULL
+              THEN date_trunc('month', GREATEST({opened}, {closed})) END, -1)""")
+    filters = [" AND ".join(k.filters) for k in ks]
+    cols = ",\n".join(
+        f"          SUM(x.d) FILTER (WHERE {' AND '.join([f'x.p = {pairs[k.sweep]}'] + ([f'({f})'] if f else []))}) AS c{i}"
+        for i, (k, f) in enumerate(zip(ks, filters)))
+    pre = "" if not all(filters) else "\n          AND (" + " OR ".join(f"({f})" for f in dict.fromkeys(filters)) + ")"
+    running = ", ".join(f"SUM(COALESCE(e.c{i}, 0)) OVER w AS c{i}" for i in range(len(ks)))
+    return f"""SELECT months.m_start, {running}
+      FROM kpi_months({lo}, {hi}) months
+      LEFT JOIN (
+        SELECT GREATEST(x.m, date_trunc('month', {lo})) AS m,
+{cols}
+          FROM {src}
+          CROSS JOIN LATERAL (VALUES
+            {(","+chr(10)+"            ").join(events)}
+          ) x(p, m, d)
+          WHERE x.m < date_trunc('month', {hi}) + interval '1 month'{pre}
+          GROUP BY 1
+      ) e ON e.m = months.m_start
+      WINDOW w AS (ORDER BY months.m_start)"""
+
+
+AGG_RE = re.compile(r"\b(?:COUNT|SUM|AVG|MIN|MAX)\(")
+FILTER_RE = re.compile(r"\s*FILTER\s*(\()\s*WHERE\s+")
+
+
+def after_close(s: str, i: int) -> int:
+    """Index just past the ')' closing the '(' that ends at s[i - 1]."""
+    depth = 1
+    while depth:
+        c = s[i]
+        if c == "'":
+            i = s.index("'", i + 1)
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        i += 1
+    return i
+
+
+def with_filter(expr: str, cond: str) -> str:
+    """Restricts every aggregate call in expr to rows matching cond (FILTER clauses are merged)."""
+    if not cond:
+        return expr
+    out: List[str] = []
+    pos = 0
+    for m in AGG_RE.finditer(expr):
+        if m.start() < pos:
+            continue
+        end = after_close(expr, m.end())
+        out.append(expr[pos:end])
+        f = FILTER_RE.match(expr, end)
+        if f:
+            close = after_close(expr, f.start(1) + 1)
+            out.append(f" FILTER (WHERE ({cond}) AND ({expr[f.end():close - 1].strip()}))")
+            pos = close
+        else:
+            out.append(f" FILTER (WHERE {cond})")
+            pos = end
+    out.append(expr[pos:])
+    return "".join(out)
+
+
+def count_to_sum(expr: str) -> str:
+    """COUNT(*) [FILTER (...)] -> COALESCE(SUM(n_rows) [FILTER (...)], 0) for rollup rows."""
+    out: List[str] = []
+    pos = 0
+    for m in re.finditer(r"COUNT\(\*\)", expr):
+        end = m.end()
+        f = FILTER_RE.match(expr, end)
+        if f:
+            end = after_close(expr, f.start(1) + 1)
+        out.append(f"{expr[pos:m.start()]}COALESCE(SUM(n_rows){expr[m.end():end]}, 0)")
+        pos = end
+    out.append(expr[pos:])
+    return "".join(out)
+
+
+def rollup_rows(r: Rollup, lo: str, hi: str) -> str:
+    """Rows of [lo, hi) as (dims, sums, n_rows): whole UTC days from the rollup, partial edge days raw."""
+    cols = "".join(f"{c}, " for c in r.columns)
+    if r.date_col:
+        return f"""SELECT {cols}n_rows FROM {r.name}
+        WHERE day >= {lo}::date AND day < {hi}::date"""
+    first = f"(({lo}) AT TIME ZONE 'UTC' + interval '1 day' - interval '1 microsecond')::date"
+    last = r.day(f"({hi})")
+    raw = ", ".join(r.columns + ["1"])
+    t = r.time_col
+    return f"""SELECT {cols}n_rows FROM {r.name}
+        WHERE day >= {first} AND day < {last}
+        UNION ALL
+        SELECT {raw} FROM {r.table}
+        WHERE ({t} >= {lo} AND {t} < LEAST({hi}, {first}::timestamp AT TIME ZONE 'UTC'))
+           OR ({t} >= GREATEST({lo}, {last}::timestamp AT TIME ZONE 'UTC', {first}::timestamp AT TIME ZONE 'UTC') AND {t} < {hi})"""
+
+
+def rollup_value(k: Kpi) -> str:
+    return count_to_sum(k.unaliased(k.value))
+
+
+def rollup_query(k: Kpi, r: Rollup, lo: str, hi: str) -> str:
+    return f"""SELECT {rollup_value(k)}
+      FROM (
+        {rollup_rows(r, lo, hi)}
+      ) u{where_clause(k.unaliased(k.where))}"""
+
+
+def split_aggregates(expr: str) -> Tuple[List[str], List[str]]:
+    """(text, calls): expr == text[0] + calls[0] + text[1] + ... + text[-1]; calls keep their FILTER."""
+    text: List[str] = []
+    calls: List[str] = []
+    pos = 0
+    for m in AGG_RE.finditer(expr):
+        if m.start() < pos:
+            continue
+        end = after_close(expr, m.end())
+        f = FILTER_RE.match(expr, end)
+        if f:
+            end = after_close(expr, f.start(1) + 1)
+        text.append(expr[pos:m.start()])
+        calls.append(expr[m.start():end])
+        pos = end
+    text.append(expr[pos:])
+    return text, calls
+
+
+def daily_terms(k: Kpi) -> Optional[Tuple[List[str], List[str]]]:
+    """Rollup value of `k` split into additive SUM terms, or None when a term is not a SUM
+    (then windows cannot be slid over daily totals)."""
+    text, calls = split_aggregates(with_filter(rollup_value(k), k.unaliased(k.where)))
+    if not calls or not all(c.startswith("SUM(") for c in calls):
+        return None
+    return text, calls
+
+
+def rolling_query(k: Kpi, r: Rollup) -> str:
+    """Value of the trailing p_window UTC days ending on each day of [p_from, p_to].
+
+    Daily SUM terms come from the rollup once; each window is a sliding SUM over them.
+    """
+    text, calls = daily_terms(k)
+    uniq = list(dict.fromkeys(calls))
+    terms = ",\n".join(f"        {c} AS a{i}" for i, c in enumerate(uniq))
+    slid = ", ".join(f"SUM(x.a{i}) OVER w AS a{i}" for i in range(len(uniq)))
+    value = "".join(t + (f"d.a{uniq.index(calls[i])}" if i < len(calls) else "") for i, t in enumerate(text))
+    return f"""SELECT d.day, {value}
+    FROM (
+      SELECT g.day::date AS day, {slid}
+      FROM generate_series((p_from - (p_window - 1))::timestamp, p_to::timestamp, interval '1 day') g(day)
+      LEFT JOIN (
+        SELECT day,
+{terms}
+        FROM {r.name}
+        WHERE day >= p_from - (p_window - 1) AND day <= p_to
+        GROUP BY day
+      ) x ON x.day = g.day::date
+      WINDOW w AS (ORDER BY g.day ROWS BETWEEN p_window - 1 PRECEDING AND CURRENT ROW)
+    ) d
+    WHERE d.day >= p_from"""
+
+
+def buckets_query(k: Kpi, r: Rollup) -> str:
+    """Value per day / week / month / quarter (p_grain) of [p_from, p_to], from the daily rollup."""
+    step = "kpi_grain_interval(p_grain)"
+    return f"""SELECT b.period_start::date, COALESCE(g.v, 0)
+    FROM generate_series(date_trunc(p_grain, p_from::timestamp), date_trunc(p_grain, p_to::timestamp), {step}) b(period_start)
+    LEFT JOIN (
+      SELECT date_trunc(p_grain, day::timestamp) AS b, {rollup_value(k)} AS v
+      FROM {r.name}
+      WHERE day >= date_trunc(p_grain, p_from::timestamp)
+        AND day < date_trunc(p_grain, p_to::timestamp) + {step}{"" if not k.where else chr(10) + "        AND " + k.unaliased(k.where)}
+      GROUP BY 1
+    ) g ON g.b = b.period_start"""
+
+
+def canonical_kpis() -> List[Tuple[Kpi, List[str]]]:
+    """Distinct definitions in KPIS order: (canonical KPI, all ids sharing it, canonical first)."""
+    by_def: Dict[tuple, Tuple[Kpi, List[str]]] = {}
+    for k in KPIS:
+        by_def.setdefault(k.definition, (k, []))[1].append(k.kid)
+    return list(by_def.values())
+
+
+def canonical_of() -> Dict[str, Kpi]:
+    """auto_kpi_id -> canonical KPI (itself unless it is an alias)."""
+    return {kid: k for k, kids in canonical_kpis() for kid in kids}
+
+
+def source_groups() -> List[Tuple[str, List[Tuple[Kpi, List[str]]]]]:
+    """Canonical KPIs sharing a source table, with the FROM item their expressions agree on."""
+    groups: Dict[str, List[Tuple[Kpi, List[str]]]] = {}
+    for k, kids in canonical_kpis():
+        groups.setdefault(k.source_key, []).append((k, kids))
     out = []
-    w = out.append
-    w("""-- KPI aylık gerçekleşen: tüm otomatik KPI id'leri için dönem [m_start, m_end)
--- + backfill + güncel değer senkronu (kpis.current_value)
-CREATE OR REPLACE FUNCTION public.kpi_monthly_actual(p_kid text, m_start timestamptz, m_end timestamptz)
-RETURNS numeric
+    for key, ks in groups.items():
+        aliased = {k.src for k, _ in ks if k.src != key}
+        if len(aliased) > 1:
+            raise ValueError(f"{key}: conflicting aliases {sorted(aliased)}")
+        out.append((aliased.pop() if aliased else key, ks))
+    return out
+
+
+def monthly_upsert(rows: str, group: List[Tuple[Kpi, List[str]]]) -> str:
+    """Upserts kpi_monthly_data from `rows` (m_start, c0..cN for every month); aliases share a column.
+
+    Unchanged values are not rewritten. Leaves (candidates, inserted, updated) in v_total, v_ins, v_upd.
+    """
+    values = ", ".join(f"('{kid}', g.c{i})" for i, (_, kids) in enumerate(group) for kid in kids)
+    return f"""WITH src AS (
+      SELECT k.id AS kpi_id, extract(year from r.m_start)::integer AS year, extract(month from r.m_start)::integer AS month, r.v
+      FROM (
+        SELECT g.m_start, x.kid, COALESCE(x.v, 0) AS v
+        FROM (
+        {rows}
+        ) g
+        CROSS JOIN LATERAL (VALUES {values}) x(kid, v)
+      ) r
+      JOIN kpis k ON k.is_auto = true AND k.auto_kpi_id = r.kid
+    ), up AS (
+      INSERT INTO kpi_monthly_data (kpi_id, year, month, actual_value)
+      SELECT kpi_id, year, month, v FROM src
+      ON CONFLICT (kpi_id, year, month)
+      DO UPDATE SET actual_value = EXCLUDED.actual_value, updated_at = now()
+      WHERE kpi_monthly_data.actual_value IS DISTINCT FROM EXCLUDED.actual_value
+      RETURNING (xmax = 0) AS inserted
+    )
+    SELECT (SELECT count(*) FROM src), count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+    INTO v_total, v_ins, v_upd
+    FROM up"""
+
+
+def backfill_insert(src: str, group: List[Tuple[Kpi, List[str]]]) -> str:
+    """One INSERT for all KPIs of a source over kpi_months(v_from, v_to): one scan, FILTER aggregates.
+
+    Each canonical definition is one column; its aliases read the same column.
+    """
+    ks = [k for k, _ in group]
+    cols = ",\n".join(
+        f"          {with_filter(k.value, k.conditions(k.window('m_start', 'm_end') if k.time_col else ''))} AS c{i}"
+        for i, k in enumerate(ks))
+    if all(k.time_col for k in ks):
+        # Yalnız akış KPI'ları: her satır kendi ay(lar)ına eşlenir, aralık dışı satırlar okunmaz.
+        windows = {k.time_col: k for k in ks}
+        on = " OR ".join(f"mo.m_start = date_trunc('month', {t})" for t in windows)
+        hi = "(date_trunc('month', v_to) + interval '1 month')"
+        rng = " OR ".join(f"({k.window('v_from', hi)})" for k in windows.values())
+        scan = f"""FROM {src}
+          JOIN kpi_months(v_from, v_to) mo ON {on}
+          WHERE {rng}"""
+    else:
+        # Ay sonu anlık KPI içeren kaynak: her satır her ay için bir kez değerlendirilir.
+        join = "CROSS JOIN LATERAL" if src.startswith("(") else "CROSS JOIN"
+        scan = f"FROM kpi_months(v_from, v_to) mo {join} {src}"
+    picked = ", ".join(f"a.c{i}" for i in range(len(ks)))
+    return monthly_upsert(f"""SELECT months.m_start, {picked}
+      FROM kpi_months(v_from, v_to) months
+      LEFT JOIN (
+        SELECT mo.m_start,
+{cols}
+        {scan}
+        GROUP BY mo.m_start
+      ) a ON a.m_start = months.m_start""", group)
+
+
+def backfill_statements(src: str, group: List[Tuple[Kpi, List[str]]]) -> List[Tuple[List[Kpi], str]]:
+    """(KPIs, statement): rollup KPIs of a source read its daily rollup, sweep KPIs share one
+    running-sum pass, the rest share one grouped scan."""
+    rollups = rollup_of()
+    rolled = [(k, kids) for k, kids in group if k.kid in rollups]
+    sweep = [(k, kids) for k, kids in group if k.sweep]
+    rest = [(k, kids) for k, kids in group if not k.sweep and k.kid not in rollups]
+    out = []
+    if rest:
+        out.append(([k for k, _ in rest], backfill_insert(src, rest)))
+    if rolled:
+        r = rollups[rolled[0][0].kid]
+        cols = ",\n".join(
+            f"        {with_filter(rollup_value(k), k.unaliased(k.where))} AS c{i}" for i, (k, _) in enumerate(rolled))
+        picked = ", ".join(f"a.c{i}" for i in range(len(rolled)))
+        out.append(([k for k, _ in rolled], monthly_upsert(f"""SELECT months.m_start, {picked}
+      FROM kpi_months(v_from, v_to) months
+      CROSS JOIN LATERAL (
+        SELECT
+{cols}
+        FROM (
+          {rollup_rows(r, "months.m_start", "months.m_end")}
+        ) u
+      ) a""", rolled)))
+    if sweep:
+        ks = [k for k, _ in sweep]
+        out.append((ks, monthly_upsert(sweep_rows(src, ks, "v_from", "v_to"), sweep)))
+    return out
+
+
+def snapshot_selects(src: str, group: List[Tuple[Kpi, List[str]]]) -> List[Tuple[List[Tuple[Kpi, List[str]]], str]]:
+    """Single-period SELECTs (c0..cN) for the KPIs of a source: rollup KPIs read the rollup,
+    the rest share one FILTER-aggregate scan."""
+    rollups = rollup_of()
+    rolled = [(k, kids) for k, kids in group if k.kid in rollups]
+    rest = [(k, kids) for k, kids in group if k.kid not in rollups]
+    out = []
+    if rest:
+        # Tüm KPI'larda ortak koşullar WHERE'e çıkar, FILTER yalnız KPI'ya özgü kalanı taşır (tek KPI'da
+        # sorgu kpi_query ile aynıdır); satırlar en az bir KPI'nın koşulunu sağlayanlarla sınırlanır.
+        terms = [conjuncts(k.conditions(k.window("m_start", "m_end") if k.time_col else "")) for k, _ in rest]
+        common = [c for c in terms[0] if all(c in t for t in terms[1:])]
+        residual = [" AND ".join(c for c in t if c not in common) for t in terms]
+        cond = list(common)
+        if all(residual):
+            alts = list(dict.fromkeys(residual))
+            cond.append(alts[0] if len(alts) == 1 else "(" + " OR ".join(f"({a})" for a in alts) + ")")
+        cols = ",\n".join(f"        {with_filter(k.value, r)} AS c{i}" for i, ((k, _), r) in enumerate(zip(rest, residual)))
+        where = where_clause(" AND ".join(cond))
+        out.append((rest, f"""SELECT
+{cols}
+      FROM {src}{where}"""))
+    if rolled:
+        r = rollups[rolled[0][0].kid]
+        cols = ",\n".join(
+            f"        {with_filter(rollup_value(k), k.unaliased(k.where))} AS c{i}" for i, (k, _) in enumerate(rolled))
+        out.append((rolled, f"""SELECT
+{cols}
+      FROM (
+        {rollup_rows(r, "m_start", "m_end")}
+      ) u"""))
+    return out
+
+
+def emit_snapshot(w: Callable[[str], None]) -> None:
+    """kpi_snapshot_<table>: one period's values of a source group as jsonb; kpi_monthly_snapshot
+    concatenates them (one function per group keeps each statement small enough for --parts)."""
+    groups = snapshot_groups()
+    for fn, src, group in groups:
+        table = group[0][0].table
+        blocks = []
+        for ks, select in snapshot_selects(src, group):
+            pairs = [f"'{kid}', COALESCE(a.c{i}, 0)" for i, (_, kids) in enumerate(ks) for kid in kids]
+            # jsonb_build_object en fazla 100 argüman alır.
+            obj = " || ".join(f"jsonb_build_object({', '.join(pairs[j:j + 50])})" for j in range(0, len(pairs), 50))
+            blocks.append(f"""  BEGIN
+    SELECT {obj} INTO part
+    FROM (
+      {textwrap.indent(select, "  ").lstrip()}
+    ) a;
+    result := result || part;
+  EXCEPTION WHEN undefined_table OR undefined_column THEN
+    RAISE WARNING 'kpi_monthly_snapshot: % atlandı: %', '{table}', SQLERRM;
+  END;
+""")
+        n = sum(len(kids) for _, kids in group)
+        w(f"""-- {table}: {n} KPI; dönem [m_start, m_end) değerleri, kpi_monthly_snapshot bunları birleştirir.
+CREATE OR REPLACE FUNCTION public.{fn}(m_start timestamptz, m_end timestamptz)
+RETURNS jsonb
 LANGUAGE plpgsql
 STABLE
 SECURITY DEFINER
 SET search_path = public
-AS $kpi$
+AS $snap$
 DECLARE
-  v numeric;
+  result jsonb := '{{}}'::jsonb;
+  part jsonb;
+BEGIN
+{"".join(blocks)}  RETURN result;
+END;
+$snap$;
+""")
+    calls = "\n    || ".join(f"public.{fn}(m_start, m_end)" for fn, _, _ in groups)
+    w(f"""-- Dönem anlık görüntüsü: tüm otomatik KPI'lar tek çağrıda ({{"auto_kpi_id": değer, ...}}).
+-- Aynı kaynağı okuyan KPI'lar tek taramada FILTER agregalarıyla hesaplanır; değerler
+-- kpi_monthly_actual ile aynıdır (kpi_monthly_data dönemleri). Güncel değer için kpi_current_snapshot.
+-- Tablosu olmayan modüllerin KPI'ları sonuçta yer almaz.
+CREATE OR REPLACE FUNCTION public.kpi_monthly_snapshot(m_start timestamptz, m_end timestamptz)
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $snap$
+  SELECT {calls};
+$snap$;
+""")
+
+
+def emit_current_snapshot(w: Callable[[str], None]) -> None:
+    """kpi_current_snapshot: the dashboard's get_* RPCs in one round trip.
+
+    current_value keeps each get_* function's own window (trailing 30 days, all time or
+    now), which the calendar-month kpi_monthly_snapshot does not reproduce.
+    """
+    w("""-- Güncel değerler (kpis.current_value): istemcinin {"auto_kpi_id": "get_..."} eşlemesindeki
+-- RPC'ler tek çağrıda çalışır ve {"auto_kpi_id": değer, ...} döner. Değerler get_* fonksiyonlarının
+-- kendi penceresidir (son 30 gün, tüm zamanlar, anlık); takvim ayı değerleri kpi_monthly_snapshot'tadır.
+-- Yalnız public şemasındaki argümansız get_* fonksiyonları çağrılır; çağıranın yetkisiyle çalışır.
+-- Bulunamayan ya da hata veren fonksiyonun KPI'ları sonuçta yer almaz.
+CREATE OR REPLACE FUNCTION public.kpi_current_snapshot(p_rpcs jsonb)
+RETURNS jsonb
+LANGUAGE plpgsql
+SET search_path = public
+AS $cur$
+DECLARE
+  result jsonb := '{}'::jsonb;
+  r record;
+  v jsonb;
 BEGIN
-  v := NULL;
+  FOR r IN
+    SELECT e.value AS fn, array_agg(e.key ORDER BY e.key) AS kids
+    FROM jsonb_each_text(p_rpcs) e
+    GROUP BY e.value
+  LOOP
+    IF r.fn !~ '^get_\\w+$' OR to_regprocedure(format('public.%I()', r.fn)) IS NULL THEN
+      RAISE WARNING 'kpi_current_snapshot: % bulunamadı', r.fn;
+      CONTINUE;
+    END IF;
+    BEGIN
+      EXECUTE format('SELECT to_jsonb(public.%I())', r.fn) INTO v;
+      SELECT result || jsonb_object_agg(k, v) INTO result FROM unnest(r.kids) k;
+    EXCEPTION WHEN OTHERS THEN
+      RAISE WARNING 'kpi_current_snapshot: % atlandı: %', r.fn, SQLERRM;
+    END;
+  END LOOP;
+  RETURN result;
+END;
+$cur$;
 """)
 
-    def branch(kid, sql):
-        w(f"  IF p_kid = '{kid}' THEN\n    {sql}\n")
-        w("    RETURN v;\n  END IF;\n")
 
-    # Girdi kalite oranları (ay içi)
-    same_incoming = """SELECT CASE WHEN COALESCE(SUM(quantity_received),0) = 0 THEN 0
-      ELSE ROUND(COALESCE(SUM(quantity_rejected),0)::numeric / NULLIF(SUM(quantity_received),0) * 100, 2) END
-      INTO v FROM incoming_inspections WHERE inspection_date >= m_start AND inspection_date < m_end"""
-    branch("incoming_rejection_rate", same_incoming)
-    branch("supplier_nc_rate", same_incoming)
+def group_functions(prefix: str) -> List[Tuple[str, str, List[Tuple[Kpi, List[str]]]]]:
+    """(function name, FROM item, KPIs) per source group: <prefix>_<table>, numbered from _2 when
+    several groups read the same table."""
+    out = []
+    seen: Dict[str, int] = {}
+    for src, group in source_groups():
+        table = group[0][0].table
+        seen[table] = seen.get(table, 0) + 1
+        suffix = f"_{seen[table]}" if seen[table] > 1 else ""
+        out.append((f"{prefix}_{table}{suffix}", src, group))
+    return out
 
-    # DF/8D — açık anlık (ay sonu)
-    branch("open_non_conformities_count", """SELECT COUNT(*)::numeric INTO v FROM non_conformities nc
-      WHERE nc.created_at < m_end AND nc.status NOT IN ('Kapatıldı', 'Reddedildi')
-        AND (nc.closed_at IS NULL OR nc.closed_at >= m_end)""")
-    branch("open_8d_count", """SELECT COUNT(*)::numeric INTO v FROM non_conformities nc
-      WHERE nc.type = '8D' AND nc.created_at < m_end AND nc.status <> 'Kapatıldı'
-        AND (nc.closed_at IS NULL OR nc.closed_at >= m_end)""")
-    branch("df_closure_rate", """SELECT CASE WHEN COUNT(*) FILTER (WHERE nc.type = 'DF' AND nc.status != 'Reddedildi') = 0 THEN 0
-      ELSE ROUND(COUNT(*) FILTER (WHERE nc.type = 'DF' AND nc.status = 'Kapatıldı')::numeric
-        / NULLIF(COUNT(*) FILTER (WHERE nc.type = 'DF' AND nc.status != 'Reddedildi'), 0) * 100, 2) END INTO v
-      FROM non_conformities nc WHERE nc.created_at >= m_start AND nc.created_at < m_end""")
-    branch("avg_quality_nc_closure_time", """SELECT COALESCE(ROUND(AVG(EXTRACT(EPOCH FROM (nc.closed_at - nc.created_at)) / 86400)::numeric, 1), 0) INTO v
-      FROM non_conformities nc WHERE nc.department = 'Kalite' AND nc.status = 'Kapatıldı'
-        AND nc.closed_at IS NOT NULL AND nc.created_at IS NOT NULL
-        AND nc.closed_at >= m_start AND nc.closed_at < m_end""")
 
-    # Uygunsuzluk modülü
-    branch("open_nonconformity_count", """SELECT COUNT(*)::numeric INTO v FROM nonconformity_records nr
-      WHERE nr.created_at < m_end
-        AND NOT (nr.status = 'Kapatıldı' AND COALESCE(nr.updated_at, nr.created_at) < m_end)
-        AND NOT (nr.status IN ('DF Açıldı','8D Açıldı') AND nr.source_nc_id IS NOT NULL)""")
-    branch("nonconformity_30d_count", """SELECT COUNT(*)::numeric INTO v FROM nonconformity_records
-      WHERE created_at >= m_start AND created_at < m_end""")
-    branch("nonconformity_closure_rate", """SELECT CASE WHEN COUNT(*) = 0 THEN 0 ELSE ROUND(
-      COUNT(*) FILTER (WHERE status = 'Kapatıldı')::numeric / COUNT(*)::numeric * 100, 2) END INTO v
-      FROM nonconformity_records WHERE created_at >= m_start AND created_at < m_end""")
-    branch("critical_nonconformity_count", """SELECT COUNT(*)::numeric INTO v FROM nonconformity_records
-      WHERE severity = 'Kritik' AND created_at >= m_start AND created_at < m_end""")
-    branch("nonconformity_df_8d_conversion_rate", """SELECT CASE WHEN COUNT(*) = 0 THEN 0 ELSE ROUND(
-      COUNT(*) FILTER (WHERE status IN ('DF Açıldı','8D Açıldı'))::numeric / COUNT(*)::numeric * 100, 2) END INTO v
-      FROM nonconformity_records WHERE created_at >= m_start AND created_at < m_end""")
-
-    branch("quarantine_count", """SELECT COUNT(*)::numeric INTO v FROM quarantine_records qr
-      WHERE qr.status = 'Karantinada' AND qr.created_at < m_end""")
-
-    branch("produced_vehicles_count", """SELECT COUNT(*)::numeric INTO v FROM produced_vehicles pv
-      WHERE pv.created_at >= m_start AND pv.created_at < m_end""")
-
-    branch("quality_inspection_pass_rate", """SELECT CASE WHEN COUNT(*) = 0 THEN 0 ELSE ROUND(
-      COUNT(*) FILTER (WHERE qi.status = 'Onaylandı')::numeric / COUNT(*)::numeric * 100, 2) END INTO v
-      FROM quality_inspections qi WHERE qi.quality_entry_at >= m_start AND qi.quality_entry_at < m_end""")
-
-    branch("avg_quality_process_time", """SELECT COALESCE(ROUND(AVG(EXTRACT(EPOCH FROM (COALESCE(qi.shipped_at, qi.updated_at) - qi.quality_entry_at)) / 86400)::numeric, 2), 0) INTO v
-      FROM quality_inspections qi WHERE qi.quality_entry_at >= m_start AND qi.quality_entry_at < m_end AND qi.quality_entry_at IS NOT NULL""")
-
-    branch("avg_quality_inspection_time", """SELECT COALESCE(ROUND(AVG(EXTRACT(EPOCH FROM (e.event_timestamp - s.event_timestamp)) / 86400)::numeric, 2), 0) INTO v
-      FROM vehicle_timeline_events s
-      JOIN vehicle_timeline_events e ON s.inspection_id = e.inspection_id AND s.event_type = 'control_start' AND e.event_type = 'control_end'
-      WHERE s.event_timestamp >= m_start AND s.event_timestamp < m_end""")
-
-    branch("process_inkr_30d_count", """SELECT COUNT(*)::numeric INTO v FROM process_inkr_reports WHERE created_at >= m_start AND created_at < m_end""")
-    branch("process_inkr_total_count", """SELECT COUNT(*)::numeric INTO v FROM process_inkr_reports WHERE created_at >= m_start AND created_at < m_end""")
-
-    branch("leak_test_30d_count", """SELECT COUNT(*)::numeric INTO v FROM leak_test_records WHERE created_at >= m_start AND created_at < m_end""")
-    branch("leak_test_rejection_30d_count", """SELECT COUNT(*)::numeric INTO v FROM leak_test_records WHERE test_result = 'Red' AND created_at >= m_start AND created_at < m_end""")
-    branch("leak_test_pass_rate", """SELECT CASE WHEN COUNT(*) = 0 THEN 0 ELSE ROUND(
-      COUNT(*) FILTER (WHERE test_result = 'Kabul')::numeric / COUNT(*)::numeric * 100, 2) END INTO v
-      FROM leak_test_records WHERE created_at >= m_start AND created_at < m_end""")
-
-    branch("open_supplier_nc_count", """SELECT COUNT(*)::numeric INTO v FROM supplier_non_conformities snc
-      WHERE snc.created_at < m_end AND snc.status <> 'Kapatıldı' AND (snc.closed_at IS NULL OR snc.closed_at >= m_end)""")
-
-    branch("active_suppliers_count", """SELECT COUNT(*)::numeric INTO v FROM suppliers s
-      WHERE s.status = 'Onaylı' AND s.created_at < m_end""")
-
-    branch("avg_supplier_score", """SELECT COALESCE(ROUND(AVG(l.final_score)::numeric, 2), 0) INTO v FROM (
-      SELECT DISTINCT ON (ss.supplier_id) ss.supplier_id, ss.final_score FROM supplier_scores ss
-      WHERE ss.created_at < m_end ORDER BY ss.supplier_id, ss.period DESC NULLS LAST, ss.created_at DESC
-    ) l JOIN suppliers s ON s.id = l.supplier_id AND s.status = 'Onaylı'""")
+def snapshot_groups() -> List[Tuple[str, str, List[Tuple[Kpi, List[str]]]]]:
+    """(function name, FROM item, KPIs) per source group for kpi_monthly_snapshot."""
+    return group_functions("kpi_snapshot")
 
-    # SPC / MPC / validation / FMEA / APQP / PPAP / run-at-rate / DMAIC
-    branch("active_spc_characteristics_count", """SELECT COUNT(*)::numeric INTO v FROM spc_characteristics WHERE is_active = true AND created_at < m_end""")
-    branch("out_of_control_processes_count", """SELECT COUNT(DISTINCT characteristic_id)::numeric INTO v FROM spc_control_charts
-      WHERE is_in_control = false AND period_end >= m_start AND period_start < m_end""")
-    branch("capable_processes_rate", """SELECT CASE WHEN COUNT(*) = 0 THEN 0 ELSE ROUND(
-      COUNT(*) FILTER (WHERE cp >= 1.33 AND cpk >= 1.33)::numeric / COUNT(*)::numeric * 100, 2) END INTO v
-      FROM spc_capability_studies WHERE created_at >= m_start AND created_at < m_end""")
-    branch("msa_studies_count", """SELECT COUNT(*)::numeric INTO v FROM spc_msa_studies WHERE created_at >= m_start AND created_at < m_end""")
-    branch("active_production_plans_count", """SELECT COUNT(*)::numeric INTO v FROM production_plans WHERE status IN ('Planned', 'In Progress') AND created_at < m_end""")
-    branch("critical_characteristics_count", """SELECT COUNT(*)::numeric INTO v FROM critical_characteristics WHERE is_active = true AND created_at < m_end""")
-    branch("process_parameter_records_count", """SELECT COUNT(*)::numeric INTO v FROM process_parameter_records WHERE record_date >= m_start::date AND record_date < m_end::date""")
-    branch("active_validation_plans_count", """SELECT COUNT(*)::numeric INTO v FROM validation_plans WHERE status IN ('Planned', 'In Progress') AND created_at < m_end""")
-    branch("completed_validations_rate", """SELECT CASE WHEN COUNT(*) = 0 THEN 0 ELSE ROUND(
-      COUNT(*) FILTER (WHERE status = 'Completed')::numeric / COUNT(*)::numeric * 100, 2) END INTO v
-      FROM validation_plans WHERE created_at >= m_start AND created_at < m_end""")
-    branch("active_fmea_projects_count", """SELECT COUNT(*)::numeric INTO v FROM fmea_projects WHERE status IN ('Active', 'In Review', 'Draft') AND created_at < m_end""")
-    branch("high_rpn_count", """SELECT COUNT(*)::numeric INTO v FROM fmea_causes_controls WHERE rpn > 100 AND created_at >= m_start AND created_at < m_end""")
-    branch("completed_fmea_actions_rate", """SELECT CASE WHEN COUNT(*) = 0 THEN 0 ELSE ROUND(
-      COUNT(*) FILTER (WHERE status = 'Completed')::numeric / COUNT(*)::numeric * 100, 2) END INTO v
-      FROM fmea_action_plans WHERE created_at >= m_start AND created_at < m_end""")
-    branch("active_apqp_projects_count", """SELECT COUNT(*)::numeric INTO v FROM apqp_projects WHERE status NOT IN ('Approved', 'Rejected', 'Completed') AND created_at < m_end""")
-    branch("pending_ppap_approvals_count", """SELECT COUNT(*)::numeric INTO v FROM ppap_submissions WHERE submission_status IN ('Submitted', 'Draft') AND created_at < m_end""")
-    branch("run_at_rate_completion_rate", """SELECT CASE WHEN COUNT(*) = 0 THEN 0 ELSE ROUND(
-      COUNT(*) FILTER (WHERE status = 'Completed')::numeric / COUNT(*)::numeric * 100, 2) END INTO v FROM run_at_rate_studies WHERE created_at >= m_start AND created_at < m_end""")
-    branch("active_dmaic_projects_count", """SELECT COUNT(*)::numeric INTO v FROM dmaic_projects WHERE overall_status != 'Completed' AND created_at < m_end""")
-    branch("completed_dmaic_projects_count", """SELECT COUNT(*)::numeric INTO v FROM dmaic_projects WHERE overall_status = 'Completed' AND updated_at >= m_start AND updated_at < m_end""")
-    branch("dmaic_success_rate", """SELECT CASE WHEN COUNT(*) = 0 THEN 0 ELSE ROUND(
-      COUNT(*) FILTER (WHERE overall_status = 'Completed')::numeric / COUNT(*)::numeric * 100, 2) END INTO v
-      FROM dmaic_projects WHERE created_at >= m_start AND created_at < m_end""")
-
-    branch("open_customer_complaints_count", """SELECT COUNT(*)::numeric INTO v FROM customer_complaints cc
-      WHERE cc.created_at < m_end AND cc.status NOT IN ('Kapatıldı', 'Çözüldü', 'İptal')
-        AND (cc.actual_close_date IS NULL OR cc.actual_close_date >= m_end::date)""")
-    branch("after_sales_open_count", """SELECT COUNT(*)::numeric INTO v FROM customer_complaints cc
-      WHERE cc.created_at < m_end AND cc.status NOT IN ('Kapatıldı', 'Çözüldü', 'İptal')
-        AND (cc.actual_close_date IS NULL OR cc.actual_close_date >= m_end::date)""")
-    branch("after_sales_30d_count", """SELECT COUNT(*)::numeric INTO v FROM customer_complaints WHERE created_at >= m_start AND created_at < m_end""")
 
-    branch("sla_compliant_complaints_rate", """SELECT CASE WHEN COUNT(*) FILTER (WHERE status IN ('Kapalı','Çözüldü')) = 0 THEN 0 ELSE ROUND(
-      COUNT(*) FILTER (WHERE status IN ('Kapalı','Çözüldü') AND actual_close_date IS NOT NULL AND target_close_date IS NOT NULL AND actual_close_date <= target_close_date)::numeric
-      / NULLIF(COUNT(*) FILTER (WHERE status IN ('Kapalı','Çözüldü')), 0) * 100, 2) END INTO v
-      FROM customer_complaints WHERE updated_at >= m_start AND updated_at < m_end""")
-
-    branch("avg_complaint_resolution_time", """SELECT COALESCE(ROUND(AVG(EXTRACT(EPOCH FROM (actual_close_date - complaint_date)) / 86400)::numeric, 2), 0) INTO v
-      FROM customer_complaints WHERE status IN ('Kapalı', 'Çözüldü') AND actual_close_date IS NOT NULL AND complaint_date IS NOT NULL
-        AND actual_close_date >= m_start AND actual_close_date < m_end""")
-
-    branch("expired_document_count", """SELECT COUNT(*)::numeric INTO v FROM documents d
-      WHERE d.valid_until IS NOT NULL AND d.valid_until >= m_start::date AND d.valid_until < m_end::date""")
-
-    branch("completed_internal_audits_30d_count", """SELECT COUNT(*)::numeric INTO v FROM audits
-      WHERE status = 'Tamamlandı' AND COALESCE(updated_at, created_at) >= m_start AND COALESCE(updated_at, created_at) < m_end""")
-    branch("open_internal_audit_count", """SELECT COUNT(*)::numeric INTO v FROM audits
-      WHERE status = 'Tamamlandı' AND COALESCE(updated_at, created_at) >= m_start AND COALESCE(updated_at, created_at) < m_end""")
-
-    branch("open_deviation_count", """SELECT COUNT(*)::numeric INTO v FROM deviations d
-      WHERE d.created_at < m_end AND d.status NOT IN ('Tamamlandı', 'Reddedildi')""")
-
-    branch("calibration_due_count", """WITH latest AS (
-        SELECT DISTINCT ON (ec.equipment_id) ec.equipment_id, ec.next_calibration_date, ec.is_active
-        FROM equipment_calibrations ec ORDER BY ec.equipment_id, ec.calibration_date DESC NULLS LAST, ec.created_at DESC NULLS LAST
-      )
-      SELECT COUNT(*)::numeric INTO v FROM latest l
-      JOIN equipments e ON e.id = l.equipment_id
-      WHERE e.status IS DISTINCT FROM 'Hurdaya Ayrıldı' AND (l.is_active IS NULL OR l.is_active = true)
-        AND l.next_calibration_date IS NOT NULL AND l.next_calibration_date < m_end::date""")
-
-    branch("active_fixture_count", """SELECT COUNT(*)::numeric INTO v FROM fixtures WHERE status = 'Aktif' AND created_at < m_end""")
-    branch("total_fixture_count", """SELECT COUNT(*)::numeric INTO v FROM fixtures WHERE created_at < m_end""")
-    branch("fixture_nonconformity_count", """SELECT COUNT(*)::numeric INTO v FROM fixture_nonconformities fn
-      WHERE fn.created_at < m_end AND (fn.correction_status IS NULL OR fn.correction_status != 'Düzeltildi')""")
-
-    branch("active_wps_procedures_count", """SELECT COUNT(*)::numeric INTO v FROM wps_procedures WHERE status = 'Active' AND created_at < m_end""")
-    branch("pending_wps_approvals_count", """SELECT COUNT(*)::numeric INTO v FROM wps_procedures WHERE status = 'Pending Approval' AND created_at < m_end""")
-
-    branch("planned_trainings_count", """SELECT COUNT(*)::numeric INTO v FROM trainings WHERE created_at >= m_start AND created_at < m_end""")
-    branch("completed_trainings_count", """SELECT COUNT(*)::numeric INTO v FROM trainings WHERE status IN ('Tamamlandı', 'Tamamlandi', 'Completed') AND updated_at >= m_start AND updated_at < m_end""")
-    branch("training_participation_rate", """SELECT CASE WHEN COUNT(*) = 0 THEN 0 ELSE ROUND(
-      COUNT(*) FILTER (WHERE tp.status = 'Tamamlandı')::numeric / COUNT(*)::numeric * 100, 2) END INTO v
-      FROM training_participants tp JOIN trainings tr ON tr.id = tp.training_id
-      WHERE tr.created_at >= m_start AND tr.created_at < m_end""")
-
-    branch("avg_polyvalence_score", """SELECT COALESCE(ROUND(AVG(ps.current_level)::numeric, 2), 0) INTO v FROM personnel_skills ps WHERE ps.updated_at < m_end""")
-    branch("critical_skill_gaps_count", """SELECT COUNT(*)::numeric INTO v FROM personnel_skills ps JOIN skills s ON ps.skill_id = s.id
-      WHERE s.is_critical = true AND ps.current_level < s.target_level AND ps.updated_at < m_end""")
-    branch("expired_certifications_count", """SELECT COUNT(*)::numeric INTO v FROM personnel_skills
-      WHERE is_certified = true AND certification_expiry_date IS NOT NULL AND certification_expiry_date < m_end::date""")
-
-    branch("active_kaizen_count", """SELECT COUNT(*)::numeric INTO v FROM kaizen_entries WHERE status NOT IN ('Kapandı', 'Reddedildi') AND created_at < m_end""")
-    branch("completed_kaizen_count", """SELECT COUNT(*)::numeric INTO v FROM kaizen_entries WHERE status = 'Kapandı' AND updated_at >= m_start AND updated_at < m_end""")
-    branch("kaizen_success_rate", """SELECT CASE WHEN COUNT(*) FILTER (WHERE status NOT IN ('Reddedildi', 'Askıda')) = 0 THEN 0 ELSE ROUND(
-      COUNT(*) FILTER (WHERE status = 'Kapandı')::numeric / NULLIF(COUNT(*) FILTER (WHERE status NOT IN ('Reddedildi', 'Askıda')), 0) * 100, 2) END INTO v
-      FROM kaizen_entries WHERE created_at >= m_start AND created_at < m_end""")
-
-    branch("active_benchmarks_count", """SELECT COUNT(*)::numeric INTO v FROM benchmarks WHERE status NOT IN ('Completed', 'Cancelled', 'Tamamlandı', 'İptal') AND created_at < m_end""")
-    branch("completed_benchmarks_count", """SELECT COUNT(*)::numeric INTO v FROM benchmarks WHERE status IN ('Completed', 'Tamamlandı') AND updated_at >= m_start AND updated_at < m_end""")
-
-    branch("open_tasks_count", """SELECT COUNT(*)::numeric INTO v FROM tasks t
-      WHERE t.created_at < m_end AND t.status NOT IN ('Completed', 'Cancelled', 'Tamamlandı', 'İptal')""")
-    branch("overdue_tasks_count", """SELECT COUNT(*)::numeric INTO v FROM tasks t
-      WHERE t.status NOT IN ('Completed', 'Cancelled', 'Tamamlandı', 'İptal') AND t.due_date IS NOT NULL AND t.due_date < LEAST(m_end::date, CURRENT_DATE) AND t.created_at < m_end""")
-    branch("task_completion_rate", """SELECT CASE WHEN COUNT(*) = 0 THEN 0 ELSE ROUND(
-      COUNT(*) FILTER (WHERE status IN ('Completed', 'Tamamlandı'))::numeric / COUNT(*)::numeric * 100, 2) END INTO v
-      FROM tasks WHERE created_at >= m_start AND created_at < m_end""")
-    branch("completed_tasks_30d_count", """SELECT COUNT(*)::numeric INTO v FROM tasks WHERE status IN ('Tamamlandı', 'Completed') AND updated_at >= m_start AND updated_at < m_end""")
-
-    branch("nps_score", """WITH x AS (SELECT COUNT(*) AS t,
-        COUNT(*) FILTER (WHERE nps_score >= 9) AS p, COUNT(*) FILTER (WHERE nps_score <= 6) AS d
-      FROM customer_satisfaction_surveys WHERE created_at >= m_start AND created_at < m_end)
-      SELECT CASE WHEN t = 0 THEN 0 ELSE ROUND(((p::numeric / t) - (d::numeric / t)) * 100, 2) END INTO v FROM x""")
-    branch("satisfaction_surveys_count", """SELECT COUNT(*)::numeric INTO v FROM customer_satisfaction_surveys WHERE created_at >= m_start AND created_at < m_end""")
-    branch("avg_customer_satisfaction_score", """SELECT COALESCE(ROUND(AVG(overall_score)::numeric, 2), 0) INTO v FROM customer_satisfaction_surveys WHERE created_at >= m_start AND created_at < m_end""")
-
-    branch("active_supplier_development_plans_count", """SELECT COUNT(*)::numeric INTO v FROM supplier_development_plans
-      WHERE current_status NOT IN ('Completed', 'Cancelled', 'Tamamlandı', 'İptal') AND created_at < m_end""")
-    branch("completed_supplier_development_plans_count", """SELECT COUNT(*)::numeric INTO v FROM supplier_development_plans
-      WHERE current_status IN ('Completed', 'Tamamlandı') AND updated_at >= m_start AND updated_at < m_end""")
-
-    branch("non_quality_cost", """SELECT COALESCE(SUM(amount), 0)::numeric INTO v FROM quality_costs WHERE cost_date >= m_start::date AND cost_date < m_end::date""")
-    branch("total_quality_cost", """SELECT COALESCE(SUM(amount), 0)::numeric INTO v FROM quality_costs WHERE cost_date >= m_start::date AND cost_date < m_end::date""")
-
-    w("  RETURN v;\nEND;\n$kpi$;\n\n")
-
-    w("""CREATE OR REPLACE FUNCTION public.backfill_kpi_monthly_data(p_months_back integer DEFAULT 13)
-RETURNS jsonb
+def backfill_groups() -> List[Tuple[str, str, List[Tuple[Kpi, List[str]]]]]:
+    """(function name, source table, KPIs) per source group: the backfill unit of work."""
+    return group_functions("kpi_backfill")
+
+
+def emit_backfill(w: Callable[[str], None]) -> None:
+    """Per-source backfill functions, the synchronous backfill RPC over them and the
+    background job queue that runs them one (source, month) chunk per transaction."""
+    groups = backfill_groups()
+    for fn, src, group in groups:
+        table = group[0][0].table
+        all_kids = [kid for _, kids in group for kid in kids]
+        kids = ", ".join(f"'{kid}'" for kid in all_kids)
+        inserts = "".join(
+            f"""      t0 := clock_timestamp();
+      {textwrap.indent(stmt, "  ").lstrip()};
+      inserted_count := inserted_count + v_ins;
+      updated_count := updated_count + v_upd;
+      unchanged_count := unchanged_count + v_total - v_ins - v_upd;
+      IF v_stats THEN
+        PERFORM kpi_stats_record(ARRAY[{", ".join(f"'{k.kid}'" for k in ks)}], 'backfill', v_from, v_to, t0, NULL);
+      END IF;
+""" for ks, stmt in backfill_statements(src, group))
+        shared = f" ({len(group)} hesap)" if len(group) < len(all_kids) else ""
+        w(f"""-- {table}: {len(all_kids)} KPI{shared}; kpi_months(v_from, v_to) ayları, {{eklenen, güncellenen, değişmeyen}} döner.
+CREATE OR REPLACE FUNCTION public.{fn}(v_from timestamptz, v_to timestamptz, v_stats boolean DEFAULT false)
+RETURNS integer[]
 LANGUAGE plpgsql
 SECURITY DEFINER
 SET search_path = public
 AS $bf$
 DECLARE
-  kpi_row RECORD;
-  mo integer;
-  t_year integer;
-  t_month integer;
-  m_start timestamptz;
-  m_end timestamptz;
-  calc_value numeric;
+  v_total integer;
+  v_ins integer;
+  v_upd integer;
+  inserted_count integer := 0;
   updated_count integer := 0;
+  unchanged_count integer := 0;
+  t0 timestamptz;
+BEGIN
+  IF EXISTS (SELECT 1 FROM kpis WHERE is_auto = true AND auto_kpi_id IN ({kids})) THEN
+    BEGIN
+{inserts}    EXCEPTION WHEN undefined_table OR undefined_column THEN
+      RAISE WARNING 'backfill_kpi_monthly_data: % atlandı: %', '{table}', SQLERRM;
+    END;
+  END IF;
+  RETURN ARRAY[inserted_count, updated_count, unchanged_count];
+END;
+$bf$;
+""")
+    rows = ",\n".join(
+        f"  ({i}, '{group[0][0].table}', 'public.{fn}', ARRAY[{', '.join(repr(kid) for _, kids in group for kid in kids)}])"
+        for i, (fn, _, group) in enumerate(groups, 1))
+    w(f"""-- Backfill iş birimleri: kaynak tablo başına bir fonksiyon, sırayla çalışır.
+CREATE TABLE IF NOT EXISTS public.kpi_backfill_groups (
+    ord integer PRIMARY KEY,
+    source_table text NOT NULL,
+    fn regproc NOT NULL,
+    kpi_ids text[] NOT NULL
+);
+ALTER TABLE public.kpi_backfill_groups ENABLE ROW LEVEL SECURITY;
+
+INSERT INTO public.kpi_backfill_groups (ord, source_table, fn, kpi_ids) VALUES
+{rows}
+ON CONFLICT (ord) DO UPDATE SET
+  source_table = EXCLUDED.source_table,
+  fn = EXCLUDED.fn,
+  kpi_ids = EXCLUDED.kpi_ids;
+DELETE FROM public.kpi_backfill_groups WHERE ord > {len(groups)};
+
+-- Son tamamlanan backfill (eşzamanlı ve arka plan); tazelik kontrolü bunu okur.
+CREATE TABLE IF NOT EXISTS public.kpi_backfill_state (
+    id boolean PRIMARY KEY DEFAULT true CHECK (id),
+    months_back integer NOT NULL,
+    started_at timestamptz NOT NULL,
+    finished_at timestamptz NOT NULL,
+    result jsonb NOT NULL
+);
+ALTER TABLE public.kpi_backfill_state ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "kpi_backfill_state_select" ON public.kpi_backfill_state;
+CREATE POLICY "kpi_backfill_state_select"
+  ON public.kpi_backfill_state FOR SELECT TO authenticated USING (true);
+
+-- Arka plan backfill işleri: (kaynak, ay) parçaları en yeni aydan geriye doğru işlenir,
+-- her parça ayrı transaction'da yazılır; chunks_done / chunks_total ilerlemedir.
+CREATE TABLE IF NOT EXISTS public.kpi_backfill_jobs (
+    id bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    months_back integer NOT NULL,
+    to_month timestamptz NOT NULL,
+    group_count integer NOT NULL,
+    chunks_total integer NOT NULL,
+    chunks_done integer NOT NULL DEFAULT 0,
+    status text NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+    inserted integer NOT NULL DEFAULT 0,
+    updated integer NOT NULL DEFAULT 0,
+    unchanged integer NOT NULL DEFAULT 0,
+    error text,
+    requested_at timestamptz NOT NULL DEFAULT now(),
+    started_at timestamptz,
+    finished_at timestamptz
+);
+CREATE INDEX IF NOT EXISTS idx_kpi_backfill_jobs_active
+  ON public.kpi_backfill_jobs (id) WHERE status IN ('queued', 'running');
+ALTER TABLE public.kpi_backfill_jobs ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "kpi_backfill_jobs_select" ON public.kpi_backfill_jobs;
+CREATE POLICY "kpi_backfill_jobs_select"
+  ON public.kpi_backfill_jobs FOR SELECT TO authenticated USING (true);
+
+CREATE OR REPLACE FUNCTION public.kpi_backfill_job_progress(p_job_id bigint DEFAULT NULL)
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $p$
+  SELECT to_jsonb(j) || jsonb_build_object(
+    'job_id', j.id,
+    'percent', CASE WHEN j.chunks_total = 0 THEN 100 ELSE round(100.0 * j.chunks_done / j.chunks_total, 1) END)
+  FROM kpi_backfill_jobs j
+  WHERE j.id = p_job_id OR (p_job_id IS NULL AND j.id = (SELECT max(id) FROM kpi_backfill_jobs));
+$p$;
+
+-- Aynı veya daha geniş bir iş bekliyor/çalışıyorsa yenisi açılmaz, onun id'si döner.
+CREATE OR REPLACE FUNCTION public.kpi_backfill_enqueue(p_months_back integer DEFAULT 13)
+RETURNS bigint
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $q$
+DECLARE
+  v_id bigint;
+  n_groups integer;
+BEGIN
+  PERFORM pg_advisory_xact_lock(hashtext('kpi_backfill_enqueue'));
+  SELECT id INTO v_id FROM kpi_backfill_jobs
+  WHERE status IN ('queued', 'running') AND months_back >= p_months_back
+  ORDER BY id LIMIT 1;
+  IF v_id IS NOT NULL THEN
+    RETURN v_id;
+  END IF;
+  SELECT count(*) INTO n_groups FROM kpi_backfill_groups;
+  INSERT INTO kpi_backfill_jobs (months_back, to_month, group_count, chunks_total)
+  VALUES (p_months_back, date_trunc('month', now()), n_groups, p_months_back * n_groups)
+  RETURNING id INTO v_id;
+  RETURN v_id;
+END;
+$q$;
+
+-- En eski etkin işin sıradaki parçasını işler ve ilerlemeyi döner (iş yoksa NULL).
+-- Eşzamanlı backfill ile aynı danışma kilidini kullanır; kilit doluysa 'busy' döner, parça atlanmaz.
+CREATE OR REPLACE FUNCTION public.kpi_backfill_job_step()
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $st$
+DECLARE
+  j kpi_backfill_jobs;
+  v_fn regproc;
+  v_month timestamptz;
+  v_counts integer[];
+BEGIN
+  SELECT * INTO j FROM kpi_backfill_jobs WHERE status IN ('queued', 'running') ORDER BY id LIMIT 1;
+  IF j.id IS NULL THEN
+    RETURN NULL;
+  END IF;
+  IF NOT pg_try_advisory_xact_lock(hashtext('backfill_kpi_monthly_data')) THEN
+    RETURN kpi_backfill_job_progress(j.id) || jsonb_build_object('busy', true);
+  END IF;
+  -- Kilit alındıktan sonra güncel satır yeniden okunur (başka bir adım ilerletmiş olabilir).
+  SELECT * INTO j FROM kpi_backfill_jobs WHERE id = j.id;
+
+  IF j.status IN ('queued', 'running') AND j.chunks_done < j.chunks_total THEN
+    v_month := j.to_month - make_interval(months => j.chunks_done / j.group_count);
+    SELECT g.fn INTO v_fn FROM kpi_backfill_groups g WHERE g.ord = j.chunks_done % j.group_count + 1;
+    BEGIN
+      EXECUTE format('SELECT %s($1, $2, $3)', v_fn) INTO v_counts USING v_month, v_month, kpi_stats_sampled();
+      UPDATE kpi_backfill_jobs SET
+        status = 'running',
+        started_at = COALESCE(started_at, clock_timestamp()),
+        chunks_done = chunks_done + 1,
+        inserted = inserted + v_counts[1],
+        updated = updated + v_counts[2],
+        unchanged = unchanged + v_counts[3]
+      WHERE id = j.id
+      RETURNING * INTO j;
+    EXCEPTION WHEN OTHERS THEN
+      UPDATE kpi_backfill_jobs SET status = 'failed', error = SQLERRM, finished_at = clock_timestamp()
+      WHERE id = j.id
+      RETURNING * INTO j;
+    END;
+  END IF;
+
+  IF j.status IN ('queued', 'running') AND j.chunks_done >= j.chunks_total THEN
+    UPDATE kpi_backfill_jobs SET status = 'done', finished_at = clock_timestamp()
+    WHERE id = j.id
+    RETURNING * INTO j;
+    INSERT INTO kpi_backfill_state (id, months_back, started_at, finished_at, result)
+    VALUES (true, j.months_back, COALESCE(j.started_at, j.finished_at), j.finished_at, jsonb_build_object(
+      'success', true,
+      'records_updated', j.inserted + j.updated,
+      'inserted', j.inserted,
+      'updated', j.updated,
+      'unchanged', j.unchanged
+    ))
+    ON CONFLICT (id) DO UPDATE SET
+      months_back = EXCLUDED.months_back,
+      started_at = EXCLUDED.started_at,
+      finished_at = EXCLUDED.finished_at,
+      result = EXCLUDED.result;
+  END IF;
+  RETURN kpi_backfill_job_progress(j.id);
+END;
+$st$;
+
+-- İşçi: parça başına COMMIT (kilitler kısa tutulur, statement_timeout parça başına işler).
+-- Transaction denetimi için SECURITY DEFINER / SET içermez; pg_cron veya psql'den CALL edilir.
+CREATE OR REPLACE PROCEDURE public.kpi_backfill_worker(p_max_chunks integer DEFAULT NULL)
+LANGUAGE plpgsql
+AS $wk$
+DECLARE
+  v jsonb;
+  n integer := 0;
 BEGIN
-  FOR kpi_row IN
-    SELECT id, auto_kpi_id FROM kpis WHERE is_auto = true AND auto_kpi_id IS NOT NULL
   LOOP
-    FOR mo IN 0..p_months_back - 1 LOOP
-      m_start := date_trunc('month', now() - (mo || ' months')::interval);
-      m_end := m_start + interval '1 month';
-      t_year := extract(year from m_start)::integer;
-      t_month := extract(month from m_start)::integer;
-      calc_value := kpi_monthly_actual(kpi_row.auto_kpi_id, m_start, m_end);
-      IF calc_value IS NOT NULL THEN
-        INSERT INTO kpi_monthly_data (kpi_id, year, month, actual_value)
-        VALUES (kpi_row.id, t_year, t_month, calc_value)
-        ON CONFLICT (kpi_id, year, month)
-        DO UPDATE SET actual_value = EXCLUDED.actual_value, updated_at = now();
-        updated_count := updated_count + 1;
-      END IF;
-    END LOOP;
+    EXIT WHEN p_max_chunks IS NOT NULL AND n >= p_max_chunks;
+    v := public.kpi_backfill_job_step();
+    COMMIT;
+    EXIT WHEN v IS NULL OR (v ->> 'busy')::boolean IS TRUE;
+    n := n + 1;
   END LOOP;
-  RETURN jsonb_build_object('success', true, 'records_updated', updated_count);
+END;
+$wk$;
+
+DO $cron$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+    PERFORM cron.schedule('kpi-backfill-worker', '* * * * *', 'CALL public.kpi_backfill_worker()');
+  END IF;
+END;
+$cron$;
+
+-- Backfill: kaynak tablo başına tek INSERT ... SELECT; aynı tabloyu okuyan KPI'lar
+-- tüm aylar için tek taramada FILTER agregalarıyla hesaplanır. Değeri değişmeyen satırlar
+-- yeniden yazılmaz (audit/WAL yükü yok); eklenen/güncellenen/değişmeyen sayıları döner.
+-- Örneklenen koşularda her deyimin süresi, hesapladığı KPI'lar için kpi_compute_stats'a yazılır.
+-- Tek uçuş: son koşu p_max_age_seconds içinde bittiyse (ve en az p_months_back ayı kapsadıysa)
+-- hesaplamadan onun sonucu döner. Koşu sürerken gelen çağrılar danışma kilidinde bekler ve
+-- biten koşunun sonucunu alır; 'ran', 'coalesced' ve 'data_age_seconds' sunulan verinin kaynağını söyler.
+-- p_background (varsayılan: 13 aydan uzun geçmiş) işi kuyruğa ekler ve 'job_id' ile hemen döner;
+-- ilerleme kpi_backfill_job_progress(job_id) ile izlenir.
+DROP FUNCTION IF EXISTS public.backfill_kpi_monthly_data(integer);
+DROP FUNCTION IF EXISTS public.backfill_kpi_monthly_data(integer, integer);
+CREATE OR REPLACE FUNCTION public.backfill_kpi_monthly_data(
+  p_months_back integer DEFAULT 13,
+  p_max_age_seconds integer DEFAULT 300,
+  p_background boolean DEFAULT NULL)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $bf$
+DECLARE
+  v_state kpi_backfill_state;
+  v_coalesced boolean := false;
+  v_started timestamptz;
+  v_from timestamptz := date_trunc('month', now()) - make_interval(months => p_months_back - 1);
+  v_to timestamptz := now();
+  v_stats boolean := kpi_stats_sampled();
+  v_counts integer[];
+  v_job bigint;
+  g record;
+  inserted_count integer := 0;
+  updated_count integer := 0;
+  unchanged_count integer := 0;
+BEGIN
+  SELECT * INTO v_state FROM kpi_backfill_state;
+  IF v_state.months_back >= p_months_back
+     AND v_state.finished_at > clock_timestamp() - make_interval(secs => p_max_age_seconds) THEN
+    RETURN v_state.result || jsonb_build_object('ran', false, 'coalesced', false,
+      'data_age_seconds', round(extract(epoch FROM clock_timestamp() - v_state.finished_at)));
+  END IF;
+
+  IF COALESCE(p_background, p_months_back > 13) THEN
+    v_job := kpi_backfill_enqueue(p_months_back);
+    RETURN jsonb_build_object('success', true, 'ran', false, 'queued', true, 'job_id', v_job,
+      'progress', kpi_backfill_job_progress(v_job));
+  END IF;
+
+  -- Koşu sürüyorsa bitmesini bekle; kilit alındığında onun sonucu görünür.
+  IF NOT pg_try_advisory_xact_lock(hashtext('backfill_kpi_monthly_data')) THEN
+    PERFORM pg_advisory_xact_lock(hashtext('backfill_kpi_monthly_data'));
+    v_coalesced := true;
+    SELECT * INTO v_state FROM kpi_backfill_state;
+    IF v_state.months_back >= p_months_back
+       AND v_state.finished_at > clock_timestamp() - make_interval(secs => p_max_age_seconds) THEN
+      RETURN v_state.result || jsonb_build_object('ran', false, 'coalesced', true,
+        'data_age_seconds', round(extract(epoch FROM clock_timestamp() - v_state.finished_at)));
+    END IF;
+  END IF;
+  v_started := clock_timestamp();
+
+  FOR g IN SELECT fn FROM kpi_backfill_groups ORDER BY ord LOOP
+    EXECUTE format('SELECT %s($1, $2, $3)', g.fn) INTO v_counts USING v_from, v_to, v_stats;
+    inserted_count := inserted_count + v_counts[1];
+    updated_count := updated_count + v_counts[2];
+    unchanged_count := unchanged_count + v_counts[3];
+  END LOOP;
+
+  INSERT INTO kpi_backfill_state (id, months_back, started_at, finished_at, result)
+  VALUES (true, p_months_back, v_started, clock_timestamp(), jsonb_build_object(
+    'success', true,
+    'records_updated', inserted_count + updated_count,
+    'inserted', inserted_count,
+    'updated', updated_count,
+    'unchanged', unchanged_count
+  ))
+  ON CONFLICT (id) DO UPDATE SET
+    months_back = EXCLUDED.months_back,
+    started_at = EXCLUDED.started_at,
+    finished_at = EXCLUDED.finished_at,
+    result = EXCLUDED.result
+  RETURNING * INTO v_state;
+  RETURN v_state.result || jsonb_build_object('ran', true, 'coalesced', v_coalesced, 'data_age_seconds', 0);
 END;
 $bf$;
 
-CREATE OR REPLACE FUNCTION public.sync_kpi_current_from_monthly()
+""")
+
+
+@dataclass(frozen=True)
+class Index:
+    """Supporting index derived from the KPI spec."""
+
+    name: str
+    table: str
+    key: str
+    where: str = ""
+
+    def sql(self) -> str:
+        key = self.key if re.fullmatch(r"\w+", self.key) else f"({self.key})"
+        where = f" WHERE {self.where}" if self.where else ""
+        return f"CREATE INDEX IF NOT EXISTS {self.name} ON public.{self.table} ({key}){where}"
+
+
+# Daha önceki migration'larda zaten var olan (tablo, anahtar) indeksleri.
+EXISTING_INDEXES = {("nonconformity_records", "created_at")}
+
+
+def kpi_indexes() -> List[Index]:
+    """Indexes the period filters of the canonical KPIs need.
+
+    Flow KPIs get one index on the time column per table; it is partial when every KPI
+    reading that column has the same static filter. Month-end snapshot KPIs scan
+    ``key < m_end`` (nearly the whole table), so they only get an index when a static
+    filter (e.g. open status) makes a partial index selective.
+    """
+    flow: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+    out: Dict[Tuple[str, str, str], Index] = {}
+    for k, _ in canonical_kpis():
+        if not k.plain or not k.index_key:
+            continue
+        pred = k.unaliased(" AND ".join(k.filters))
+        if k.kind == "flow":
+            flow.setdefault((k.table, k.index_key), []).append((k.kid, pred))
+        elif pred:
+            out.setdefault((k.table, k.index_key, pred), Index(f"idx_kpi_{k.kid}", k.table, k.index_key, pred))
+    for (table, key), uses in flow.items():
+        preds = {pred for _, pred in uses}
+        if len(preds) == 1 and "" not in preds:
+            pred = preds.pop()
+            out.setdefault((table, key, pred), Index(f"idx_kpi_{uses[0][0]}", table, key, pred))
+        elif (table, key) not in EXISTING_INDEXES:
+            slug = re.sub(r"\W+", "_", key.lower()).strip("_")
+            out.setdefault((table, key, ""), Index(f"idx_kpi_{table}_{slug}", table, key))
+    return [Index(ix.name[:63], ix.table, ix.key, ix.where) for ix in out.values()]
+
+
+def emit_indexes(w: Callable[[str], None]) -> None:
+    by_table: Dict[str, List[Index]] = {}
+    for ix in kpi_indexes():
+        by_table.setdefault(ix.table, []).append(ix)
+    w("""-- KPI destek indeksleri: KPI tanımlarından (zaman kolonu + sabit filtre) türetilir.
+DO $idx$
+BEGIN""")
+    for table, ixs in by_table.items():
+        stmts = "\n".join(f"      {ix.sql()};" for ix in ixs)
+        w(f"""  IF to_regclass('public.{table}') IS NOT NULL THEN
+    BEGIN
+{stmts}
+    EXCEPTION WHEN undefined_column THEN
+      RAISE WARNING 'kpi indeksleri: % atlandı: %', '{table}', SQLERRM;
+    END;
+  END IF;""")
+    w("""END;
+$idx$;
+""")
+
+
+def rollup_delta(r: Rollup, rel: str, sign: int) -> str:
+    cols = "".join(f", {c}" for c, _ in r.dims) + "".join(
+        f", {'-' if sign < 0 else ''}COALESCE({c}, 0) AS {c}" for c in r.sums)
+    return f"SELECT {r.day(r.time_col)} AS day{cols}, {sign} AS n_rows FROM {rel} WHERE {r.time_col} IS NOT NULL"
+
+
+def rollup_rows_full(r: Rollup) -> str:
+    """SELECT producing the rollup's rows (day, dims, sums, n_rows) from the raw table."""
+    cols = "".join(f", {c}" for c, _ in r.dims) + "".join(f", COALESCE(SUM({c}), 0) AS {c}" for c in r.sums)
+    return f"""SELECT {r.day(r.time_col)} AS day{cols}, COUNT(*) AS n_rows
+    FROM public.{r.table}
+    WHERE {r.time_col} IS NOT NULL
+    GROUP BY {", ".join(str(i) for i in range(1, len(r.dims) + 2))}"""
+
+
+def rollup_fill(r: Rollup) -> str:
+    """Rebuilds the rollup from the raw table."""
+    names = ", ".join(["day"] + r.columns + ["n_rows"])
+    return f"""DELETE FROM public.{r.name};
+    INSERT INTO public.{r.name} ({names})
+    {rollup_rows_full(r)};"""
+
+
+def emit_rollups(w: Callable[[str], None]) -> None:
+    for r in ROLLUPS:
+        key = ", ".join(["day"] + [d for d, _ in r.dims])
+        cols = "".join(f"    {d} {t},\n" for d, t in r.dims) + "".join(f"    {c} numeric NOT NULL DEFAULT 0,\n" for c in r.sums)
+        names = ", ".join(["day"] + r.columns + ["n_rows"])
+        sums = "".join(f", SUM(d.{c})" for c in r.sums)
+        dims = "".join(f", d.{c}" for c, _ in r.dims)
+        merge = ",\n    ".join(f"{c} = t.{c} + EXCLUDED.{c}" for c in ["n_rows"] + list(r.sums))
+        changed = " OR ".join([f"SUM(d.{c}) <> 0" for c in ["n_rows"] + list(r.sums)])
+
+        def upsert(*deltas: str) -> str:
+            rows = "\n      UNION ALL\n      ".join(deltas)
+            return f"""INSERT INTO {r.name} AS t ({names})
+    SELECT d.day{dims}{sums}, SUM(d.n_rows)
+    FROM (
+      {rows}
+    ) d
+    GROUP BY d.day{dims}
+    HAVING {changed}
+    ON CONFLICT ({key}) DO UPDATE SET
+    {merge};"""
+
+        day = r.time_col if r.date_col else f"{r.time_col} UTC günü"
+        w(f"""-- Günlük özet: {r.table} ({day}{''.join(', ' + d for d, _ in r.dims)}); tetikleyicilerle güncel tutulur.
+CREATE TABLE IF NOT EXISTS public.{r.name} (
+    day date NOT NULL,
+{cols}    n_rows bigint NOT NULL DEFAULT 0,
+    CONSTRAINT {r.name}_key UNIQUE NULLS NOT DISTINCT ({key})
+);
+
+ALTER TABLE public.{r.name} ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "{r.name}_select" ON public.{r.name};
+CREATE POLICY "{r.name}_select"
+  ON public.{r.name} FOR SELECT TO authenticated USING (true);
+
+CREATE OR REPLACE FUNCTION public.{r.name}_sync()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $trg$
+BEGIN
+  IF TG_OP = 'TRUNCATE' THEN
+    DELETE FROM {r.name};
+  ELSIF TG_OP = 'INSERT' THEN
+    {upsert(rollup_delta(r, "new_rows", 1))}
+  ELSIF TG_OP = 'DELETE' THEN
+    {upsert(rollup_delta(r, "old_rows", -1))}
+  ELSE
+    {upsert(rollup_delta(r, "new_rows", 1), rollup_delta(r, "old_rows", -1))}
+  END IF;
+  RETURN NULL;
+END;
+$trg$;
+
+DO $roll$
+BEGIN
+  IF to_regclass('public.{r.table}') IS NOT NULL THEN
+    LOCK TABLE public.{r.table} IN SHARE ROW EXCLUSIVE MODE;
+    DROP TRIGGER IF EXISTS trg_{r.name}_ins ON public.{r.table};
+    DROP TRIGGER IF EXISTS trg_{r.name}_upd ON public.{r.table};
+    DROP TRIGGER IF EXISTS trg_{r.name}_del ON public.{r.table};
+    DROP TRIGGER IF EXISTS trg_{r.name}_trunc ON public.{r.table};
+    CREATE TRIGGER trg_{r.name}_ins AFTER INSERT ON public.{r.table}
+      REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION public.{r.name}_sync();
+    CREATE TRIGGER trg_{r.name}_upd AFTER UPDATE ON public.{r.table}
+      REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION public.{r.name}_sync();
+    CREATE TRIGGER trg_{r.name}_del AFTER DELETE ON public.{r.table}
+      REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION public.{r.name}_sync();
+    CREATE TRIGGER trg_{r.name}_trunc AFTER TRUNCATE ON public.{r.table}
+      FOR EACH STATEMENT EXECUTE FUNCTION public.{r.name}_sync();
+    {rollup_fill(r)}
+  END IF;
+END;
+$roll$;
+""")
+
+
+def maintained_fill(d: Union[Latest, EventPairs]) -> str:
+    """Rebuilds a maintained table (Latest / EventPairs) from its raw table."""
+    return f"""DELETE FROM public.{d.name};
+    INSERT INTO public.{d.name} ({", ".join(d.columns)})
+    {d.rows()};"""
+
+
+def emit_maintained(w: Callable[[str], None]) -> None:
+    for d in MAINTAINED:
+        names = ", ".join(d.columns)
+        indexes = "\n".join(
+            f"    CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON public.{d.name} ({cols});"
+            for name, cols, unique in d.indexes)
+
+        def refresh(keys: str) -> str:
+            return f"""DELETE FROM {d.name} WHERE {d.key} IN ({keys});
+    INSERT INTO {d.name} ({names})
+    {d.rows(keys)};"""
+
+        def keys(*rels: str) -> str:
+            return " UNION ".join(f"SELECT {d.key} FROM {rel}" for rel in rels)
+
+        def lock(keys: str) -> str:
+            # Kilitler kimlik sırasıyla alınır: aynı anahtarları yazan iki işlem kilitlenmeye girmez.
+            return f"""PERFORM pg_advisory_xact_lock(l.id)
+    FROM (
+      SELECT DISTINCT hashtext('{d.name}:' || k.{d.key}::text) AS id
+      FROM ({keys}) k
+      WHERE k.{d.key} IS NOT NULL
+      ORDER BY 1
+    ) l;"""
+
+        w(f"""-- {d.title}; tetikleyicilerle güncel tutulur.
+CREATE OR REPLACE FUNCTION public.{d.name}_sync()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $trg$
+BEGIN
+  -- Aynı anahtara eşzamanlı yazan işlemler anahtar başına danışma kilidiyle sırayla yeniden hesaplar
+  -- (silinip eklenen satırlar çakışmasın); farklı anahtarlara yazanlar birbirini beklemez. Kilitten
+  -- sonraki her sorgu yeni anlık görüntü alır, önceki işlemin satırlarını görür.
+  IF TG_OP = 'TRUNCATE' THEN
+    DELETE FROM {d.name};
+  ELSIF TG_OP = 'INSERT' THEN
+    {lock(keys("new_rows"))}
+    {refresh(keys("new_rows"))}
+  ELSIF TG_OP = 'DELETE' THEN
+    {lock(keys("old_rows"))}
+    {refresh(keys("old_rows"))}
+  ELSE
+    {lock(keys("new_rows", "old_rows"))}
+    {refresh(keys("new_rows", "old_rows"))}
+  END IF;
+  RETURN NULL;
+END;
+$trg$;
+
+DO $maint$
+BEGIN
+  IF to_regclass('public.{d.table}') IS NOT NULL THEN
+    -- Kolon tipleri kaynak tablodan alınır.
+    CREATE TABLE IF NOT EXISTS public.{d.name} AS
+    {d.rows()}
+    WITH NO DATA;
+{indexes}
+    CREATE INDEX IF NOT EXISTS idx_kpi_{d.table}_{d.key} ON public.{d.table} ({d.key});
+    ALTER TABLE public.{d.name} ENABLE ROW LEVEL SECURITY;
+    DROP POLICY IF EXISTS "{d.name}_select" ON public.{d.name};
+    CREATE POLICY "{d.name}_select"
+      ON public.{d.name} FOR SELECT TO authenticated USING (true);
+
+    LOCK TABLE public.{d.table} IN SHARE ROW EXCLUSIVE MODE;
+    DROP TRIGGER IF EXISTS trg_{d.name}_ins ON public.{d.table};
+    DROP TRIGGER IF EXISTS trg_{d.name}_upd ON public.{d.table};
+    DROP TRIGGER IF EXISTS trg_{d.name}_del ON public.{d.table};
+    DROP TRIGGER IF EXISTS trg_{d.name}_trunc ON public.{d.table};
+    CREATE TRIGGER trg_{d.name}_ins AFTER INSERT ON public.{d.table}
+      REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION public.{d.name}_sync();
+    CREATE TRIGGER trg_{d.name}_upd AFTER UPDATE ON public.{d.table}
+      REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION public.{d.name}_sync();
+    CREATE TRIGGER trg_{d.name}_del AFTER DELETE ON public.{d.table}
+      REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION public.{d.name}_sync();
+    CREATE TRIGGER trg_{d.name}_trunc AFTER TRUNCATE ON public.{d.table}
+      FOR EACH STATEMENT EXECUTE FUNCTION public.{d.name}_sync();
+    {maintained_fill(d)}
+  END IF;
+END;
+$maint$;
+""")
+
+
+def value_fn(k: Kpi) -> str:
+    return f"kpi_value_{k.kid}"
+
+
+def rolling_fn(k: Kpi) -> str:
+    return f"kpi_rolling_{k.kid}"
+
+
+def buckets_fn(k: Kpi) -> str:
+    return f"kpi_buckets_{k.kid}"
+
+
+def actual_fn(k: Kpi) -> str:
+    return f"kpi_actual_{k.kid}"
+
+
+def series_fn(k: Kpi) -> str:
+    return f"kpi_series_{k.kid}"
+
+
+def emit_kpi_functions(w: Callable[[str], None]) -> None:
+    """Per distinct definition (aliases share the canonical's):
+
+    - kpi_value_<id>: the query itself as a one-row STABLE sql table function with no
+      SECURITY DEFINER / SET clause, so the planner inlines it when it is called in FROM
+      (e.g. ``kpi_months(...) m CROSS JOIN LATERAL kpi_value_x(m.m_start, m.m_end)``).
+      It runs with the caller's rights and search_path.
+    - kpi_actual_<id>: SECURITY DEFINER scalar wrapper for RPC and the dispatcher.
+    - kpi_series_<id>: all months from one scan.
+    - kpi_rolling_<id> / kpi_buckets_<id> (KPIs with a daily rollup): trailing N-day windows
+      for each day, and day / week / month / quarter buckets, all from the daily rollup.
+    """
+    rollups = rollup_of()
+    for k, _ in canonical_kpis():
+        w(f"""CREATE OR REPLACE FUNCTION public.{value_fn(k)}(m_start timestamptz, m_end timestamptz)
+RETURNS TABLE(actual_value numeric)
+LANGUAGE sql
+STABLE
+AS $f$
+  {kpi_query(k)};
+$f$;
+
+CREATE OR REPLACE FUNCTION public.{actual_fn(k)}(m_start timestamptz, m_end timestamptz)
+RETURNS numeric
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $f$
+  SELECT actual_value FROM public.{value_fn(k)}(m_start, m_end);
+$f$;
+
+CREATE OR REPLACE FUNCTION public.{series_fn(k)}(p_from timestamptz, p_to timestamptz)
+RETURNS TABLE(month_start timestamptz, month_value numeric)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $f$
+  {series_query(k)};
+$f$;
+""")
+        r = rollups.get(k.kid)
+        if r and daily_terms(k):
+            w(f"""CREATE OR REPLACE FUNCTION public.{rolling_fn(k)}(p_from date, p_to date, p_window integer DEFAULT 30)
+RETURNS TABLE(day date, value numeric)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $f$
+  {rolling_query(k, r)};
+$f$;
+
+CREATE OR REPLACE FUNCTION public.{buckets_fn(k)}(p_grain text, p_from date, p_to date)
+RETURNS TABLE(period_start date, value numeric)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $f$
+  {buckets_query(k, r)};
+$f$;
+""")
+
+
+def emit_stats(w: Callable[[str], None]) -> None:
+    """kpi_compute_stats: sampled per-KPI timings of the dispatchers and the backfill, and the
+    kpi_compute_stats_summary view ranking KPIs by p95. Off until kpi_compute_stats_settings.enabled."""
+    w("""-- KPI hesap süreleri (profil): dispatcher ve backfill örneklenen çağrılarda KPI başına
+-- dönem, süre ve sonucu yazar. Varsayılan kapalı; açmak için:
+--   UPDATE kpi_compute_stats_settings SET enabled = true, sample_rate = 0.1;
+CREATE TABLE IF NOT EXISTS public.kpi_compute_stats_settings (
+    id boolean PRIMARY KEY DEFAULT true CHECK (id),
+    enabled boolean NOT NULL DEFAULT false,
+    sample_rate numeric NOT NULL DEFAULT 0.1 CHECK (sample_rate >= 0 AND sample_rate <= 1),
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+INSERT INTO public.kpi_compute_stats_settings (id) VALUES (true) ON CONFLICT (id) DO NOTHING;
+
+-- batch_size: aynı taramada birlikte hesaplanan KPI sayısı (backfill); süre o taramanın tamamıdır.
+-- Backfill satırlarında actual_value boştur (dönem birden çok aydır).
+CREATE TABLE IF NOT EXISTS public.kpi_compute_stats (
+    id bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    auto_kpi_id text NOT NULL,
+    source text NOT NULL CHECK (source IN ('actual', 'backfill')),
+    period_start timestamptz NOT NULL,
+    period_end timestamptz NOT NULL,
+    elapsed_ms numeric NOT NULL,
+    actual_value numeric,
+    batch_size integer NOT NULL DEFAULT 1,
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_kpi_compute_stats_created_at ON public.kpi_compute_stats (created_at);
+
+ALTER TABLE public.kpi_compute_stats_settings ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "kpi_compute_stats_settings_select" ON public.kpi_compute_stats_settings;
+CREATE POLICY "kpi_compute_stats_settings_select"
+  ON public.kpi_compute_stats_settings FOR SELECT TO authenticated USING (true);
+ALTER TABLE public.kpi_compute_stats ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "kpi_compute_stats_select" ON public.kpi_compute_stats;
+CREATE POLICY "kpi_compute_stats_select"
+  ON public.kpi_compute_stats FOR SELECT TO authenticated USING (true);
+
+-- Salt okunur işlemlerde (READ ONLY, replika, PostgREST GET) örnek alınmaz: INSERT hata verirdi.
+CREATE OR REPLACE FUNCTION public.kpi_stats_sampled()
+RETURNS boolean
+LANGUAGE sql
+VOLATILE
+SET search_path = public
+AS $s$
+  SELECT current_setting('transaction_read_only') = 'off'
+     AND COALESCE((SELECT enabled AND random() < sample_rate FROM kpi_compute_stats_settings), false);
+$s$;
+
+CREATE OR REPLACE FUNCTION public.kpi_stats_record(
+  p_kids text[], p_source text, p_from timestamptz, p_to timestamptz, p_t0 timestamptz, p_value numeric)
 RETURNS void
+LANGUAGE sql
+VOLATILE
+SECURITY DEFINER
+SET search_path = public
+AS $s$
+  INSERT INTO kpi_compute_stats (auto_kpi_id, source, period_start, period_end, elapsed_ms, actual_value, batch_size)
+  SELECT kid, p_source, p_from, p_to,
+         round((extract(epoch FROM clock_timestamp() - p_t0) * 1000)::numeric, 3), p_value, cardinality(p_kids)
+  FROM unnest(p_kids) kid;
+$s$;
+
+-- Son 30 günün KPI başına süre dağılımı, p95'e göre yavaştan hızlıya.
+CREATE OR REPLACE VIEW public.kpi_compute_stats_summary
+WITH (security_invoker = true) AS
+SELECT
+  s.auto_kpi_id,
+  s.source,
+  count(*) AS calls,
+  round(avg(s.elapsed_ms), 3) AS avg_ms,
+  round(percentile_cont(0.5) WITHIN GROUP (ORDER BY s.elapsed_ms)::numeric, 3) AS p50_ms,
+  round(percentile_cont(0.95) WITHIN GROUP (ORDER BY s.elapsed_ms)::numeric, 3) AS p95_ms,
+  max(s.elapsed_ms) AS max_ms,
+  max(s.created_at) AS last_at,
+  rank() OVER (PARTITION BY s.source ORDER BY percentile_cont(0.95) WITHIN GROUP (ORDER BY s.elapsed_ms) DESC) AS p95_rank
+FROM public.kpi_compute_stats s
+WHERE s.created_at >= now() - interval '30 days'
+GROUP BY s.auto_kpi_id, s.source
+ORDER BY s.source, p95_rank;
+""")
+
+
+def emit_registry(w: Callable[[str], None]) -> None:
+    canon = canonical_of()
+    rollups = rollup_of()
+
+    def daily(c: Kpi, fn: Callable[[Kpi], str]) -> str:
+        return f"'public.{fn(c)}'" if c.kid in rollups and daily_terms(c) else "NULL"
+
+    rows = ",\n".join(
+        f"  ('{k.kid}', '{c.kid}', 'public.{actual_fn(c)}', 'public.{series_fn(c)}', "
+        f"{daily(c, rolling_fn)}, {daily(c, buckets_fn)}, '{c.table}')"
+        for k in KPIS for c in [canon[k.kid]])
+    kids = ", ".join(f"'{k.kid}'" for k in KPIS)
+    w(f"""-- KPI kayıt defteri: auto_kpi_id -> KPI fonksiyonları (dispatcher tek satır okur).
+-- Aynı tanımlı KPI'lar (takma adlar) kanonik KPI'nın fonksiyonlarını paylaşır.
+CREATE TABLE IF NOT EXISTS public.kpi_registry (
+    auto_kpi_id text PRIMARY KEY,
+    canonical_kpi_id text NOT NULL,
+    actual_fn regproc NOT NULL,
+    series_fn regproc NOT NULL,
+    rolling_fn regproc,
+    buckets_fn regproc,
+    source_table text NOT NULL,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+ALTER TABLE public.kpi_registry ADD COLUMN IF NOT EXISTS canonical_kpi_id text;
+ALTER TABLE public.kpi_registry ADD COLUMN IF NOT EXISTS rolling_fn regproc;
+ALTER TABLE public.kpi_registry ADD COLUMN IF NOT EXISTS buckets_fn regproc;
+
+ALTER TABLE public.kpi_registry ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "kpi_registry_select" ON public.kpi_registry;
+CREATE POLICY "kpi_registry_select"
+  ON public.kpi_registry FOR SELECT TO authenticated USING (true);
+
+INSERT INTO public.kpi_registry (auto_kpi_id, canonical_kpi_id, actual_fn, series_fn, rolling_fn, buckets_fn, source_table) VALUES
+{rows}
+ON CONFLICT (auto_kpi_id) DO UPDATE SET
+  canonical_kpi_id = EXCLUDED.canonical_kpi_id,
+  actual_fn = EXCLUDED.actual_fn,
+  series_fn = EXCLUDED.series_fn,
+  rolling_fn = EXCLUDED.rolling_fn,
+  buckets_fn = EXCLUDED.buckets_fn,
+  source_table = EXCLUDED.source_table,
+  updated_at = now();
+
+DELETE FROM public.kpi_registry WHERE auto_kpi_id NOT IN ({kids});
+""")
+
+
+def build_sql() -> str:
+    out: List[str] = []
+    w = out.append
+    w("""-- KPI aylık gerçekleşen: tüm otomatik KPI id'leri için dönem [m_start, m_end)
+-- + çok aylı seri + backfill + güncel değer senkronu (kpis.current_value)
+-- KPI başına ayrı fonksiyon; gövdeler çağrıda doğrulanır (eksik modül tablosu kurulumu bozmasın).
+SET check_function_bodies = off;
+
+-- Ay listesi: p_from ve p_to'nun ayları dahil, ay başı sınırları [m_start, m_end)
+CREATE OR REPLACE FUNCTION public.kpi_months(p_from timestamptz, p_to timestamptz)
+RETURNS TABLE(m_start timestamptz, m_end timestamptz)
+LANGUAGE sql
+STABLE
+AS $m$
+  SELECT m, m + interval '1 month'
+  FROM generate_series(date_trunc('month', p_from), date_trunc('month', p_to), interval '1 month') m;
+$m$;
+
+-- Günlük özetten toplanabilen dönem adımları (day / week / month / quarter); bilinmeyen için NULL.
+CREATE OR REPLACE FUNCTION public.kpi_grain_interval(p_grain text)
+RETURNS interval
+LANGUAGE sql
+IMMUTABLE
+AS $g$
+  SELECT CASE p_grain
+    WHEN 'day' THEN interval '1 day'
+    WHEN 'week' THEN interval '1 week'
+    WHEN 'month' THEN interval '1 month'
+    WHEN 'quarter' THEN interval '3 months'
+  END;
+$g$;
+""")
+    emit_rollups(w)
+    emit_maintained(w)
+    # Bakımlı tablolar (ör. inspection_control_durations) önce kurulur ki indeksleri de türetilsin.
+    emit_indexes(w)
+    emit_kpi_functions(w)
+    emit_registry(w)
+
+    emit_stats(w)
+
+    w("""-- Örneklenen çağrılar kpi_compute_stats'a yazabildiği için VOLATILE: planlayıcı sorgu başına
+-- tek değer varsaymaz ve PostgREST bu fonksiyonları GET ile salt okunur işlemde çağırır
+-- (kpi_stats_sampled orada false döner, hiçbir şey yazılmaz).
+CREATE OR REPLACE FUNCTION public.kpi_monthly_actual(p_kid text, m_start timestamptz, m_end timestamptz)
+RETURNS numeric
+LANGUAGE plpgsql
+VOLATILE
+SECURITY DEFINER
+SET search_path = public
+AS $kpi$
+DECLARE
+  fn regproc;
+  canon text;
+  v numeric;
+  t0 timestamptz := clock_timestamp();
+BEGIN
+  SELECT r.actual_fn, r.canonical_kpi_id INTO fn, canon FROM kpi_registry r WHERE r.auto_kpi_id = p_kid;
+  IF fn IS NULL THEN
+    RETURN NULL;
+  END IF;
+  EXECUTE format('SELECT %s($1, $2)', fn) INTO v USING m_start, m_end;
+  IF kpi_stats_sampled() THEN
+    PERFORM kpi_stats_record(ARRAY[canon], 'actual', m_start, m_end, t0, v);
+  END IF;
+  RETURN v;
+END;
+$kpi$;
+
+-- Toplu okuma: istenen KPI'lar için her kanonik fonksiyon dönem başına bir kez çalışır,
+-- sonuç tüm takma adlara dağıtılır.
+CREATE OR REPLACE FUNCTION public.kpi_monthly_actual_many(p_kids text[], m_start timestamptz, m_end timestamptz)
+RETURNS TABLE(auto_kpi_id text, actual_value numeric)
+LANGUAGE plpgsql
+VOLATILE
+SECURITY DEFINER
+SET search_path = public
+AS $many$
+DECLARE
+  r record;
+  v numeric;
+  v_stats boolean := kpi_stats_sampled();
+  t0 timestamptz;
+BEGIN
+  FOR r IN
+    SELECT g.actual_fn, min(g.canonical_kpi_id) AS canon, array_agg(g.auto_kpi_id) AS kids
+    FROM kpi_registry g
+    WHERE g.auto_kpi_id = ANY (p_kids)
+    GROUP BY g.actual_fn
+  LOOP
+    t0 := clock_timestamp();
+    EXECUTE format('SELECT %s($1, $2)', r.actual_fn) INTO v USING m_start, m_end;
+    IF v_stats THEN
+      PERFORM kpi_stats_record(ARRAY[r.canon], 'actual', m_start, m_end, t0, v);
+    END IF;
+    RETURN QUERY SELECT unnest(r.kids), v;
+  END LOOP;
+END;
+$many$;
+
+-- Çok aylı seri: kpi_monthly_actual ile aynı değerler, KPI başına tek gruplanmış tarama
+CREATE OR REPLACE FUNCTION public.kpi_monthly_series(p_kid text, p_from timestamptz, p_to timestamptz)
+RETURNS TABLE(month_start timestamptz, month_value numeric)
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $series$
+DECLARE
+  fn regproc;
+BEGIN
+  SELECT r.series_fn INTO fn FROM kpi_registry r WHERE r.auto_kpi_id = p_kid;
+  IF fn IS NOT NULL THEN
+    RETURN QUERY EXECUTE format('SELECT * FROM %s($1, $2)', fn) USING p_from, p_to;
+  END IF;
+END;
+$series$;
+
+-- Günlük motor (günlük özeti olan KPI'lar): gün başına son p_window UTC gününün değeri
+-- (ör. gerçek kayan 30 gün) ve gün / hafta / ay / çeyrek kovaları; ham satır yeniden taranmaz.
+CREATE OR REPLACE FUNCTION public.kpi_rolling_series(p_kid text, p_from date, p_to date, p_window integer DEFAULT 30)
+RETURNS TABLE(day date, value numeric)
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $rolling$
+DECLARE
+  fn regproc;
+BEGIN
+  IF p_window IS NULL OR p_window < 1 THEN
+    RAISE EXCEPTION 'kpi_rolling_series: p_window >= 1 olmalı (%)', p_window USING ERRCODE = 'invalid_parameter_value';
+  END IF;
+  SELECT r.rolling_fn INTO fn FROM kpi_registry r WHERE r.auto_kpi_id = p_kid;
+  IF fn IS NOT NULL THEN
+    RETURN QUERY EXECUTE format('SELECT * FROM %s($1, $2, $3)', fn) USING p_from, p_to, p_window;
+  END IF;
+END;
+$rolling$;
+
+CREATE OR REPLACE FUNCTION public.kpi_bucket_series(p_kid text, p_grain text, p_from date, p_to date)
+RETURNS TABLE(period_start date, value numeric)
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $buckets$
+DECLARE
+  fn regproc;
+BEGIN
+  IF kpi_grain_interval(p_grain) IS NULL THEN
+    RAISE EXCEPTION 'kpi_bucket_series: bilinmeyen dönem %', p_grain USING ERRCODE = 'invalid_parameter_value';
+  END IF;
+  SELECT r.buckets_fn INTO fn FROM kpi_registry r WHERE r.auto_kpi_id = p_kid;
+  IF fn IS NOT NULL THEN
+    RETURN QUERY EXECUTE format('SELECT * FROM %s($1, $2, $3)', fn) USING p_grain, p_from, p_to;
+  END IF;
+END;
+$buckets$;
+
+""")
+    emit_snapshot(w)
+    emit_current_snapshot(w)
+    emit_backfill(w)
+
+    w("""-- Güncel değer: bu ayın değeri, yoksa en son dolu ay; KPI başına tek indeks okuması.
+-- Yalnız değeri değişen satırlar yazılır (ölü tuple / audit tetikleyicisi yok); değişen satır sayısı döner.
+DROP FUNCTION IF EXISTS public.sync_kpi_current_from_monthly();
+CREATE OR REPLACE FUNCTION public.sync_kpi_current_from_monthly()
+RETURNS integer
 LANGUAGE plpgsql
 SECURITY DEFINER
 SET search_path = public
@@ -271,20 +1963,195 @@ AS $sync$
 DECLARE
   cy int := extract(year from current_date)::int;
   cm int := extract(month from current_date)::int;
+  changed integer;
 BEGIN
   UPDATE public.kpis k
-  SET current_value = COALESCE(
-    (SELECT d.actual_value FROM kpi_monthly_data d WHERE d.kpi_id = k.id AND d.year = cy AND d.month = cm AND d.actual_value IS NOT NULL),
-    (SELECT d2.actual_value FROM kpi_monthly_data d2 WHERE d2.kpi_id = k.id AND d2.actual_value IS NOT NULL ORDER BY d2.year DESC, d2.month DESC LIMIT 1)
-  ),
-  updated_at = now()
-  WHERE k.is_auto = true;
+  SET current_value = v.actual_value,
+      updated_at = now()
+  FROM public.kpis a
+  LEFT JOIN LATERAL (
+    SELECT d.actual_value
+    FROM kpi_monthly_data d
+    WHERE d.kpi_id = a.id AND d.actual_value IS NOT NULL
+    ORDER BY (d.year = cy AND d.month = cm) DESC, d.year DESC, d.month DESC
+    LIMIT 1
+  ) v ON true
+  WHERE a.id = k.id
+    AND k.is_auto = true
+    AND k.current_value IS DISTINCT FROM v.actual_value;
+  GET DIAGNOSTICS changed = ROW_COUNT;
+  RETURN changed;
 END;
 $sync$;
 """)
 
-    text = "\n".join(out)
-    print(text)
+    return "\n".join(out)
+
+
+# Parça başına (BEGIN/COMMIT ve uygulandı kaydı dahil) varsayılan bayt bütçesi.
+PART_BYTES = 30000
+DOLLAR_RE = re.compile(r"\$(?:[A-Za-z_]\w*)?\$")
+RERUNNABLE_RE = re.compile(
+    r"(?:CREATE OR REPLACE|CREATE (?:UNIQUE )?INDEX IF NOT EXISTS|CREATE TABLE IF NOT EXISTS|DROP \w+ IF EXISTS"
+    r"|ALTER TABLE \S+ (?:ADD COLUMN IF NOT EXISTS|ENABLE ROW LEVEL SECURITY)|DO|DELETE FROM|SET"
+    r"|INSERT INTO .*\bON CONFLICT\b)\b", re.S)
+
+
+def split_statements(sql: str) -> List[str]:
+    """Top-level statements of sql (string literals, quoted names, comments and dollar quotes
+    respected); comments preceding a statement stay with it."""
+    out: List[str] = []
+    start = i = 0
+    while i < len(sql):
+        c = sql[i]
+        if sql.startswith("--", i):
+            i = sql.find("\n", i)
+            i = len(sql) if i < 0 else i
+        elif sql.startswith("/*", i):
+            i = sql.index("*/", i) + 2
+            continue
+        elif c in "'\"":
+            i = sql.index(c, i + 1)
+        elif c == "$" and (m := DOLLAR_RE.match(sql, i)):
+            i = sql.index(m.group(0), m.end()) + len(m.group(0))
+            continue
+        elif c == ";":
+            out.append(sql[start:i + 1].strip())
+            start = i + 1
+        i += 1
+    rest = sql[start:].strip()
+    if "\n".join(ln for ln in rest.splitlines() if not ln.lstrip().startswith("--")).strip():
+        raise ValueError(f"unterminated statement: {rest[:80]!r}")
+    return out
+
+
+def statement_head(stmt: str) -> str:
+    """The statement without its leading comments, whitespace-normalised."""
+    lines = stmt.splitlines()
+    while lines and (not lines[0].strip() or lines[0].lstrip().startswith("--")):
+        lines.pop(0)
+    return " ".join(" ".join(lines).split())
+
+
+def check_rerunnable(stmts: List[str]) -> None:
+    """Every statement must be safe to run twice; CREATE POLICY only right after its DROP POLICY IF EXISTS."""
+    prev = ""
+    for stmt in stmts:
+        head = statement_head(stmt)
+        policy = re.match(r'CREATE POLICY ("[^"]+") ON (\S+)', head)
+        if policy:
+            if not prev.startswith(f"DROP POLICY IF EXISTS {policy.group(1)} ON {policy.group(2)}"):
+                raise ValueError(f"CREATE POLICY {policy.group(1)} is not preceded by its DROP POLICY IF EXISTS")
+        elif not RERUNNABLE_RE.match(head):
+            raise ValueError(f"statement is not safe to re-run: {head[:80]!r}")
+        prev = head
+
+
+def split_parts(sql: str, max_bytes: int = PART_BYTES) -> List[Tuple[str, int]]:
+    """(text, statement count) of numbered migration parts of at most max_bytes, each holding whole
+    statements in one transaction. A statement that does not fit in a part on its own is a ValueError.
+
+    Session settings (top-level SET) seen so far are repeated at the top of every part, and each
+    part records itself in kpi_migration_parts, so a deploy can skip applied parts and resume.
+    """
+    import hashlib
+
+    stmts = split_statements(sql)
+    check_rerunnable(stmts)
+    build = hashlib.sha256(sql.encode("utf-8")).hexdigest()
+    sets: List[str] = []
+    groups: List[Tuple[List[str], List[str]]] = []
+
+    def render(n: int, total: Union[int, str], pre: List[str], body: List[str]) -> str:
+        return "\n".join([
+            f"-- KPI migration part {n}/{total} (build {build[:12]}): whole statements, safe to re-run.",
+            *pre,
+            "BEGIN;",
+            """CREATE TABLE IF NOT EXISTS public.kpi_migration_parts (
+    build text NOT NULL,
+    part integer NOT NULL,
+    parts integer NOT NULL,
+    applied_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (build, part)
+);""",
+            "",
+            "\n\n".join(body),
+            "",
+            f"INSERT INTO public.kpi_migration_parts (build, part, parts) VALUES ('{build}', {n}, {total})",
+            "ON CONFLICT (build, part) DO UPDATE SET applied_at = now();",
+            "COMMIT;",
+            "",
+        ])
+
+    # Yer tutucu toplam ("9999") gerçek sayıdan kısa olamaz; bütçe onunla ölçülür.
+    for stmt in stmts:
+        if groups and len(render(9999, 9999, groups[-1][0], groups[-1][1] + [stmt]).encode("utf-8")) <= max_bytes:
+            groups[-1][1].append(stmt)
+        else:
+            size = len(render(9999, 9999, sets, [stmt]).encode("utf-8"))
+            if size > max_bytes:
+                raise ValueError(f"statement needs a part of {size} bytes, over --max-bytes {max_bytes}: "
+                                 f"{statement_head(stmt)[:60]!r}")
+            groups.append((list(sets), [stmt]))
+        if statement_head(stmt).startswith("SET "):
+            sets.append(statement_head(stmt))
+    return [(render(n, len(groups), pre, body), len(body)) for n, (pre, body) in enumerate(groups, 1)]
+
+
+def write_parts(sql: str, out_dir: str, max_bytes: int = PART_BYTES) -> None:
+    """Writes kpi_monthly_partNNN.sql files and manifest.json (checksums, resume query) to out_dir."""
+    import hashlib
+    import json
+    from pathlib import Path
+
+    parts = split_parts(sql, max_bytes)
+    d = Path(out_dir)
+    d.mkdir(parents=True, exist_ok=True)
+    for old in d.glob("kpi_monthly_part*.sql"):
+        old.unlink()
+    build = hashlib.sha256(sql.encode("utf-8")).hexdigest()
+    entries = []
+    for n, (part, count) in enumerate(parts, 1):
+        data = part.encode("utf-8")
+        name = f"kpi_monthly_part{n:03d}.sql"
+        (d / name).write_bytes(data)
+        entries.append({"part": n, "file": name, "bytes": len(data), "sha256": hashlib.sha256(data).hexdigest(),
+                        "statements": count})
+    manifest = {
+        "build": build,
+        "max_bytes": max_bytes,
+        "parts": entries,
+        "applied_query": f"SELECT part FROM public.kpi_migration_parts WHERE build = '{build}' ORDER BY part",
+    }
+    (d / "manifest.json").write_text(json.dumps(manifest, indent=1) + "\n", encoding="utf-8")
+    print(f"Wrote {len(entries)} parts ({sum(e['bytes'] for e in entries)} bytes) and manifest.json to {d}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--explain", action="store_true",
+                    help="EXPLAIN (ANALYZE, BUFFERS) every KPI query in a rolled-back transaction and compare with snapshots")
+    ap.add_argument("--dsn", help="throwaway database URL for --explain (default: KPI_PLAN_DSN / TEST_DATABASE_URL)")
+    ap.add_argument("--allow-remote", action="store_true", help="let --explain use a database on another host")
+    ap.add_argument("--seed-rows", type=int, default=5000, help="synthetic rows per source table for --explain")
+    ap.add_argument("--update-snapshots", action="store_true", help="store the current plans as the new snapshots")
+    ap.add_argument("--parts", metavar="DIR",
+                    help="write numbered, re-runnable parts of at most --max-bytes and a manifest to DIR")
+    ap.add_argument("--max-bytes", type=int, default=PART_BYTES, help="byte budget per part for --parts")
+    args = ap.parse_args()
+    if args.parts:
+        try:
+            write_parts(build_sql(), args.parts, args.max_bytes)
+        except ValueError as e:
+            print(f"error: {e}", file=sys.stderr)
+            sys.exit(1)
+        return
+    if not args.explain:
+        print(build_sql())
+        return
+    import kpi_plan_check
+
+    sys.exit(kpi_plan_check.run(args.dsn, args.seed_rows, args.update_snapshots, allow_remote=args.allow_remote))
 
 
 if __name__ == "__main__":
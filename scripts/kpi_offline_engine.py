@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""Offline KPI engine: every auto KPI for every month, computed from table exports.
+
+The KPI definitions are the ones in build_kpi_monthly_migration.py (or a modified copy
+given with ``--generator`` for what-if runs). Each export (``<table>.csv``,
+``<table>.jsonl`` / ``.ndjson`` or ``<table>.json``) becomes a view in an in-memory
+DuckDB database, loaded once; the trigger-maintained tables and daily rollups are built
+from them the same way the migration fills them.
+Every canonical KPI then runs its generated ``series_query`` once, as a vectorized
+grouped scan over all months, and the value is fanned out to its aliases.
+
+Output is CSV (auto_kpi_id, year, month, actual_value). With ``--compare`` the result is
+checked against database values exported in the same shape, e.g.::
+
+    COPY (SELECT k.auto_kpi_id, d.year, d.month, d.actual_value
+          FROM kpi_monthly_data d JOIN kpis k ON k.id = d.kpi_id WHERE k.is_auto)
+    TO STDOUT WITH CSV HEADER
+
+Usage:
+
+    python scripts/kpi_offline_engine.py EXPORT_DIR --from 2024-01 --to 2026-10 -o kpi_monthly.csv
+    ... --compare kpi_monthly_db.csv          # exits 1 on mismatches
+    ... --generator /tmp/whatif_build.py      # definitions from a modified generator
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import importlib.util
+import re
+import sys
+import time
+from datetime import date
+from pathlib import Path
+from types import ModuleType
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
+
+from build_kpi_monthly_migration import after_close
+
+try:
+    import duckdb
+except ImportError:  # optional: only this offline engine needs it
+    duckdb = None
+
+READERS = {
+    ".csv": "read_csv_auto('{path}', header = true)",
+    ".jsonl": "read_json_auto('{path}', format = 'newline_delimited')",
+    ".ndjson": "read_json_auto('{path}', format = 'newline_delimited')",
+    ".json": "read_json_auto('{path}')",
+}
+# Karşılaştırmada yuvarlama farkı sayılmayan sapma (değerler en fazla 2 ondalıklı).
+TOLERANCE = 0.005
+# Postgres numeric yerine: ROUND yarım değerlerde sıfırdan uzağa yuvarlasın diye DECIMAL.
+DECIMAL = "DECIMAL(38,10)"
+ROUND_RE = re.compile(r"\bROUND\(", re.I)
+
+Row = Tuple[str, int, int, float]
+
+
+def load_generator(path: Optional[str] = None) -> ModuleType:
+    """The KPI spec module: build_kpi_monthly_migration next to this file, or a copy at `path`."""
+    path = Path(path) if path else Path(__file__).with_name("build_kpi_monthly_migration.py")
+    spec = importlib.util.spec_from_file_location("kpi_spec", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def export_files(export_dir: Path) -> Dict[str, Path]:
+    """Table name -> export file (first match in READERS order)."""
+    out: Dict[str, Path] = {}
+    for ext in READERS:
+        for f in sorted(export_dir.glob(f"*{ext}")):
+            out.setdefault(f.name[: -len(ext)], f)
+    return out
+
+
+def to_duckdb(sql: str) -> str:
+    """Postgres-only spellings in the generated SQL -> DuckDB.
+
+    ``numeric`` is a fixed DECIMAL(18,3) in DuckDB, so it becomes DECIMAL(38,10). DuckDB
+    divides decimals (and averages) in DOUBLE, where 41/160*100 is 25.6249999...; the first
+    argument of every ROUND is therefore brought back to DECIMAL(38,10) so half-way values
+    round away from zero as in Postgres (25.63).
+    """
+    sql = re.sub(r"\bpublic\.", "", sql)
+    return decimal_round(re.sub(r"::numeric\b", f"::{DECIMAL}", sql))
+
+
+def decimal_round(sql: str) -> str:
+    """ROUND(x[, n]) -> ROUND((x)::DECIMAL(38,10)[, n]), nested ROUNDs included."""
+    out: List[str] = []
+    pos = 0
+    for m in ROUND_RE.finditer(sql):
+        if m.start() < pos:
+            continue
+        end = after_close(sql, m.end())
+        args = sql[m.end():end - 1]
+        depth = i = 0
+        comma = len(args)
+        while i < len(args):
+            c = args[i]
+            if c == "'":
+                i = args.index("'", i + 1)
+            elif c in "()":
+                depth += 1 if c == "(" else -1
+            elif c == "," and depth == 0:
+                comma = i
+            i += 1
+        out.append(f"{sql[pos:m.start()]}ROUND(({decimal_round(args[:comma])})::{DECIMAL}{args[comma:]})")
+        pos = end
+    out.append(sql[pos:])
+    return "".join(out)
+
+
+def connect(gen: ModuleType, export_dir: Path, log: TextIO = sys.stderr):
+    """In-memory DuckDB with the exports, kpi_months and the maintained / rollup tables."""
+    con = duckdb.connect()
+    # Supabase oturumu UTC'dir; date_trunc('month', timestamptz) aynı ay sınırlarını versin.
+    con.execute("SET TimeZone = 'UTC'")
+    for table, path in export_files(export_dir).items():
+        reader = READERS[path.suffix].format(path=str(path).replace("'", "''"))
+        con.execute(f'CREATE TABLE "{table}" AS SELECT * FROM {reader}')
+        casts = temporal_casts(con, table)
+        if casts:
+            con.execute(f'CREATE OR REPLACE TABLE "{table}" AS SELECT * REPLACE ({", ".join(casts)}) FROM "{table}"')
+    con.execute("""CREATE MACRO kpi_months(p_from, p_to) AS TABLE
+        SELECT m AS m_start, m + INTERVAL 1 MONTH AS m_end
+        FROM generate_series(date_trunc('month', p_from::TIMESTAMPTZ), date_trunc('month', p_to::TIMESTAMPTZ),
+                             INTERVAL 1 MONTH) t(m)""")
+    derived = [(d.name, d.table, d.rows()) for d in gen.MAINTAINED]
+    derived += [(r.name, r.table, gen.rollup_rows_full(r)) for r in gen.ROLLUPS]
+    for name, table, rows in derived:
+        if (table,) in con.execute("SELECT table_name FROM duckdb_tables()").fetchall():
+            try:
+                con.execute(f"CREATE TABLE {name} AS {to_duckdb(rows)}")
+            except duckdb.Error as e:
+                print(f"skip {name}: {str(e).splitlines()[0]}", file=log)
+    return con
+
+
+def temporal_casts(con, table: str) -> List[str]:
+    """``col::DATE`` / ``col::TIMESTAMPTZ`` for text columns holding only dates or timestamps.
+
+    JSON has no date type, so exported timestamps arrive as strings; KPI filters compare
+    them with period bounds and need the real types.
+    """
+    cols = [c for c, t in con.execute(f'SELECT column_name, column_type FROM (DESCRIBE "{table}")').fetchall()
+            if t == "VARCHAR"]
+    if not cols:
+        return []
+    checks = ", ".join(
+        f"""count("{c}"),
+        count("{c}") FILTER (WHERE TRY_CAST("{c}" AS TIMESTAMPTZ) IS NULL),
+        count("{c}") FILTER (WHERE NOT regexp_full_match("{c}", '\\d{{4}}-\\d{{2}}-\\d{{2}}'))""" for c in cols)
+    stats = con.execute(f'SELECT {checks} FROM "{table}"').fetchone()
+    out = []
+    for i, c in enumerate(cols):
+        filled, not_ts, not_date = stats[3 * i: 3 * i + 3]
+        if filled and not not_ts:
+            out.append(f'"{c}"::{"DATE" if not not_date else "TIMESTAMPTZ"} AS "{c}"')
+    return out
+
+
+def month_bounds(p_from: str, p_to: str) -> Tuple[str, str]:
+    """'YYYY-MM' bounds -> timestamptz literals for series_query's p_from / p_to."""
+    return f"TIMESTAMPTZ '{p_from}-01 00:00:00+00'", f"TIMESTAMPTZ '{p_to}-01 00:00:00+00'"
+
+
+def kpi_series(con, gen: ModuleType, k, lo: str, hi: str) -> List[Tuple[int, int, float]]:
+    sql = gen.series_query(k)
+    for name, value in (("p_from", lo), ("p_to", hi)):
+        sql = re.sub(rf"\b{name}\b", value, sql)
+    sql = f"SELECT year(s.m)::INTEGER, month(s.m)::INTEGER, COALESCE(s.v, 0)::DOUBLE FROM ({to_duckdb(sql)}) s(m, v)"
+    return con.execute(sql).fetchall()
+
+
+def run(gen: ModuleType, export_dir: Path, p_from: str, p_to: str,
+        only: Iterable[str] = (), log: TextIO = sys.stderr) -> List[Row]:
+    """Every month of every canonical KPI (restricted to `only` ids), fanned out to aliases.
+
+    KPIs whose tables or columns are missing from the exports are skipped with a note.
+    """
+    if duckdb is None:
+        raise RuntimeError("kpi_offline_engine needs duckdb: pip install duckdb")
+    con = connect(gen, export_dir, log)
+    lo, hi = month_bounds(p_from, p_to)
+    wanted = set(only)
+    rows: List[Row] = []
+    for k, kids in gen.canonical_kpis():
+        if wanted and not wanted & set(kids):
+            continue
+        t0 = time.perf_counter()
+        try:
+            series = kpi_series(con, gen, k, lo, hi)
+        except duckdb.Error as e:
+            print(f"skip {k.kid}: {str(e).splitlines()[0]}", file=log)
+            continue
+        print(f"{k.kid}: {len(series)} months, {(time.perf_counter() - t0) * 1000:.0f} ms", file=log)
+        rows += [(kid, y, m, v) for kid in kids if not wanted or kid in wanted for y, m, v in series]
+    return rows
+
+
+def compare(rows: List[Row], expected_csv: Path) -> List[str]:
+    """Differences against an (auto_kpi_id, year, month, actual_value) export; missing months count as 0."""
+    with expected_csv.open(newline="", encoding="utf-8") as f:
+        expected = {(r["auto_kpi_id"], int(r["year"]), int(r["month"])): float(r["actual_value"] or 0)
+                    for r in csv.DictReader(f)}
+    out = []
+    for kid, y, m, v in rows:
+        db = expected.get((kid, y, m))
+        if db is None:
+            continue
+        if abs(db - v) > TOLERANCE:
+            out.append(f"{kid} {y}-{m:02d}: offline {v:g}, database {db:g}")
+    return out
+
+
+def main() -> int:
+    this_month = date.today().strftime("%Y-%m")
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("export_dir", type=Path, help="directory with <table>.csv / .jsonl / .json exports")
+    ap.add_argument("--from", dest="p_from", default=f"{date.today().year - 1}-01", help="first month, YYYY-MM")
+    ap.add_argument("--to", dest="p_to", default=this_month, help="last month, YYYY-MM")
+    ap.add_argument("--kpi", action="append", default=[], help="only this auto_kpi_id (repeatable)")
+    ap.add_argument("--generator", help="KPI definitions from this copy of build_kpi_monthly_migration.py")
+    ap.add_argument("--compare", type=Path, help="database values to cross-check (auto_kpi_id,year,month,actual_value)")
+    ap.add_argument("-o", "--output", type=Path, help="CSV output (default: stdout)")
+    args = ap.parse_args()
+    for v in (args.p_from, args.p_to):
+        if not re.fullmatch(r"\d{4}-\d{2}", v):
+            ap.error(f"month must be YYYY-MM: {v}")
+    if duckdb is None:
+        print("kpi_offline_engine needs duckdb: pip install duckdb", file=sys.stderr)
+        return 2
+
+    rows = run(load_generator(args.generator), args.export_dir, args.p_from, args.p_to, args.kpi)
+    out = args.output.open("w", newline="", encoding="utf-8") if args.output else sys.stdout
+    try:
+        w = csv.writer(out)
+        w.writerow(["auto_kpi_id", "year", "month", "actual_value"])
+        w.writerows(rows)
+    finally:
+        if args.output:
+            out.close()
+    if args.compare:
+        diffs = compare(rows, args.compare)
+        for d in diffs:
+            print(f"DIFF {d}", file=sys.stderr)
+        print(f"{len(rows)} values, {len(diffs)} differences", file=sys.stderr)
+        return 1 if diffs else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
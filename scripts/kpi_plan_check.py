@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""EXPLAIN-plan regression check for the queries generated by build_kpi_monthly_migration.py.
+
+The source tables are vacuumed first (earlier runs leave dead seed rows behind),
+then everything runs in one transaction that is rolled back at the end: the generated
+migration is applied, the KPI source tables are seeded with synthetic rows
+(``setseed`` keeps them reproducible), and every canonical KPI query is run under
+``EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)``. The plan shape (node, relation, index)
+and buffer count of each query are compared with the stored snapshot; the check
+fails when a relation that used to be read through an index is now seq-scanned, or
+when a query reads more than twice its snapshot buffers.
+
+Usage (throwaway database, e.g. ``supabase db reset`` on a local stack; needs
+``pip install 'psycopg[binary]'``):
+
+    KPI_PLAN_DSN=postgresql://... python scripts/build_kpi_monthly_migration.py --explain
+    ... --explain --update-snapshots      # accept current plans
+
+The database comes from ``--dsn``, ``KPI_PLAN_DSN`` or ``TEST_DATABASE_URL`` only, never
+from SUPABASE_DB_URL / DATABASE_URL (those point at the production pooler), and it
+must be on this machine unless ``--allow-remote`` is given: the check VACUUMs tables
+and runs the whole migration, even though the transaction is rolled back.
+
+The baseline (kpi_plan_snapshots.json next to this file) is not generated in CI: it
+needs the production schema, which only a local stack synced with ``supabase db pull``
+has. Whoever changes a KPI definition or the generator refreshes it on such a stack
+with ``--update-snapshots`` and commits the JSON in the same change, so the diff shows
+the plan changes for review (see "KPI Migration" in SUPABASE_WORKFLOW.md). Until a
+baseline is committed, ``--explain`` only prints the plans and exits 2.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import build_kpi_monthly_migration as gen
+
+try:
+    import psycopg
+except ImportError:  # optional: only the --explain mode needs a database driver
+    psycopg = None
+
+SNAPSHOTS = Path(__file__).parent / "kpi_plan_snapshots.json"
+DSN_VARS = ("KPI_PLAN_DSN", "TEST_DATABASE_URL")
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+INDEX_NODES = {"Index Scan", "Index Only Scan", "Bitmap Index Scan", "Bitmap Heap Scan"}
+# Küçük tablolarda birkaç sayfalık oynama regresyon sayılmaz.
+BUFFER_SLACK = 16
+
+LITERAL_RE = re.compile(r"\b(\w+)\s*(?:=|<>|!=)\s*'([^']*)'")
+IN_LIST_RE = re.compile(r"\b(\w+)\s+(?:NOT\s+)?IN\s*\(([^)]*)\)", re.I)
+
+
+def source_tables() -> List[str]:
+    """Every table a KPI reads, including join partners and subquery tables.
+
+    Trigger-maintained tables are not seeded: their raw table is listed instead.
+    """
+    maintained = {d.name: d.table for d in gen.MAINTAINED}
+    seen: Dict[str, None] = {}
+    for k, _ in gen.canonical_kpis():
+        for t in re.findall(r"(?:^\s*|\bFROM\s+|\bJOIN\s+)(?!LATERAL\b)(\w+)", k.src):
+            seen.setdefault(maintained.get(t, t), None)
+    return list(seen)
+
+
+def literal_pool() -> Dict[str, List[str]]:
+    """Column -> string literals the KPI filters compare it with (so filters match seeded rows)."""
+    pool: Dict[str, Dict[str, None]] = {}
+    texts = [f"{k.value} {k.src} {k.where}" for k in gen.KPIS] + [d.rows() for d in gen.MAINTAINED]
+    for text in texts:
+        for col, lit in LITERAL_RE.findall(text):
+            pool.setdefault(col, {})[lit] = None
+        for col, items in IN_LIST_RE.findall(text):
+            for lit in re.findall(r"'([^']*)'", items):
+                pool.setdefault(col, {})[lit] = None
+    return {col: list(lits) for col, lits in pool.items()}
+
+
+def column_expr(col: str, data_type: str, pool: Dict[str, List[str]]) -> Optional[str]:
+    """Synthetic value for one column, or None when the column is left to its default/NULL."""
+    if col in pool and data_type in ("text", "character varying"):
+        arr = ", ".join("'" + lit.replace("'", "''") + "'" for lit in pool[col])
+        return f"(ARRAY[{arr}])[1 + floor(random() * {len(pool[col])})::int]"
+    if data_type.startswith("timestamp"):
+        return "now() - random() * interval '400 days'"
+    if data_type == "date":
+        return "(now() - random() * interval '400 days')::date"
+    if data_type == "boolean":
+        return "random() < 0.5"
+    if data_type in ("integer", "bigint", "smallint"):
+        return "floor(random() * 200)::int"
+    if data_type in ("numeric", "double precision", "real"):
+        return "round((random() * 10)::numeric, 2)"
+    if data_type == "uuid" and col.endswith("_id"):
+        # Küçük bir kimlik havuzu: aynı adlı kolonlar tablolar arasında eşleşebilsin.
+        return f"md5('{col}' || floor(random() * 50)::text)::uuid"
+    if data_type in ("text", "character varying"):
+        return "md5(random()::text)"
+    return None
+
+
+def seed(cur, rows: int) -> List[str]:
+    """Inserts `rows` synthetic rows into every KPI source table; returns the skip notes."""
+    notes: List[str] = []
+    cur.execute("SELECT setseed(0.42)")
+    try:
+        cur.execute("SAVEPOINT seed_role")
+        cur.execute("SET LOCAL session_replication_role = replica")
+    except psycopg.Error as e:
+        cur.execute("ROLLBACK TO SAVEPOINT seed_role")
+        notes.append(f"foreign keys stay enforced ({e.diag.message_primary})")
+    pool = literal_pool()
+    for table in source_tables():
+        cur.execute(
+            """SELECT column_name, data_type, is_nullable = 'YES', column_default IS NOT NULL
+            FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s
+            ORDER BY ordinal_position""",
+            (table,),
+        )
+        cols = cur.fetchall()
+        if not cols:
+            notes.append(f"{table}: table missing")
+            continue
+        names: List[str] = []
+        exprs: List[str] = []
+        for name, data_type, nullable, has_default in cols:
+            expr = column_expr(name, data_type, pool)
+            if name == "id" and has_default:
+                continue
+            if expr is None or (has_default and name not in pool and not data_type.startswith("timestamp")):
+                if not nullable and not has_default:
+                    notes.append(f"{table}: no synthetic value for NOT NULL {name} ({data_type})")
+                    break
+                continue
+            names.append(f'"{name}"')
+            exprs.append(expr)
+        else:
+            cur.execute("SAVEPOINT seed_table")
+            try:
+                cur.execute(
+                    f"INSERT INTO public.{table} ({', '.join(names)}) "
+                    f"SELECT {', '.join(exprs)} FROM generate_series(1, {int(rows)})"
+                )
+            except psycopg.Error as e:
+                cur.execute("ROLLBACK TO SAVEPOINT seed_table")
+                notes.append(f"{table}: {e.diag.message_primary}")
+    # replica rolünde tetikleyiciler çalışmaz; günlük özetler ve bakımlı tablolar yeniden kurulur.
+    cur.execute("SET LOCAL session_replication_role = origin")
+    fills = [(r.table, gen.rollup_fill(r)) for r in gen.ROLLUPS] + [(d.table, gen.maintained_fill(d)) for d in gen.MAINTAINED]
+    for table, fill in fills:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (f"public.{table}",))
+        if cur.fetchone()[0]:
+            cur.execute(fill)
+    cur.execute("ANALYZE")
+    return notes
+
+
+def bind(sql: str, **params: str) -> str:
+    for name, value in params.items():
+        sql = re.sub(rf"\b{name}\b", value, sql)
+    return sql
+
+
+def kpi_queries() -> List[Tuple[str, str]]:
+    """(name, SQL) for the scalar and series query of every canonical KPI, plus the
+    rolling-window and bucket queries of KPIs with a daily rollup."""
+    month = "date_trunc('month', now())"
+    rollups = gen.rollup_of()
+    out = []
+    for k, _ in gen.canonical_kpis():
+        out.append((f"{k.kid}:actual", bind(gen.kpi_query(k), m_start=month, m_end=f"({month} + interval '1 month')")))
+        out.append((f"{k.kid}:series", bind(gen.series_query(k), p_from=f"({month} - interval '11 months')", p_to="now()")))
+        r = rollups.get(k.kid)
+        if r and gen.daily_terms(k):
+            out.append((f"{k.kid}:rolling", bind(gen.rolling_query(k, r), p_from="(current_date - 90)", p_to="current_date", p_window="30")))
+            out.append((f"{k.kid}:buckets", bind(gen.buckets_query(k, r), p_grain="'week'", p_from="(current_date - 365)", p_to="current_date")))
+    return out
+
+
+def plan_summary(plan: dict) -> dict:
+    nodes: List[str] = []
+
+    def walk(node: dict) -> None:
+        label = node["Node Type"]
+        if "Relation Name" in node:
+            label += f" on {node['Relation Name']}"
+        if "Index Name" in node:
+            label += f" using {node['Index Name']}"
+        nodes.append(label)
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan["Plan"])
+    top = plan["Plan"]
+    return {
+        "nodes": nodes,
+        "buffers": top.get("Shared Hit Blocks", 0) + top.get("Shared Read Blocks", 0),
+    }
+
+
+def regressions(name: str, old: dict, new: dict) -> List[str]:
+    out = []
+    indexed = {n.split(" on ")[1].split(" using ")[0] for n in old["nodes"] if n.split(" on ")[0] in INDEX_NODES and " on " in n}
+    seq = {n.split(" on ")[1] for n in new["nodes"] if n.startswith("Seq Scan on ")}
+    for rel in sorted(indexed & seq):
+        out.append(f"{name}: {rel} index scan -> seq scan")
+    if new["buffers"] > 2 * old["buffers"] and new["buffers"] > old["buffers"] + BUFFER_SLACK:
+        out.append(f"{name}: buffers {old['buffers']} -> {new['buffers']}")
+    return out
+
+
+def is_local(dsn: str) -> bool:
+    """True when every host in the connection string is a loopback address or a socket directory."""
+    params = psycopg.conninfo.conninfo_to_dict(dsn)
+    hosts = params.get("hostaddr") or params.get("host") or os.environ.get("PGHOST") or ""
+    return all(h in LOCAL_HOSTS or h.startswith("/") or h == "" for h in str(hosts).split(","))
+
+
+def run(dsn: Optional[str], rows: int, update: bool, snapshots: Path = SNAPSHOTS,
+        allow_remote: bool = False) -> int:
+    if psycopg is None:
+        print("--explain needs psycopg: pip install 'psycopg[binary]'", file=sys.stderr)
+        return 2
+    dsn = dsn or next((os.environ[v] for v in DSN_VARS if os.environ.get(v)), None)
+    if not dsn:
+        print(f"--dsn or {' / '.join(DSN_VARS)} is required (a throwaway database, not the production one)",
+              file=sys.stderr)
+        return 2
+    try:
+        local = is_local(dsn)
+    except psycopg.ProgrammingError as e:
+        print(f"invalid connection string: {e}", file=sys.stderr)
+        return 2
+    if not local and not allow_remote:
+        print("refusing to run --explain against a non-local database; pass --allow-remote "
+              "if it is a throwaway one", file=sys.stderr)
+        return 2
+
+    results: Dict[str, dict] = {}
+    with psycopg.connect(dsn) as conn:
+        cur = conn.cursor()
+        # Önceki koşuların geri alınan tohum satırları ölü tuple olarak kalır; buffer sayıları
+        # karşılaştırılabilir olsun diye tablolar koşu öncesi temizlenir.
+        conn.autocommit = True
+        for table in source_tables():
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL", (f"public.{table}",))
+            if cur.fetchone()[0]:
+                cur.execute(f"VACUUM public.{table}")
+        conn.autocommit = False
+        cur.execute(gen.build_sql())
+        for note in seed(cur, rows):
+            print(f"seed: {note}", file=sys.stderr)
+        for name, sql in kpi_queries():
+            cur.execute("SAVEPOINT q")
+            try:
+                cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}")
+            except psycopg.Error as e:
+                cur.execute("ROLLBACK TO SAVEPOINT q")
+                print(f"skip {name}: {e.diag.message_primary}", file=sys.stderr)
+                continue
+            results[name] = plan_summary(cur.fetchone()[0][0])
+        conn.rollback()
+
+    if update:
+        snapshots.write_text(json.dumps(results, indent=1, ensure_ascii=False, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"Wrote {len(results)} plan snapshots to {snapshots}")
+        return 0
+    if not snapshots.exists():
+        for name, new in results.items():
+            print(f"new  {name}: {' > '.join(new['nodes'])}")
+        print(f"No snapshots at {snapshots}; create the baseline with --update-snapshots on a local stack "
+              f"with the production schema (see SUPABASE_WORKFLOW.md)", file=sys.stderr)
+        return 2
+
+    old = json.loads(snapshots.read_text(encoding="utf-8"))
+    failures: List[str] = []
+    changed = 0
+    for name, new in results.items():
+        if name not in old:
+            print(f"new  {name}: {' > '.join(new['nodes'])}")
+            continue
+        failures += regressions(name, old[name], new)
+        if new["nodes"] != old[name]["nodes"]:
+            changed += 1
+            print(f"plan {name}:\n  was {' > '.join(old[name]['nodes'])}\n  now {' > '.join(new['nodes'])}")
+    for name in sorted(set(old) - set(results)):
+        print(f"gone {name}")
+    for f in failures:
+        print(f"FAIL {f}", file=sys.stderr)
+    print(f"{len(results)} queries, {changed} plan changes, {len(failures)} regressions")
+    return 1 if failures else 0
@@ -2,212 +2,232 @@
 """
 Parse KademeQMS_DF8D_Analizleri_*.docx (flat paragraphs) into non_conformities
 analysis JSON + core fields. Outputs SQL with dollar-quoting for JSONB columns.
+
+Documents are parsed in parallel (one process per file); statements are written in
+report-number order, and a number found in several files with different content is
+reported as a conflict.
+
+Usage:
+    python scripts/parse_df8d_docx_apply.py Analizler/ 'arsiv/**/*.docx' -j 4 -o out.sql
+    python scripts/parse_df8d_docx_apply.py big.docx --bench 5    # parser timing only
+    python scripts/parse_df8d_docx_apply.py Analizler/ --batch 500  # one UPDATE ... FROM jsonb_to_recordset per 500 reports
+    SUPABASE_DB_URL=postgresql://... python scripts/parse_df8d_docx_apply.py Analizler/ --apply
+
+--apply needs ``pip install 'psycopg[binary]'``; the other modes use the standard library only.
 """
 from __future__ import annotations
 
+import argparse
+import glob
 import json
+import os
 import re
 import secrets
 import sys
+import time
 import zipfile
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import psycopg
+    from psycopg.types.json import Jsonb
+except ImportError:  # optional: only the --apply mode needs a database driver
+    psycopg = None
 
 NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+Report = Tuple[str, str, Dict[str, Any]]  # (nc_number, kind, parse_report çıktısı)
+RE_HEADER = re.compile(r"^(?:DÜZELTİCİ FAALİYET RAPORU - (DF-2026-\d+)|8D RAPORU - (8D-2026-\d+))$")
+
+
+def paragraph_text(p: ET.Element) -> str:
+    parts: List[str] = []
+    for t in p.iter(f"{{{NS}}}t"):
+        if t.text:
+            parts.append(t.text)
+        if t.tail:
+            parts.append(t.tail)
+    return "".join(parts).strip()
+
+
+def iter_paragraphs(docx_path: Path) -> Iterator[str]:
+    """Non-empty paragraph texts in document order, streamed from word/document.xml.
+
+    Each top-level body element (paragraph, table, ...) is handled when it ends and then
+    cleared, so memory is bounded by the largest single element, not the document.
+    """
+    body_tag = f"{{{NS}}}body"
+    with zipfile.ZipFile(docx_path) as z, z.open("word/document.xml") as f:
+        body: Optional[ET.Element] = None
+        depth = 0
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if elem.tag == body_tag:
+                    body = elem
+                continue
+            depth -= 1
+            # depth 2: doğrudan body altındaki öğe (document > body > öğe)
+            if depth == 2 and body is not None:
+                for p in elem.iter(f"{{{NS}}}p"):
+                    s = paragraph_text(p)
+                    if s:
+                        yield s
+                body.clear()
 
 
 def extract_paragraphs(docx_path: Path) -> List[str]:
-    with zipfile.ZipFile(docx_path) as z:
-        xml = z.read("word/document.xml")
-    root = ET.fromstring(xml)
-    out: List[str] = []
-    for p in root.iter(f"{{{NS}}}p"):
-        parts: List[str] = []
-        for t in p.iter(f"{{{NS}}}t"):
-            if t.text:
-                parts.append(t.text)
-            if t.tail:
-                parts.append(t.tail)
-        s = "".join(parts).strip()
-        if s:
-            out.append(s)
-    return out
+    return list(iter_paragraphs(docx_path))
+
+
+def report_header(p: str) -> Optional[Tuple[str, str]]:
+    """(nc_number, kind) when p starts a DF or 8D report."""
+    # Başlık olmayan paragraflar (hemen hepsi) tek bir alt dize aramasıyla elenir.
+    m = RE_HEADER.match(p.strip()) if "RAPORU - " in p else None
+    if not m:
+        return None
+    return (m.group(1), "DF") if m.group(1) else (m.group(2), "8D")
 
 
 def find_report_starts(paras: List[str]) -> List[Tuple[int, str, str]]:
     """Returns list of (index, nc_number, kind) where kind is DF or 8D."""
     starts: List[Tuple[int, str, str]] = []
-    re_df = re.compile(r"^DÜZELTİCİ FAALİYET RAPORU - (DF-2026-\d+)$")
-    re_8d = re.compile(r"^8D RAPORU - (8D-2026-\d+)$")
     for i, p in enumerate(paras):
-        m = re_df.match(p.strip())
-        if m:
-            starts.append((i, m.group(1), "DF"))
-            continue
-        m = re_8d.match(p.strip())
-        if m:
-            starts.append((i, m.group(1), "8D"))
+        h = report_header(p)
+        if h:
+            starts.append((i, h[0], h[1]))
     return starts
 
 
-def slice_section(paras: List[str], starts: List[Tuple[int, str, str]], idx: int) -> List[str]:
-    a = starts[idx][0]
-    b = starts[idx + 1][0] if idx + 1 < len(starts) else len(paras)
-    return paras[a:b]
-
-
-def take_until(lines: List[str], start: int, stop_markers: Tuple[str, ...]) -> Tuple[str, int]:
-    """Collect lines from start until a line starts with any stop marker (exclusive). Returns text, next index."""
-    buf: List[str] = []
-    i = start
-    while i < len(lines):
-        line = lines[i]
-        if any(line.startswith(m) for m in stop_markers):
-            break
-        buf.append(line)
-        i += 1
-    return "\n".join(buf).strip(), i
-
-
-def kv_block(
-    lines: List[str],
-    i: int,
-    stop_at: Tuple[str, ...],
-    labels_extra: Optional[set] = None,
-) -> Tuple[Dict[str, str], int]:
-    """Read label\\nvalue pairs until stop_at line."""
-    data: Dict[str, str] = {}
-    labels = {
-        "Rapor No",
-        "Rapor Türü",
-        "Birim/Departman",
-        "Yayın Tarihi",
-        "Sorumlu Kişi",
-        "Parça Adı",
-        "Parça Kodu",
-        "Araç Tipi",
-        "Maliyet Tutarı",
-        "Problem Tanimi",
-        "Toplam Kayıt",
-        "Toplam Adet",
-    }
-    if labels_extra:
-        labels |= labels_extra
-    while i < len(lines):
-        line = lines[i]
-        if line in stop_at:
-            break
-        if line in labels and i + 1 < len(lines):
-            data[line] = lines[i + 1]
-            i += 2
-            continue
-        i += 1
-    return data, i
-
-
-def parse_5n1k(lines: List[str], i: int) -> Tuple[Dict[str, str], int]:
-    if i >= len(lines) or not lines[i].startswith("2. 5N1K"):
-        return {}, i
-    i += 1
-    # skip Soru/Açıklama
-    while i < len(lines) and lines[i] in ("Soru", "Açıklama"):
-        i += 1
-    mapping = [
-        (re.compile(r"^Ne \(What\)"), "ne"),
-        (re.compile(r"^Nerede \(Where\)"), "nerede"),
-        (re.compile(r"^Ne Zaman \(When\)"), "neZaman"),
-        (re.compile(r"^Kim \(Who\)"), "kim"),
-        (re.compile(r"^Nasıl \(How\)"), "nasil"),
-        (re.compile(r"^Neden Önemli"), "neden"),
-    ]
-    out: Dict[str, str] = {}
-    for pat, key in mapping:
-        if i < len(lines) and pat.search(lines[i]):
-            if i + 1 < len(lines):
-                out[key] = lines[i + 1]
-                i += 2
-            else:
-                i += 1
-            continue
-    return out, i
-
-
-def parse_5why(lines: List[str], i: int) -> Tuple[Dict[str, str], int]:
-    if i >= len(lines) or not lines[i].startswith("3. 5 NEDEN"):
-        return {}, i
-    i += 1
-    while i < len(lines) and lines[i] in ("Adim", "Neden / Bulgu"):
-        i += 1
-    out: Dict[str, str] = {}
-    # Problem
-    if i < len(lines) and lines[i] == "Problem" and i + 1 < len(lines):
-        out["problem"] = lines[i + 1]
-        i += 2
-    for n in range(1, 6):
-        label = "Neden 5 (Kok Neden)" if n == 5 else f"Neden {n}"
-        if i < len(lines) and lines[i] == label and i + 1 < len(lines):
-            out[f"why{n}"] = lines[i + 1]
-            i += 2
-    extras = [
+def iter_sections(paras: Iterable[str]) -> Iterator[Tuple[str, str, List[str]]]:
+    """(nc_number, kind, section lines) per report, one at a time (text before the first header is skipped)."""
+    current: Optional[Tuple[str, str]] = None
+    lines: List[str] = []
+    for p in paras:
+        h = report_header(p)
+        if h:
+            if current:
+                yield current[0], current[1], lines
+            current, lines = h, []
+        if current:
+            lines.append(p)
+    if current:
+        yield current[0], current[1], lines
+
+
+BASIC_HEAD = "1. TEMEL"
+BASIC_END = "2. 5N1K ANALİZİ"
+BASIC_LABELS = frozenset({
+    "Rapor No",
+    "Rapor Türü",
+    "Birim/Departman",
+    "Yayın Tarihi",
+    "Sorumlu Kişi",
+    "Parça Adı",
+    "Parça Kodu",
+    "Araç Tipi",
+    "Maliyet Tutarı",
+    "Problem Tanimi",
+    "Toplam Kayıt",
+    "Toplam Adet",
+})
+RISKS = frozenset({"Yuksek", "Orta", "Dusuk", "Düşük"})
+RE_STEP = re.compile(r"^D([1-8])\s*-\s*(.+)$")
+FOOTER = "KADEME A.Ş. KYS"
+EIGHT_D_TITLES = {
+    "D1": "Ekip Oluşturma",
+    "D2": "Problemi Tanımlama",
+    "D3": "Geçici Önlemler Alma",
+    "D4": "Kök Neden Analizi",
+    "D5": "Kalıcı Düzeltici Faaliyetleri Belirleme",
+    "D6": "Kalıcı Düzeltici Faaliyetleri Uygulama",
+    "D7": "Tekrarlanmayı Önleme",
+    "D8": "Ekibi Takdir Etme",
+}
+ISHIKAWA_KEYS = ("man", "machine", "material", "measurement", "environment", "management")
+# fta_analysis alanı -> birleştirilen FTA etiketleri (boş olmayanlar, satır satır)
+FTA_FIELDS = (
+    ("topEvent", ("Ust Olay (Top Event)",)),
+    ("intermediateEvents", ("Ara Olay 1", "Ara Olay 2")),
+    ("basicEvents", ("Temel Olay 1", "Temel Olay 2", "Temel Olay 3", "Temel Olay 4")),
+    ("gates", ("Kapi Mantigi 1", "Kapi Mantigi 2")),
+    ("summary", ("Analiz Ozeti",)),
+)
+
+
+Label = Tuple[int, str]  # (etiketin bölümdeki sırası, alan)
+
+
+def exact_labels(labels: Tuple[Tuple[str, str], ...]) -> Callable[[str], Optional[Label]]:
+    return {label: (n, field) for n, (label, field) in enumerate(labels)}.get
+
+
+def prefix_labels(labels: Tuple[Tuple[str, str], ...]) -> Callable[[str], Optional[Label]]:
+    rx = re.compile("|".join(f"({re.escape(label)})" for label, _ in labels))
+    hits = [(n, field) for n, (_, field) in enumerate(labels)]
+    exact = exact_labels(labels)
+
+    def find(line: str) -> Optional[Label]:
+        hit = exact(line)
+        if hit is None:
+            m = rx.match(line)
+            hit = hits[m.lastindex - 1] if m else None
+        return hit
+
+    return find
+
+
+@dataclass(frozen=True)
+class Section:
+    """A numbered report section: header, table header cells, then labels in document order."""
+
+    key: str
+    head: str  # satır başı deseni
+    cells: FrozenSet[str]  # başlıktan hemen sonra atlanan tablo başlık hücreleri
+    find: Callable[[str], Optional[Label]]
+    kind: str = "fields"  # fields: etiket + değer, causes: 6M kategori + neden [+ risk], steps: D1..D8 serbest metin
+
+
+def section(key: str, head: str, cells: Tuple[str, ...], labels: Tuple[Tuple[str, str], ...] = (),
+            prefix: bool = False, kind: str = "fields") -> Section:
+    find = prefix_labels(labels) if prefix else exact_labels(labels)
+    return Section(key, head, frozenset(cells), find, kind)
+
+
+# Belgedeki sırayla; 8D adımları yalnızca 8D raporlarında okunur.
+SECTIONS: Tuple[Section, ...] = (
+    section("five_n1k_analysis", r"2\. 5N1K", ("Soru", "Açıklama"), (
+        ("Ne (What)", "ne"),
+        ("Nerede (Where)", "nerede"),
+        ("Ne Zaman (When)", "neZaman"),
+        ("Kim (Who)", "kim"),
+        ("Nasıl (How)", "nasil"),
+        ("Neden Önemli", "neden"),
+    ), prefix=True),
+    section("five_why_analysis", r"3\. 5 NEDEN", ("Adim", "Neden / Bulgu"), (
+        ("Problem", "problem"),
+        ("Neden 1", "why1"),
+        ("Neden 2", "why2"),
+        ("Neden 3", "why3"),
+        ("Neden 4", "why4"),
+        ("Neden 5 (Kok Neden)", "why5"),
         ("Kok Neden Ozeti", "rootCause"),
         ("Anlik Aksiyon", "immediateAction"),
         ("Onleyici Aksiyon", "preventiveAction"),
-    ]
-    for lbl, key in extras:
-        if i < len(lines) and lines[i] == lbl and i + 1 < len(lines):
-            out[key] = lines[i + 1]
-            i += 2
-    if "rootCause" not in out and out.get("why5"):
-        out["rootCause"] = out["why5"]
-    return out, i
-
-
-def parse_ishikawa(lines: List[str], i: int, problem_fallback: str) -> Tuple[Dict[str, Any], int]:
-    if i >= len(lines) or not lines[i].startswith("4. BALIK"):
-        return {"problem": problem_fallback, "man": [], "machine": [], "material": [], "measurement": [], "environment": [], "management": []}, i
-    i += 1
-    while i < len(lines) and lines[i] in ("6M Kategorisi", "Olasi Neden / Etken", "Risk Derecesi"):
-        i += 1
-    cat_map = [
+    )),
+    section("ishikawa_analysis", r"4\. BALIK", ("6M Kategorisi", "Olasi Neden / Etken", "Risk Derecesi"), (
         ("INSAN (Man)", "man"),
         ("MAKINE (Machine)", "machine"),
         ("METOT (Method)", "management"),
         ("MALZEME (Material)", "material"),
         ("CEVRE (Environment)", "environment"),
         ("OLCUM (Measurement)", "measurement"),
-    ]
-    data: Dict[str, Any] = {
-        "problem": problem_fallback,
-        "man": [],
-        "machine": [],
-        "material": [],
-        "measurement": [],
-        "environment": [],
-        "management": [],
-    }
-    risks = ("Yuksek", "Orta", "Dusuk", "Düşük")
-    for cat_label, key in cat_map:
-        if i < len(lines) and lines[i] == cat_label:
-            i += 1
-            cause = ""
-            if i < len(lines) and lines[i] not in cat_map and not lines[i].startswith("5."):
-                cause = lines[i]
-                i += 1
-            if i < len(lines) and lines[i] in risks:
-                i += 1
-            if cause:
-                data[key].append(cause)
-    return data, i
-
-
-def parse_fta(lines: List[str], i: int) -> Tuple[Dict[str, str], int]:
-    if i >= len(lines) or not lines[i].startswith("5. FTA"):
-        return {}, i
-    i += 1
-    while i < len(lines) and lines[i] in ("FTA Unsuru", "Aciklama"):
-        i += 1
-    fields = [
+    ), kind="causes"),
+    section("fta_analysis", r"5\. FTA", ("FTA Unsuru", "Aciklama"), tuple((label, label) for label in (
         "Ust Olay (Top Event)",
         "Ara Olay 1",
         "Ara Olay 2",
@@ -218,151 +238,122 @@ def parse_fta(lines: List[str], i: int) -> Tuple[Dict[str, str], int]:
         "Kapi Mantigi 1",
         "Kapi Mantigi 2",
         "Analiz Ozeti",
-    ]
-    raw: Dict[str, str] = {}
-    for lbl in fields:
-        if i < len(lines) and lines[i] == lbl and i + 1 < len(lines):
-            raw[lbl] = lines[i + 1]
-            i += 2
-        elif i < len(lines) and lines[i] == lbl:
-            i += 1
-    top = raw.get("Ust Olay (Top Event)", "")
-    ara = []
-    if raw.get("Ara Olay 1"):
-        ara.append(raw["Ara Olay 1"])
-    if raw.get("Ara Olay 2"):
-        ara.append(raw["Ara Olay 2"])
-    temel = []
-    for k in ("Temel Olay 1", "Temel Olay 2", "Temel Olay 3", "Temel Olay 4"):
-        if raw.get(k):
-            temel.append(raw[k])
-    gates = []
-    if raw.get("Kapi Mantigi 1"):
-        gates.append(raw["Kapi Mantigi 1"])
-    if raw.get("Kapi Mantigi 2"):
-        gates.append(raw["Kapi Mantigi 2"])
-    fta: Dict[str, str] = {
-        "topEvent": top,
-        "intermediateEvents": "\n".join(ara),
-        "basicEvents": "\n".join(temel),
-        "gates": "\n".join(gates),
-        "summary": raw.get("Analiz Ozeti", ""),
-    }
-    return fta, i
-
-
-def parse_8d_steps(lines: List[str], i: int) -> Tuple[Dict[str, Dict[str, str]], int]:
-    if i >= len(lines) or not (lines[i].startswith("6. 8D ADIMLARIM") or lines[i].startswith("8D ADIMLARIM")):
-        return {}, i
-    i += 1
-    while i < len(lines) and lines[i] in ("8D Adimi", "Aciklama", "Sorumlu / Tarih"):
-        i += 1
-    steps: Dict[str, Dict[str, str]] = {}
-    order = [f"D{n}" for n in range(1, 9)]
-    pat = re.compile(r"^D([1-8])\s*-\s*(.+)$")
-    current: Optional[str] = None
-    buf: List[str] = []
-
-    def flush():
-        nonlocal current, buf
-        if current and buf:
-            body = "\n".join(buf).strip()
-            title_match = re.match(r"^(D[1-8])\s*-\s*(.+)$", buf[0] if buf else "")
-            title = title_match.group(2).strip() if title_match else ""
-            steps[current] = {
-                "title": title,
-                "responsible": "",
-                "completionDate": "",
-                "description": body,
-            }
-        buf = []
-        current = None
-
-    while i < len(lines):
+    ))),
+    section("eight_d_steps", r"(?:6\. )?8D ADIMLARIM", ("8D Adimi", "Aciklama", "Sorumlu / Tarih"), kind="steps"),
+)
+RE_SECTION = re.compile("|".join(f"({s.head})" for s in SECTIONS))
+
+# parse_report durumları; CELLS, CAUSE ve RISK bir bölümün içinde birkaç satır süren ara durumlardır.
+PRE, BASIC, STEPS, FIELDS, CELLS, CAUSE, RISK = range(7)
+
+
+def parse_report(lines: Sequence[str], kind: str, lo: int = 0, hi: Optional[int] = None) -> Dict[str, Any]:
+    """Parse the report in lines[lo:hi], visiting each line once; the layout comes from SECTIONS.
+
+    Within a section each label must come after the previous one. A line that is neither
+    a later label nor the header of a later section ends the parse.
+    """
+    hi = len(lines) if hi is None else hi
+    last = len(SECTIONS) if kind == "8D" else len(SECTIONS) - 1
+    basic: Dict[str, str] = {}
+    found: Dict[str, Dict[str, Any]] = {}
+    steps: Dict[str, Tuple[int, int]] = {}
+    state, pos, cursor = PRE, -1, 0
+    find, cells, causes = SECTIONS[0].find, SECTIONS[0].cells, False
+    data: Dict[str, Any] = basic  # bekleyen değerin yazılacağı sözlük
+    want: Optional[str] = None  # önceki satırdaki etiketin alanı; bu satır onun değeri
+    cause_field = ""
+    step, start, end = "", 0, hi
+    for i in range(lo, hi):
         line = lines[i]
-        m = pat.match(line)
-        if m:
-            flush()
-            current = f"D{m.group(1)}"
-            buf = [line]
-            i += 1
+        if want is not None:
+            data[want] = line
+            want = None
             continue
-        if current:
-            # stop at KADEME footer
-            if line.startswith("KADEME A.Ş. KYS"):
+        if state >= FIELDS:
+            if state != FIELDS:
+                if state == CELLS:
+                    if line in cells:
+                        continue
+                elif state == CAUSE:
+                    if not line.startswith("5."):
+                        if line:
+                            data.setdefault(cause_field, []).append(line)
+                        state = RISK
+                        continue
+                elif line in RISKS:
+                    state = FIELDS
+                    continue
+                state = FIELDS
+            hit = find(line)
+            if hit is not None and hit[0] >= cursor:
+                cursor = hit[0] + 1
+                if causes:
+                    cause_field, state = hit[1], CAUSE
+                else:
+                    want = hit[1]
+                continue
+        elif state == STEPS:
+            # Her adım kendi D satırından bir sonraki D satırına (ya da altbilgiye) kadar sürer.
+            m = RE_STEP.match(line) if line[:1] == "D" else None
+            if m:
+                if step:
+                    steps[step] = (start, i)
+                step, start = f"D{m.group(1)}", i
+            elif step and line.startswith(FOOTER):
+                end = i
                 break
-            buf.append(line)
-        i += 1
-    flush()
-    # Ensure all D keys exist with empty description
-    default_titles = {
-        "D1": "Ekip Oluşturma",
-        "D2": "Problemi Tanımlama",
-        "D3": "Geçici Önlemler Alma",
-        "D4": "Kök Neden Analizi",
-        "D5": "Kalıcı Düzeltici Faaliyetleri Belirleme",
-        "D6": "Kalıcı Düzeltici Faaliyetleri Uygulama",
-        "D7": "Tekrarlanmayı Önleme",
-        "D8": "Ekibi Takdir Etme",
-    }
-    for dk in order:
-        if dk not in steps:
-            steps[dk] = {
-                "title": default_titles[dk],
+            continue
+        elif state == BASIC:
+            if line in BASIC_LABELS:
+                want = line
+                continue
+            if line != BASIC_END:
+                continue
+        else:
+            if line.startswith(BASIC_HEAD):
+                state = BASIC
+            continue
+        # Bölüm bitti: satır sonraki bölümlerden birinin başlığı değilse rapor da biter.
+        m = RE_SECTION.match(line)
+        if not m or not pos < m.lastindex - 1 < last:
+            break
+        pos = m.lastindex - 1
+        sec = SECTIONS[pos]
+        find, cells, causes, cursor = sec.find, sec.cells, sec.kind == "causes", 0
+        state = STEPS if sec.kind == "steps" else CELLS
+        data = found[sec.key] = {}
+    if step:
+        steps[step] = (start, end)
+
+    why = found.get("five_why_analysis", {})
+    if "rootCause" not in why and why.get("why5"):
+        why["rootCause"] = why["why5"]
+    causes = found.get("ishikawa_analysis", {})
+    ishikawa: Dict[str, Any] = {"problem": basic.get("Problem Tanimi") or why.get("problem") or ""}
+    ishikawa.update((k, causes.get(k, [])) for k in ISHIKAWA_KEYS)
+    fta: Dict[str, str] = {}
+    if "fta_analysis" in found:
+        raw = found["fta_analysis"]
+        fta = {key: "\n".join([raw[k] for k in labels if raw.get(k)]) for key, labels in FTA_FIELDS}
+    eight_d: Optional[Dict[str, Dict[str, str]]] = None
+    if kind == "8D":
+        eight_d = {}
+        for dk, title in EIGHT_D_TITLES.items():
+            a, b = steps.get(dk, (0, 0))
+            eight_d[dk] = {
+                "title": title,
                 "responsible": "",
                 "completionDate": "",
-                "description": "",
+                "description": "\n".join(lines[a:b]).strip() if b else "",
             }
-        else:
-            steps[dk]["title"] = default_titles[dk]
-    return steps, i
-
-
-def merge_default_8d(parsed: Dict[str, Dict[str, str]]) -> Dict[str, Dict[str, str]]:
-    default_titles = {
-        "D1": "Ekip Oluşturma",
-        "D2": "Problemi Tanımlama",
-        "D3": "Geçici Önlemler Alma",
-        "D4": "Kök Neden Analizi",
-        "D5": "Kalıcı Düzeltici Faaliyetleri Belirleme",
-        "D6": "Kalıcı Düzeltici Faaliyetleri Uygulama",
-        "D7": "Tekrarlanmayı Önleme",
-        "D8": "Ekibi Takdir Etme",
-    }
-    out: Dict[str, Dict[str, str]] = {}
-    for k in default_titles:
-        p = parsed.get(k) or {}
-        out[k] = {
-            "title": default_titles[k],
-            "responsible": p.get("responsible") or "",
-            "completionDate": p.get("completionDate") or "",
-            "description": p.get("description") or "",
-        }
-    return out
-
-
-def parse_report(lines: List[str], kind: str) -> Dict[str, Any]:
-    i = 0
-    while i < len(lines) and not lines[i].startswith("1. TEMEL"):
-        i += 1
-    stop_basic = ("2. 5N1K ANALİZİ",)
-    basic, i = kv_block(lines, i + 1, stop_basic)
-    n1k, i = parse_5n1k(lines, i)
-    why, i = parse_5why(lines, i)
-    prob = basic.get("Problem Tanimi") or why.get("problem") or ""
-    ish, i = parse_ishikawa(lines, i, prob)
-    fta, i = parse_fta(lines, i)
-    eight_d: Dict[str, Dict[str, str]] = {}
-    if kind == "8D":
-        e8, i = parse_8d_steps(lines, i)
-        eight_d = merge_default_8d(e8)
     return {
         "basic": basic,
-        "five_n1k_analysis": n1k,
+        "five_n1k_analysis": found.get("five_n1k_analysis", {}),
         "five_why_analysis": why,
-        "ishikawa_analysis": ish,
+        "ishikawa_analysis": ishikawa,
         "fta_analysis": fta,
-        "eight_d_steps": eight_d if kind == "8D" else None,
+        "eight_d_steps": eight_d,
     }
 
 
@@ -372,87 +363,332 @@ def sql_dollar(tag: str, payload: Any) -> str:
     return f"${tag}$" + body + f"${tag}$"
 
 
-def build_update(nc_number: str, kind: str, parsed: Dict[str, Any]) -> str:
+# non_conformities sütunları ve toplu UPDATE'te jsonb_to_recordset tipleri, SET sırasıyla.
+UPDATE_COLUMNS = {
+    "department": "text",
+    "title": "text",
+    "description": "text",
+    "problem_definition": "text",
+    "responsible_person": "text",
+    "part_name": "text",
+    "part_code": "text",
+    "vehicle_type": "text",
+    "opening_date": "date",
+    "five_n1k_analysis": "jsonb",
+    "five_why_analysis": "jsonb",
+    "ishikawa_analysis": "jsonb",
+    "fta_analysis": "jsonb",
+    "eight_d_steps": "jsonb",
+}
+# Her raporda bulunmayan sütunlar; rapor vermiyorsa mevcut değer korunur.
+OPTIONAL_COLUMNS = ("opening_date", "eight_d_steps")
+
+
+def update_fields(nc_number: str, kind: str, parsed: Dict[str, Any]) -> Dict[str, Any]:
+    """Column -> new value for one report, in UPDATE_COLUMNS order (optional columns only when known)."""
     basic = parsed["basic"]
-    dept = basic.get("Birim/Departman") or ""
     opening = basic.get("Yayın Tarihi") or ""
-    # tr date dd.mm.yyyy -> ISO
+    # tr date dd.mm.yyyy -> ISO; takvimde olmayan tarih (31.02.2026) yazılmaz, mevcut değer kalır.
     iso_date = ""
     if opening and re.match(r"^\d{2}\.\d{2}\.\d{4}$", opening.strip()):
         d, m, y = opening.strip().split(".")
-        iso_date = f"{y}-{m}-{d}"
+        try:
+            iso_date = date.fromisoformat(f"{y}-{m}-{d}").isoformat()
+        except ValueError:
+            print(f"warning: {nc_number}: invalid Yayın Tarihi {opening.strip()!r}, opening_date left unchanged",
+                  file=sys.stderr)
     resp = basic.get("Sorumlu Kişi") or ""
     if resp == "-":
         resp = ""
-    part_name = basic.get("Parça Adı") or ""
-    part_code = basic.get("Parça Kodu") or ""
-    vehicle = basic.get("Araç Tipi") or ""
     prob = basic.get("Problem Tanimi") or ""
     title = (prob[:180] + "…") if len(prob) > 180 else prob
     if not title:
         title = f"{kind} {nc_number}"
 
-    tag = "j" + secrets.token_hex(12)
-    tag2 = "j" + secrets.token_hex(12)
-    tag3 = "j" + secrets.token_hex(12)
-    tag4 = "j" + secrets.token_hex(12)
-    tag5 = "j" + secrets.token_hex(12)
-
-    sets = [
-        f"department = {sql_escape(dept)}",
-        f"title = {sql_escape(title)}",
-        f"description = {sql_escape(prob)}",
-        f"problem_definition = {sql_escape(prob)}",
-        f"responsible_person = {sql_escape(resp)}",
-        f"part_name = {sql_escape(part_name)}",
-        f"part_code = {sql_escape(part_code)}",
-        f"vehicle_type = {sql_escape(vehicle)}",
-    ]
+    fields: Dict[str, Any] = {
+        "department": basic.get("Birim/Departman") or "",
+        "title": title,
+        "description": prob,
+        "problem_definition": prob,
+        "responsible_person": resp,
+        "part_name": basic.get("Parça Adı") or "",
+        "part_code": basic.get("Parça Kodu") or "",
+        "vehicle_type": basic.get("Araç Tipi") or "",
+    }
     if iso_date:
-        sets.append(f"opening_date = {sql_escape(iso_date)}")
-
-    sets.append(f"five_n1k_analysis = {sql_dollar(tag, parsed['five_n1k_analysis'])}::jsonb")
-    sets.append(f"five_why_analysis = {sql_dollar(tag + 'a', parsed['five_why_analysis'])}::jsonb")
-    sets.append(f"ishikawa_analysis = {sql_dollar(tag + 'b', parsed['ishikawa_analysis'])}::jsonb")
-    sets.append(f"fta_analysis = {sql_dollar(tag + 'c', parsed['fta_analysis'])}::jsonb")
-
+        fields["opening_date"] = iso_date
+    fields["five_n1k_analysis"] = parsed["five_n1k_analysis"]
+    fields["five_why_analysis"] = parsed["five_why_analysis"]
+    fields["ishikawa_analysis"] = parsed["ishikawa_analysis"]
+    fields["fta_analysis"] = parsed["fta_analysis"]
     if kind == "8D" and parsed.get("eight_d_steps"):
-        sets.append(f"eight_d_steps = {sql_dollar(tag + 'd', parsed['eight_d_steps'])}::jsonb")
+        fields["eight_d_steps"] = parsed["eight_d_steps"]
+    return fields
+
 
+def build_update(nc_number: str, kind: str, parsed: Dict[str, Any]) -> str:
+    tag = "j" + secrets.token_hex(12)
+    suffixes = iter(("", "a", "b", "c", "d"))
+    sets = []
+    for col, value in update_fields(nc_number, kind, parsed).items():
+        if UPDATE_COLUMNS[col] == "jsonb":
+            sets.append(f"{col} = {sql_dollar(tag + next(suffixes), value)}::jsonb")
+        else:
+            sets.append(f"{col} = {sql_escape(value)}")
     return f"UPDATE non_conformities SET {', '.join(sets)} WHERE nc_number = {sql_escape(nc_number)};"
 
 
+def row_columns() -> str:
+    """Column definitions of one update row: nc_number + UPDATE_COLUMNS."""
+    return ", ".join(["nc_number text"] + [f"{col} {typ}" for col, typ in UPDATE_COLUMNS.items()])
+
+
+def merge_update(source: str) -> str:
+    """UPDATE non_conformities n from update rows `r` (in `source`), matched on nc_number."""
+    sets = ",\n    ".join(
+        f"{col} = COALESCE(r.{col}, n.{col})" if col in OPTIONAL_COLUMNS else f"{col} = r.{col}"
+        for col in UPDATE_COLUMNS
+    )
+    return f"UPDATE non_conformities AS n SET\n    {sets}\nFROM {source}\nWHERE n.nc_number = r.nc_number"
+
+
+def build_batch_update(reports: List[Report]) -> str:
+    """One set-based UPDATE for many reports: the rows travel as a single jsonb array."""
+    rows = [json.dumps({"nc_number": nc, **update_fields(nc, kind, parsed)}, ensure_ascii=False)
+            for nc, kind, parsed in reports]
+    tag = "j" + secrets.token_hex(12)
+    payload = f"${tag}$[\n" + ",\n".join(rows) + f"\n]${tag}$"
+    return merge_update(f"jsonb_to_recordset({payload}::jsonb) AS r({row_columns()})") + ";"
+
+
+def stage_row(nc_number: str, kind: str, parsed: Dict[str, Any]) -> List[Any]:
+    """One binary COPY row for the staging table (nc_number + UPDATE_COLUMNS, NULL when absent)."""
+    fields = update_fields(nc_number, kind, parsed)
+    row: List[Any] = [nc_number]
+    for col, typ in UPDATE_COLUMNS.items():
+        value = fields.get(col)
+        if value is not None and typ == "jsonb":
+            value = Jsonb(value)
+        elif value is not None and typ == "date":
+            value = date.fromisoformat(value)
+        row.append(value)
+    return row
+
+
+def apply_reports(dsn: str, reports: List[Report]) -> Tuple[int, List[str]]:
+    """COPY the reports into a temporary staging table and merge them into non_conformities
+    in one transaction. Returns (rows updated, nc_numbers with no matching record)."""
+    laps: List[Tuple[str, float]] = []
+    t = time.perf_counter()
+
+    def lap(stage: str) -> None:
+        nonlocal t
+        now = time.perf_counter()
+        laps.append((stage, now - t))
+        t = now
+
+    with psycopg.connect(dsn) as conn:
+        lap("connect")
+        cur = conn.cursor()
+        cur.execute(f"CREATE TEMP TABLE df8d_stage ({row_columns()}) ON COMMIT DROP")
+        with cur.copy(f"COPY df8d_stage (nc_number, {', '.join(UPDATE_COLUMNS)}) FROM STDIN (FORMAT BINARY)") as copy:
+            copy.set_types(["text", *UPDATE_COLUMNS.values()])
+            for nc_num, kind, parsed in reports:
+                copy.write_row(stage_row(nc_num, kind, parsed))
+        lap("copy")
+        # Geçici tabloların istatistiği yok; ANALYZE olmadan planlayıcı küçük tablo varsayar.
+        cur.execute("ANALYZE df8d_stage")
+        cur.execute(merge_update("df8d_stage AS r"))
+        updated = cur.rowcount
+        cur.execute("""SELECT r.nc_number FROM df8d_stage r
+                       WHERE NOT EXISTS (SELECT 1 FROM non_conformities n WHERE n.nc_number = r.nc_number)""")
+        missing = sorted((row[0] for row in cur.fetchall()), key=nc_sort_key)
+        lap("merge")
+    lap("commit")
+    for stage, secs in laps:
+        print(f"apply {stage}: {secs:.3f} s")
+    return updated, missing
+
+
+def write_sql(path: Path, reports: List[Report], batch: int) -> int:
+    """Write the UPDATE statements atomically (via a .tmp file); returns the statement count."""
+    tmp_sql = path.with_suffix(".sql.tmp")
+    statements = 0
+    try:
+        with tmp_sql.open("w", encoding="utf-8") as out:
+            if batch > 0:
+                for b in range(0, len(reports), batch):
+                    out.write(build_batch_update(reports[b: b + batch]) + "\n")
+                    statements += 1
+            else:
+                for nc_num, kind, parsed in reports:
+                    out.write(build_update(nc_num, kind, parsed) + "\n")
+                    statements += 1
+    except BaseException:
+        tmp_sql.unlink(missing_ok=True)
+        raise
+    tmp_sql.replace(path)
+    return statements
+
+
 def sql_escape(s: str) -> str:
     if s is None:
         return "NULL"
     return "'" + s.replace("'", "''") + "'"
 
 
-def main() -> None:
-    docx = Path(
-        sys.argv[1]
-        if len(sys.argv) > 1
-        else "/Users/atakanbattal/Downloads/KademeQMS_DF8D_Klasor_2026-04-14_1934/KademeQMS_DF8D_Analizleri_2026.docx"
-    )
-    paras = extract_paragraphs(docx)
-    starts = find_report_starts(paras)
-    if not starts:
-        print("No report headers found", file=sys.stderr)
-        sys.exit(1)
+DEFAULT_OUTPUT = Path(__file__).parent / "_df8d_bulk_update_generated.sql"
 
-    out_sql = Path(__file__).parent / "_df8d_bulk_update_generated.sql"
-    lines_out: List[str] = []
-    for idx, (nc_num, kind) in enumerate([(t[1], t[2]) for t in starts]):
-        section = slice_section(paras, starts, idx)
+
+def expand_inputs(args: List[str]) -> List[Path]:
+    """Docx files named by paths, directories (searched recursively) or glob patterns, sorted and de-duplicated."""
+    found: Dict[Path, None] = {}
+    for a in args:
+        p = Path(a)
+        if p.is_dir():
+            matches = sorted(p.rglob("*.docx"))
+        elif p.exists():
+            matches = [p]
+        else:
+            matches = sorted(Path(m) for m in glob.glob(a, recursive=True))
+        if not matches:
+            print(f"warning: no documents match {a}", file=sys.stderr)
+        for m in matches:
+            # Word'ün açık belge kilit dosyaları (~$...) atlanır.
+            if m.suffix.lower() == ".docx" and not m.name.startswith("~$"):
+                found.setdefault(m.resolve(), None)
+    return sorted(found)
+
+
+def parse_document(docx_path: Path) -> Tuple[Path, List[Report], int, float]:
+    """(path, reports, paragraph count, seconds) for one document; runs in a pool worker."""
+    t0 = time.perf_counter()
+    reports: List[Report] = []
+    paras = 0
+    for nc_num, kind, section in iter_sections(iter_paragraphs(docx_path)):
         try:
-            parsed = parse_report(section, kind)
-            lines_out.append(build_update(nc_num, kind, parsed))
+            reports.append((nc_num, kind, parse_report(section, kind)))
         except Exception as e:
-            print(f"FAIL {nc_num}: {e}", file=sys.stderr)
-            raise
+            raise RuntimeError(f"{docx_path.name}: {nc_num}: {e}") from e
+        paras += len(section)
+    return docx_path, reports, paras, time.perf_counter() - t0
+
+
+def nc_sort_key(nc_number: str) -> Tuple[Any, ...]:
+    """DF-2026-7 < DF-2026-12 < 8D-... numbering order, not string order."""
+    m = re.match(r"^(\w+)-(\d+)-(\d+)$", nc_number)
+    return (m.group(1), int(m.group(2)), int(m.group(3)), "") if m else ("~", 0, 0, nc_number)
+
+
+def merge_reports(results: List[Tuple[Path, List[Report]]]) -> Tuple[List[Report], List[str]]:
+    """Reports ordered by nc_number, plus conflict notes.
+
+    A number parsed from several files with different content is a conflict; the file
+    that sorts last by path wins. Identical repeats are merged silently.
+    """
+    by_nc: Dict[str, List[Tuple[Path, Report]]] = {}
+    for path, reports in sorted(results, key=lambda r: r[0]):
+        for r in reports:
+            by_nc.setdefault(r[0], []).append((path, r))
+    merged: List[Report] = []
+    conflicts: List[str] = []
+    for nc in sorted(by_nc, key=nc_sort_key):
+        seen = by_nc[nc]
+        if len({json.dumps(r[1:], sort_keys=True, ensure_ascii=False) for _, r in seen}) > 1:
+            files = ", ".join(sorted({p.name for p, _ in seen}))
+            conflicts.append(f"{nc}: differs between {files}; using {seen[-1][0].name}")
+        merged.append(seen[-1][1])
+    return merged, conflicts
+
+
+def bench(docs: List[Path], rounds: int) -> None:
+    """Time report splitting + parse_report over `docs`, best of `rounds`; XML reading is done once, untimed."""
+    paras = [p for d in docs for p in iter_paragraphs(d)]
+    best, n = float("inf"), 0
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        n = 0
+        for _, kind, lines in iter_sections(paras):
+            parse_report(lines, kind)
+            n += 1
+        best = min(best, time.perf_counter() - t0)
+    print(f"parse: {n} reports, {len(paras)} paragraphs; best of {rounds}: {best:.3f} s "
+          f"({best / max(n, 1) * 1e6:.1f} us/report, {len(paras) / best / 1e6:.2f} M paragraphs/s)")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("inputs", nargs="+", help="docx files, directories (recursive) or glob patterns")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="parallel worker processes")
+    # Çıktı modu: SQL dosyası (-o, --batch), doğrudan uygulama (--apply) ya da yalnız ölçüm (--bench).
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("-o", "--output", type=Path, help=f"SQL output file (default: {DEFAULT_OUTPUT.name})")
+    mode.add_argument("--apply", action="store_true",
+                      help="COPY the reports into a staging table and update non_conformities directly instead of writing SQL")
+    mode.add_argument("--bench", type=int, metavar="ROUNDS", help="only time parse_report over the documents; writes nothing")
+    ap.add_argument("--batch", type=int, default=0, metavar="N",
+                    help="one set-based UPDATE per N reports instead of one UPDATE per report (SQL output only)")
+    ap.add_argument("--dsn", help="database URL for --apply (default: SUPABASE_DB_URL / DATABASE_URL)")
+    args = ap.parse_args()
+    if args.batch and (args.apply or args.bench is not None):
+        ap.error("--batch only applies to SQL output, not to --apply or --bench")
+    if args.dsn and not args.apply:
+        ap.error("--dsn is only used with --apply")
+    if args.bench is not None and args.bench < 1:
+        ap.error("--bench needs at least 1 round")
+    output = args.output or DEFAULT_OUTPUT
+
+    docs = expand_inputs(args.inputs)
+    if not docs:
+        print("No documents found", file=sys.stderr)
+        sys.exit(1)
+    if args.bench is not None:
+        bench(docs, args.bench)
+        return
+    if args.apply:
+        if psycopg is None:
+            print("--apply needs psycopg: pip install 'psycopg[binary]'", file=sys.stderr)
+            sys.exit(2)
+        dsn = args.dsn or os.environ.get("SUPABASE_DB_URL") or os.environ.get("DATABASE_URL")
+        if not dsn:
+            print("SUPABASE_DB_URL or DATABASE_URL (or --dsn) is required", file=sys.stderr)
+            sys.exit(2)
+
+    t0 = time.perf_counter()
+    results: List[Tuple[Path, List[Report]]] = []
+    stats: List[Tuple[Path, int, int, float]] = []
+    jobs = max(1, min(args.jobs, len(docs)))
+    # Belge başına bir iş: XML okuma süreyi belirler, raporlar belgeyi okuyan süreçte ayrıştırılır.
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for path, reports, paras, secs in pool.map(parse_document, docs):
+            results.append((path, reports))
+            stats.append((path, len(reports), paras, secs))
+    merged, conflicts = merge_reports(results)
+    for c in conflicts:
+        print(f"CONFLICT {c}", file=sys.stderr)
+    if not merged:
+        print("No report headers found", file=sys.stderr)
+        sys.exit(1)
 
-    out_sql.write_text("\n".join(lines_out) + "\n", encoding="utf-8")
-    print(f"Wrote {len(lines_out)} statements to {out_sql}")
+    if args.apply:
+        updated, missing = apply_reports(dsn, merged)
+        for nc in missing:
+            print(f"MISSING {nc}: no non_conformities record", file=sys.stderr)
+    else:
+        statements = write_sql(output, merged, args.batch)
+    wall = time.perf_counter() - t0
+
+    for path, n, paras, secs in stats:
+        mb = path.stat().st_size / 1e6
+        print(f"{path.name}: {n} reports, {paras} paragraphs in {secs:.2f} s "
+              f"({n / secs if secs else 0:.0f} reports/s, {mb / secs if secs else 0:.2f} MB/s)")
+    total = sum(n for _, n, _, _ in stats)
+    print(f"Total: {len(docs)} documents, {total} reports in {wall:.2f} s with {jobs} workers "
+          f"({total / wall if wall else 0:.0f} reports/s); {len(conflicts)} conflicts")
+    if args.apply:
+        print(f"Applied {len(merged)} reports: {updated} records updated, {len(missing)} without a record")
+    else:
+        print(f"Wrote {statements} statements ({len(merged)} reports, {output.stat().st_size / 1e6:.2f} MB) to {output}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,20 @@
+"""Tests for the Python tooling in scripts/ (run from the repo root: ``python -m pytest scripts/tests``).
+
+The scripts are plain modules next to each other, so scripts/ goes on sys.path.
+Database tests run only when TEST_DATABASE_URL points at a throwaway PostgreSQL.
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def dsn() -> str:
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    return url
@@ -0,0 +1,160 @@
+"""Shape of the SQL generated by build_kpi_monthly_migration (no database needed)."""
+import re
+
+import pytest
+
+import build_kpi_monthly_migration as gen
+from build_kpi_monthly_migration import Kpi
+
+
+def norm(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+def strip_filters(expr: str) -> str:
+    """expr without its FILTER (WHERE ...) clauses."""
+    out, pos = [], 0
+    for m in gen.FILTER_RE.finditer(expr):
+        if m.start() < pos:
+            continue
+        out.append(expr[pos:m.start()])
+        pos = gen.after_close(expr, m.start(1) + 1)
+    out.append(expr[pos:])
+    return norm("".join(out))
+
+
+@pytest.fixture(scope="module")
+def statements():
+    """Generated statements by the function they create (other statements are left out)."""
+    out = {}
+    for stmt in gen.split_statements(gen.build_sql()):
+        m = re.search(r"CREATE OR REPLACE FUNCTION public\.(\w+)\(", stmt)
+        if m:
+            out[m.group(1)] = norm(stmt)
+    return out
+
+
+# --- conjuncts
+
+def test_conjuncts_splits_top_level_and_only():
+    assert gen.conjuncts("a = 1 AND (b = 2 AND c = 3) and d IN ('x AND y')") == [
+        "a = 1", "(b = 2 AND c = 3)", "d IN ('x AND y')"]
+
+
+def test_conjuncts_normalises_whitespace_and_drops_empty():
+    assert gen.conjuncts("nc.created_at < m_end\n        AND  nc.status <> 'Kapatıldı'") == [
+        "nc.created_at < m_end", "nc.status <> 'Kapatıldı'"]
+    assert gen.conjuncts("") == []
+
+
+# --- with_filter
+
+def test_with_filter_adds_filter_to_every_aggregate():
+    assert gen.with_filter("COALESCE(SUM(amount), 0)::numeric / NULLIF(COUNT(*), 0)", "x > 1") == \
+        "COALESCE(SUM(amount) FILTER (WHERE x > 1), 0)::numeric / NULLIF(COUNT(*) FILTER (WHERE x > 1), 0)"
+
+
+def test_with_filter_merges_existing_filter():
+    assert gen.with_filter("COUNT(*) FILTER (WHERE status = 'a)')::numeric", "x > 1") == \
+        "COUNT(*) FILTER (WHERE (x > 1) AND (status = 'a)'))::numeric"
+
+
+def test_with_filter_keeps_nested_calls_and_empty_condition():
+    expr = "COALESCE(ROUND(AVG(EXTRACT(EPOCH FROM d.duration) / 86400)::numeric, 2), 0)"
+    assert gen.with_filter(expr, "") == expr
+    assert gen.with_filter(expr, "d.ok") == \
+        "COALESCE(ROUND(AVG(EXTRACT(EPOCH FROM d.duration) / 86400) FILTER (WHERE d.ok)::numeric, 2), 0)"
+    assert gen.with_filter("COUNT(DISTINCT characteristic_id)::numeric", "c") == \
+        "COUNT(DISTINCT characteristic_id) FILTER (WHERE c)::numeric"
+
+
+# --- split_statements
+
+def test_split_statements_respects_quotes_and_dollar_tags():
+    sql = """-- baş
+CREATE FUNCTION f() RETURNS text LANGUAGE sql AS $$ SELECT 'a;b'; $$;
+CREATE FUNCTION g() RETURNS void LANGUAGE plpgsql AS $g$ BEGIN PERFORM $$;$$; END; $g$;
+/* ; */ SELECT 'it''s; fine', "odd;name" FROM t;
+SELECT 1; -- ; sonda
+"""
+    stmts = gen.split_statements(sql)
+    assert len(stmts) == 4
+    assert stmts[0].startswith("-- baş\nCREATE FUNCTION f()") and stmts[0].endswith("$$;")
+    assert stmts[1].endswith("END; $g$;")
+    assert stmts[2] == """/* ; */ SELECT 'it''s; fine', "odd;name" FROM t;"""
+    assert stmts[3] == "SELECT 1;"
+
+
+def test_split_statements_rejects_unterminated_statement():
+    with pytest.raises(ValueError, match="unterminated"):
+        gen.split_statements("SELECT 1;\nSELECT 2")
+
+
+# --- alias dedup
+
+def test_equal_definitions_share_one_canonical(monkeypatch):
+    monkeypatch.setattr(gen, "KPIS", [
+        Kpi("a", "COUNT(*)::numeric", "t", "x = 1", time_col="created_at"),
+        Kpi("b", "COUNT(*)::numeric", "t", "x = 1\n        ", time_col="created_at"),
+        Kpi("c", "COUNT(*)::numeric", "t", "x = 2", time_col="created_at"),
+    ])
+    assert [(k.kid, kids) for k, kids in gen.canonical_kpis()] == [("a", ["a", "b"]), ("c", ["c"])]
+    assert gen.canonical_of()["b"].kid == "a"
+
+
+def test_aliases_use_canonical_functions(statements):
+    for k, kids in gen.canonical_kpis():
+        assert gen.value_fn(k) in statements
+        for alias in kids[1:]:
+            assert f"kpi_value_{alias}" not in statements
+    sql = norm(gen.build_sql())
+    assert ("('supplier_nc_rate', 'incoming_rejection_rate', 'public.kpi_actual_incoming_rejection_rate', "
+            "'public.kpi_series_incoming_rejection_rate'") in sql
+
+
+# --- one expression per KPI
+
+def snapshot_columns():
+    """auto_kpi_id -> snapshot column expression, from the SELECTs kpi_monthly_snapshot runs."""
+    out = {}
+    for src, group in gen.source_groups():
+        for ks, select in gen.snapshot_selects(src, group):
+            cols = dict((int(i), e) for e, i in re.findall(r"^ {8}(.*?) AS c(\d+)(?=,\n|\n {6}FROM)", select, re.S | re.M))
+            assert len(cols) == len(ks), select
+            for i, (k, _) in enumerate(ks):
+                out[k.kid] = cols[i]
+    return out
+
+
+def test_actual_series_and_snapshot_use_the_same_expression(statements):
+    rollups = gen.rollup_of()
+    snap = snapshot_columns()
+    built = norm(gen.build_sql())
+    for k, _ in gen.canonical_kpis():
+        value = gen.rollup_value(k) if k.kid in rollups else k.value
+        assert norm(value) in statements[gen.value_fn(k)], k.kid
+        series = statements[gen.series_fn(k)]
+        if k.sweep:
+            # Ay sonu açık sayımı: değer COUNT(*) yerine +1/-1 olaylarının koşan toplamıdır.
+            assert all(norm(c) in series for c in k.sweep if c), k.kid
+            assert all(norm(f) in series for f in k.filters), k.kid
+        else:
+            assert norm(value) in series, k.kid
+        assert strip_filters(snap[k.kid]) == strip_filters(value), k.kid
+        assert norm(snap[k.kid]) in built, k.kid
+
+
+# --- --parts byte budget
+
+def test_every_part_of_the_real_migration_fits_the_budget():
+    parts = gen.split_parts(gen.build_sql())
+    sizes = [len(text.encode("utf-8")) for text, _ in parts]
+    assert max(sizes) <= gen.PART_BYTES
+    assert sum(n for _, n in parts) == len(gen.split_statements(gen.build_sql()))
+
+
+def test_oversized_statement_fails_and_keeps_existing_parts(tmp_path):
+    (tmp_path / "kpi_monthly_part001.sql").write_text("-- önceki\n")
+    with pytest.raises(ValueError, match="over --max-bytes"):
+        gen.write_parts(gen.build_sql(), str(tmp_path), max_bytes=15000)
+    assert (tmp_path / "kpi_monthly_part001.sql").read_text() == "-- önceki\n"
@@ -0,0 +1,43 @@
+"""Offline KPI engine: values must round like Postgres numeric."""
+import csv
+
+import pytest
+
+import kpi_offline_engine as engine
+
+duckdb = pytest.importorskip("duckdb")
+
+
+def write_csv(path, header, rows):
+    with path.open("w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        w.writerows(rows)
+
+
+def test_to_duckdb_rounds_in_decimal():
+    sql = engine.to_duckdb("ROUND(COUNT(*) FILTER (WHERE s = 'a,(b')::numeric / COUNT(*)::numeric * 100, 2)")
+    assert sql == ("ROUND((COUNT(*) FILTER (WHERE s = 'a,(b')::DECIMAL(38,10) / COUNT(*)::DECIMAL(38,10) * 100)"
+                   "::DECIMAL(38,10), 2)")
+    assert float(duckdb.sql(engine.to_duckdb("SELECT ROUND(41::numeric / 160::numeric * 100, 2)")).fetchone()[0]) == \
+        pytest.approx(25.63)
+
+
+def test_half_cent_values_match_postgres(tmp_path):
+    """41/160 = 25.625 % and AVG(3.26, 3.27) = 3.265 round up in Postgres; DOUBLE gave 25.62 and 3.26."""
+    write_csv(tmp_path / "nonconformity_records.csv", ["id", "status", "severity", "created_at"],
+              [(i, "Kapatıldı" if i < 41 else "Açık", "Orta", "2026-03-10T08:00:00+00:00") for i in range(160)])
+    write_csv(tmp_path / "suppliers.csv", ["id", "status", "created_at"],
+              [("s1", "Onaylı", "2025-01-01T00:00:00+00:00"), ("s2", "Onaylı", "2025-01-01T00:00:00+00:00")])
+    write_csv(tmp_path / "supplier_scores.csv", ["id", "supplier_id", "period", "final_score", "created_at"],
+              [(1, "s1", "2026-02", 3.26, "2026-03-01T00:00:00+00:00"),
+               (2, "s2", "2026-02", 3.27, "2026-03-01T00:00:00+00:00")])
+    gen = engine.load_generator()
+    rows = engine.run(gen, tmp_path, "2026-03", "2026-03", ["nonconformity_closure_rate", "avg_supplier_score"])
+    values = {kid: v for kid, _, _, v in rows}
+    assert values == {"nonconformity_closure_rate": pytest.approx(25.63), "avg_supplier_score": pytest.approx(3.27)}
+
+    expected = tmp_path / "db.csv"
+    write_csv(expected, ["auto_kpi_id", "year", "month", "actual_value"],
+              [("nonconformity_closure_rate", 2026, 3, "25.63"), ("avg_supplier_score", 2026, 3, "3.27")])
+    assert engine.compare(rows, expected) == []
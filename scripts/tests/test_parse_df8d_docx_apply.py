@@ -0,0 +1,147 @@
+"""parse_df8d_docx_apply outputs: per-report SQL, --batch SQL and --apply must leave the same rows."""
+import secrets
+
+import pytest
+
+import parse_df8d_docx_apply as df8d
+
+
+def parsed(date_text="", problem="", steps=None, **basic):
+    return {
+        "basic": {"Yayın Tarihi": date_text, "Problem Tanimi": problem, **basic},
+        "five_n1k_analysis": {"ne": problem, "nerede": "Hat 2"},
+        "five_why_analysis": {"why1": "Tork düşük", "why2": "$tag$ ve 'tırnak'"},
+        "ishikawa_analysis": {"insan": ["Eğitim eksik"], "makine": []},
+        "fta_analysis": {"top_event": problem},
+        "eight_d_steps": steps or {},
+    }
+
+
+REPORTS = [
+    ("DF-2026-1", "DF", parsed("05.03.2026", "Kaynak çatlağı", **{"Birim/Departman": "Kalite", "Sorumlu Kişi": "-"})),
+    ("DF-2026-2", "DF", parsed("31.02.2026", "O'Brien's \"tork\" sapması")),
+    ("DF-2026-3", "DF", parsed("", "Tarihsiz rapor", **{"Parça Kodu": "P-100"})),
+    ("8D-2026-1", "8D", parsed("17.10.2026", "Boya kabarması", steps={"D1": {"title": "Ekip", "description": "a; b"}})),
+    ("8D-2026-2", "8D", parsed("01.01.2026", "Adımsız 8D")),
+    ("DF-2026-99", "DF", parsed("02.02.2026", "Kaydı olmayan rapor")),
+]
+# DF-2026-99 dışındaki kayıtlar; mevcut opening_date / eight_d_steps, rapor vermiyorsa korunmalı.
+EXISTING = [(nc, "2025-12-01", '{"D0": {"title": "eski"}}') for nc, _, _ in REPORTS[:-1]]
+
+
+def test_impossible_opening_date_is_dropped_with_a_warning(capsys):
+    fields = df8d.update_fields(*REPORTS[1])
+    assert "opening_date" not in fields
+    assert "DF-2026-2: invalid Yayın Tarihi '31.02.2026'" in capsys.readouterr().err
+    assert df8d.update_fields(*REPORTS[0])["opening_date"] == "2026-03-05"
+    assert df8d.stage_row(*REPORTS[1])[1 + list(df8d.UPDATE_COLUMNS).index("opening_date")] is None
+
+
+def test_write_sql_statement_counts(tmp_path):
+    out = tmp_path / "out.sql"
+    assert df8d.write_sql(out, REPORTS, 0) == len(REPORTS)
+    assert df8d.write_sql(out, REPORTS, 4) == 2
+    assert not (tmp_path / "out.sql.tmp").exists()
+
+
+@pytest.fixture
+def schema(dsn):
+    """A scratch schema holding non_conformities; yields a connection string that searches it first."""
+    psycopg = pytest.importorskip("psycopg")
+    name = "df8d_test_" + secrets.token_hex(4)
+    conninfo = psycopg.conninfo.make_conninfo(dsn, options=f"-c search_path={name}")
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute(f"CREATE SCHEMA {name}")
+    try:
+        yield conninfo
+    finally:
+        with psycopg.connect(dsn, autocommit=True) as conn:
+            conn.execute(f"DROP SCHEMA {name} CASCADE")
+
+
+def reset_table(conninfo):
+    import psycopg
+
+    with psycopg.connect(conninfo) as conn:
+        conn.execute("DROP TABLE IF EXISTS non_conformities")
+        conn.execute(f"CREATE TABLE non_conformities ({df8d.row_columns()}, PRIMARY KEY (nc_number))")
+        for nc, opened, steps in EXISTING:
+            conn.execute("INSERT INTO non_conformities (nc_number, opening_date, eight_d_steps) VALUES (%s, %s, %s)",
+                         (nc, opened, steps))
+
+
+def table_rows(conninfo):
+    import psycopg
+
+    with psycopg.connect(conninfo) as conn:
+        return conn.execute("SELECT * FROM non_conformities ORDER BY nc_number").fetchall()
+
+
+def apply_file(conninfo, path):
+    import psycopg
+
+    with psycopg.connect(conninfo) as conn:
+        conn.execute(path.read_text(encoding="utf-8"))
+
+
+def test_batch_and_per_report_updates_leave_the_same_rows(schema, tmp_path):
+    per_report, batched = tmp_path / "per_report.sql", tmp_path / "batch.sql"
+    df8d.write_sql(per_report, REPORTS, 0)
+    df8d.write_sql(batched, REPORTS, 4)
+
+    reset_table(schema)
+    apply_file(schema, per_report)
+    expected = table_rows(schema)
+    reset_table(schema)
+    apply_file(schema, batched)
+    assert table_rows(schema) == expected
+
+    rows = {r[0]: r for r in expected}
+    cols = ["nc_number", *df8d.UPDATE_COLUMNS]
+    assert str(rows["DF-2026-1"][cols.index("opening_date")]) == "2026-03-05"
+    # Geçersiz tarih ve tarihsiz rapor mevcut değeri korur; adımsız rapor eight_d_steps'e dokunmaz.
+    assert str(rows["DF-2026-2"][cols.index("opening_date")]) == "2025-12-01"
+    assert str(rows["DF-2026-3"][cols.index("opening_date")]) == "2025-12-01"
+    assert rows["8D-2026-2"][cols.index("eight_d_steps")] == {"D0": {"title": "eski"}}
+    assert rows["8D-2026-1"][cols.index("eight_d_steps")] == {"D1": {"title": "Ekip", "description": "a; b"}}
+    assert rows["DF-2026-2"][cols.index("problem_definition")] == "O'Brien's \"tork\" sapması"
+
+
+def test_apply_updates_rows_keeps_optional_columns_and_lists_missing(schema, tmp_path):
+    reset_table(schema)
+    updated, missing = df8d.apply_reports(schema, REPORTS)
+    assert updated == len(EXISTING)
+    assert missing == ["DF-2026-99"]
+    applied = table_rows(schema)
+
+    rows = {r[0]: r for r in applied}
+    cols = ["nc_number", *df8d.UPDATE_COLUMNS]
+    assert rows["DF-2026-1"][cols.index("title")] == "Kaynak çatlağı"
+    assert rows["DF-2026-3"][cols.index("part_code")] == "P-100"
+    # COALESCE: rapor vermediği opening_date / eight_d_steps mevcut değerde kalır.
+    assert str(rows["DF-2026-3"][cols.index("opening_date")]) == "2025-12-01"
+    assert str(rows["DF-2026-2"][cols.index("opening_date")]) == "2025-12-01"
+    assert rows["8D-2026-2"][cols.index("eight_d_steps")] == {"D0": {"title": "eski"}}
+    assert str(rows["8D-2026-1"][cols.index("opening_date")]) == "2026-10-17"
+
+    per_report = tmp_path / "per_report.sql"
+    df8d.write_sql(per_report, REPORTS, 0)
+    reset_table(schema)
+    apply_file(schema, per_report)
+    assert table_rows(schema) == applied
+
+
+@pytest.mark.parametrize("argv", [
+    ["--apply", "--batch", "5"],
+    ["--apply", "-o", "out.sql"],
+    ["--bench", "2", "-o", "out.sql"],
+    ["--bench", "0"],
+    ["--dsn", "postgresql://x"],
+])
+def test_conflicting_options_are_rejected(monkeypatch, tmp_path, argv):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("sys.argv", ["parse_df8d_docx_apply.py", "missing.docx", *argv])
+    with pytest.raises(SystemExit) as e:
+        df8d.main()
+    assert e.value.code == 2
+    assert not (tmp_path / "out.sql").exists()
@@ -903,51 +903,96 @@ export const DataProvider = ({ children }) => {
 
             console.log('🔄 Updating', kpis.length, 'auto KPIs...');
 
-            // Her otomatik KPI için RPC çağrısı yap ve güncelle
-            const updatePromises = kpis.map(async (kpi) => {
-                if (!kpi.auto_kpi_id) return null;
+            const updateKpiValue = async (kpi, value) => {
+                const { error: updateError } = await supabase
+                    .from('kpis')
+                    .update({ current_value: value, updated_at: new Date().toISOString() })
+                    .eq('id', kpi.id);
 
-                // kpi-definitions'dan RPC adını bul
-                const rpcName = getRpcNameFromAutoKpiId(kpi.auto_kpi_id);
-                if (!rpcName) return null;
+                if (updateError) {
+                    console.warn(`⚠️ KPI ${kpi.name} update failed:`, updateError.message);
+                    return null;
+                }
 
-                try {
-                    const { data: rpcData, error: rpcError } = await supabase.rpc(rpcName);
+                return { id: kpi.id, name: kpi.name, value };
+            };
 
-                    if (rpcError) {
-                        console.warn(`⚠️ RPC ${rpcName} failed:`, rpcError.message);
-                        return null;
-                    }
+            // Tüm get_* RPC'leri tek çağrıda: current_value her RPC'nin kendi penceresidir
+            // (son 30 gün, tüm zamanlar, anlık); takvim ayı değerleri kpi_monthly_data'dadır.
+            const rpcs = {};
+            kpis.forEach((kpi) => {
+                const rpcName = kpi.auto_kpi_id && getRpcNameFromAutoKpiId(kpi.auto_kpi_id);
+                if (rpcName) rpcs[kpi.auto_kpi_id] = rpcName;
+            });
+            const { data: snapshot, error: snapshotError } = await supabase.rpc('kpi_current_snapshot', {
+                p_rpcs: rpcs,
+            });
 
-                    // KPI'ı güncelle
-                    const { error: updateError } = await supabase
-                        .from('kpis')
-                        .update({ current_value: rpcData, updated_at: new Date().toISOString() })
-                        .eq('id', kpi.id);
+            let updatePromises;
+            if (!snapshotError && snapshot) {
+                updatePromises = kpis.map(async (kpi) => {
+                    const value = snapshot[kpi.auto_kpi_id];
+                    if (value === undefined) return null;
+
+                    // Değişmeyen değer yeniden yazılmaz (Number(null) 0 olduğundan null ayrıca karşılaştırılır)
+                    const unchanged = value === null || kpi.current_value == null
+                        ? value === null && kpi.current_value == null
+                        : Number(kpi.current_value) === Number(value);
+                    if (unchanged) {
+                        return { id: kpi.id, name: kpi.name, value };
+                    }
 
-                    if (updateError) {
-                        console.warn(`⚠️ KPI ${kpi.name} update failed:`, updateError.message);
+                    try {
+                        return await updateKpiValue(kpi, value);
+                    } catch (err) {
+                        console.warn(`⚠️ Error updating KPI ${kpi.name}:`, err);
                         return null;
                     }
+                });
+            } else {
+                // Snapshot RPC'si henüz yoksa KPI başına RPC çağrısı yap ve güncelle
+                console.warn('⚠️ kpi_current_snapshot unavailable, falling back to per-KPI RPCs:', snapshotError?.message);
+                updatePromises = kpis.map(async (kpi) => {
+                    if (!kpi.auto_kpi_id) return null;
+
+                    // kpi-definitions'dan RPC adını bul
+                    const rpcName = getRpcNameFromAutoKpiId(kpi.auto_kpi_id);
+                    if (!rpcName) return null;
+
+                    try {
+                        const { data: rpcData, error: rpcError } = await supabase.rpc(rpcName);
+
+                        if (rpcError) {
+                            console.warn(`⚠️ RPC ${rpcName} failed:`, rpcError.message);
+                            return null;
+                        }
 
-                    return { id: kpi.id, name: kpi.name, value: rpcData };
-                } catch (err) {
-                    console.warn(`⚠️ Error updating KPI ${kpi.name}:`, err);
-                    return null;
-                }
-            });
+                        return await updateKpiValue(kpi, rpcData);
+                    } catch (err) {
+                        console.warn(`⚠️ Error updating KPI ${kpi.name}:`, err);
+                        return null;
+                    }
+                });
+            }
 
             const results = await Promise.all(updatePromises);
             const successCount = results.filter(r => r !== null).length;
             console.log('✅ Auto KPIs updated:', successCount, 'of', kpis.length);
 
-            // Aylık trend verilerini otomatik backfill et (13 ay geçmiş)
+            // Aylık trend verilerini otomatik backfill et (13 ay geçmiş).
+            // Sunucu tek uçuşludur: taze sonuç ya da süren koşu varsa yeniden hesaplamaz.
             try {
-                const { error: backfillError } = await supabase.rpc('backfill_kpi_monthly_data', { p_months_back: 13 });
+                const { data: backfillResult, error: backfillError } = await supabase.rpc('backfill_kpi_monthly_data', { p_months_back: 13 });
                 if (backfillError) {
                     console.warn('⚠️ KPI monthly backfill failed:', backfillError.message);
                 } else {
-                    console.log('✅ KPI monthly trend data backfilled');
+                    console.log(backfillResult?.ran ? '✅ KPI monthly trend data backfilled' : '✅ KPI monthly trend data already fresh', {
+                        inserted: backfillResult?.inserted,
+                        updated: backfillResult?.updated,
+                        unchanged: backfillResult?.unchanged,
+                        coalesced: backfillResult?.coalesced,
+                        dataAgeSeconds: backfillResult?.data_age_seconds,
+                    });
                 }
             } catch (backfillErr) {
                 console.warn('⚠️ KPI monthly backfill error:', backfillErr);